@@ -1,15 +1,30 @@
+import asyncio
+import base64
 import json
 import logging
+import threading
 from datetime import datetime
 
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
-from tell.client import CaptioningClient
+from tell.client import AsyncCaptioningClient
 
 from .extractor import ExtractError, extract_article, get_urls
 
-client = CaptioningClient(ip='localhost', port=5558, port_out=5559)
+
+async def connect():
+    # The demo is interactive, so it shouldn't wait behind bulk requests
+    client = AsyncCaptioningClient(ip='localhost', port=5558, port_out=5559,
+                                   priority='high')
+    await client.connect()
+    return client
+
+# All request threads share one client, which lives in its own event loop.
+# Each view waits for its own request, so many users can be served at once.
+loop = asyncio.new_event_loop()
+threading.Thread(target=loop.run_forever, daemon=True).start()
+client = asyncio.run_coroutine_threadsafe(connect(), loop).result()
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
@@ -49,11 +64,16 @@ def post_caption(request):
     query = json.loads(request.body)
 
     article = extract_article(query['sections'], query['title'], query['pos'])
-    output = client.parse([article])[0]
+    output = asyncio.run_coroutine_threadsafe(
+        client.parse([article]), loop).result()[0]
     output['caption'] = ''.join([a['tokens'] for a in output['attns']])
 
     logger.info(f"Caption for {query['pos']}: {output['caption']}")
 
+    # The binary protocol returns the raw JPEG
+    if isinstance(output['image'], bytes):
+        output['image'] = base64.b64encode(output['image']).decode()
+
     data = {
         'title': article['title'],
         'image_url': article['image_url'],
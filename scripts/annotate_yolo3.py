@@ -18,6 +18,8 @@ Options:
     --device DEV        Device ID (i.e. 0 or 0,1) or cpu [default: 0].
     --agnostic-nms      Class-agnostic NMS.
     --dataset DATASET   Dataset [default: nytimes].
+    --feature-dir DIR   Also store the object features as float16 in a
+                        memory-mapped FeatureStore in this directory.
 
 """
 import os
@@ -26,6 +28,7 @@ import time
 from pathlib import Path
 
 import cv2
+import numpy as np
 import ptvsd
 import torch
 from docopt import docopt
@@ -35,6 +38,7 @@ from schema import And, Or, Schema, Use
 from torchvision.transforms import Compose, Normalize, ToTensor
 from tqdm import tqdm
 
+from tell.data.stores import FeatureStoreWriter
 from tell.models.resnet import resnet152
 from tell.utils import setup_logger
 from tell.yolov3.models import Darknet, attempt_download, load_darknet_weights
@@ -85,6 +89,10 @@ def detect(opt):
 
     dataset = LoadImages(source, img_size=img_size)
 
+    writer = None
+    if opt['feature_dir']:
+        writer = FeatureStoreWriter(opt['feature_dir'], row_shape=[2048])
+
     # Get names and colors
     names = load_classes(opt['names'])
     colors = [[random.randint(0, 255) for _ in range(3)]
@@ -120,7 +128,12 @@ def detect(opt):
         filename = str(Path(p).name)
         basename, ext = os.path.splitext(filename)
 
-        if db.objects.find_one({'_id': basename}):
+        obj = db.objects.find_one({'_id': basename})
+        if obj is not None:
+            # Objects detected in an earlier run still go to the sidecar
+            if writer is not None and basename not in writer:
+                writer.add(basename, np.array(
+                    obj['object_features']).reshape(-1, 2048))
             continue
 
         save_path = str(Path(out_dir) / filename)
@@ -158,6 +171,11 @@ def detect(opt):
         # Save results (image with detections)
         cv2.imwrite(save_path, im0)
 
+        if writer is not None:
+            writer.add(basename, np.array(obj_feats).reshape(-1, 2048))
+            if len(writer.index) % 1000 == 0:
+                writer.flush()
+
         db.objects.insert_one({
             '_id': basename,
             'object_features': obj_feats,
@@ -165,6 +183,9 @@ def detect(opt):
             'classes': classes,
         })
 
+    if writer is not None:
+        writer.close()
+
     elapsed = (time.time() - t0) / 3600
     logger.info(f'Done. Results saved to {out_dir}. Object detection takes '
                 f'{elapsed:.1f} hours.')
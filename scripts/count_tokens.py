@@ -0,0 +1,96 @@
+"""Store the number of RoBERTa BPE tokens of each paragraph in the database.
+
+The dataset readers use these counts to choose the context paragraphs of
+each image without running BPE on every paragraph.
+
+Usage:
+    count_tokens.py [options]
+
+Options:
+    -p --ptvsd PORT     Enable debug mode with ptvsd on PORT, e.g. 5678.
+    -h --host HOST      MongoDB host [default: localhost].
+    -f --force          Recount articles that already have token counts.
+
+"""
+
+import ptvsd
+from docopt import docopt
+from pymongo import MongoClient, UpdateOne
+from schema import And, Or, Schema, Use
+from tqdm import tqdm
+
+from tell.utils import setup_logger
+from tell.utils.roberta import get_roberta_bpe
+
+logger = setup_logger()
+
+
+def validate(args):
+    """Validate command line arguments."""
+    args = {k.lstrip('-').lower().replace('-', '_'): v
+            for k, v in args.items()}
+    schema = Schema({
+        'ptvsd': Or(None, And(Use(int), lambda port: 1 <= port <= 65535)),
+        'host': str,
+        'force': bool,
+    })
+    args = schema.validate(args)
+    return args
+
+
+def count_tokens(bpe, text):
+    # This matches NYTimesFacesNERMatchedReader.to_token_ids
+    return len(bpe.encode(text).split())
+
+
+def get_update(article, bpe):
+    update = {}
+    if 'main' in article['headline']:
+        title = article['headline']['main'].strip()
+        update['headline.n_tokens'] = count_tokens(bpe, title)
+
+    for i, section in enumerate(article['parsed_section']):
+        n_tokens = 0
+        if section['type'] == 'paragraph':
+            n_tokens = count_tokens(bpe, section['text'])
+        update[f'parsed_section.{i}.n_tokens'] = n_tokens
+
+    return UpdateOne({'_id': article['_id']}, {'$set': update})
+
+
+def main():
+    args = docopt(__doc__, version='0.0.1')
+    args = validate(args)
+
+    if args['ptvsd']:
+        address = ('0.0.0.0', args['ptvsd'])
+        ptvsd.enable_attach(address)
+        ptvsd.wait_for_attach()
+
+    bpe, _ = get_roberta_bpe()
+
+    client = MongoClient(host=args['host'], port=27017)
+    db = client.nytimes
+
+    query = {}
+    if not args['force']:
+        query = {'parsed_section.n_tokens': {'$exists': False}}
+
+    article_cursor = db.articles.find(query, projection=[
+        '_id', 'headline', 'parsed_section.type', 'parsed_section.text'],
+        no_cursor_timeout=True).batch_size(128)
+
+    updates = []
+    for article in tqdm(article_cursor):
+        updates.append(get_update(article, bpe))
+        if len(updates) == 1000:
+            db.articles.bulk_write(updates, ordered=False)
+            updates = []
+
+    if updates:
+        db.articles.bulk_write(updates, ordered=False)
+    article_cursor.close()
+
+
+if __name__ == '__main__':
+    main()
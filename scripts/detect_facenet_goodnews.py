@@ -8,10 +8,14 @@ Options:
     -d --image-dir DIR  Image directory [default: ./data/goodnews/images].
     -f --face-dir DIR   Image directory [default: ./data/goodnews/facenet].
     -h --host HOST      Mongo host name [default: localhost]
+    -e --feature-dir DIR
+                        Also store the face embeddings as float16 in a
+                        memory-mapped FeatureStore in this directory.
 
 """
 import os
 
+import numpy as np
 import ptvsd
 import torch
 from docopt import docopt
@@ -21,6 +25,7 @@ from pymongo.errors import DocumentTooLarge
 from schema import And, Or, Schema, Use
 from tqdm import tqdm
 
+from tell.data.stores import FeatureStoreWriter
 from tell.facenet import MTCNN, InceptionResnetV1
 from tell.utils import setup_logger
 
@@ -36,13 +41,16 @@ def validate(args):
         'image_dir': str,
         'face_dir': str,
         'host': str,
+        'feature_dir': Or(None, str),
     })
     args = schema.validate(args)
     return args
 
 
-def detect_faces(sample, goodnews, image_dir, face_dir, mtcnn, resnet):
+def detect_faces(sample, goodnews, image_dir, face_dir, mtcnn, resnet,
+                 writer=None):
     if 'facenet_details' in sample:
+        add_to_store(sample, writer)
         return
 
     image_path = os.path.join(image_dir, f"{sample['_id']}.jpg")
@@ -72,6 +80,8 @@ def detect_faces(sample, goodnews, image_dir, face_dir, mtcnn, resnet):
         'detect_probs': probs.tolist()[:10],
     }
 
+    add_to_store(sample, writer)
+
     try:
         goodnews.splits.find_one_and_update(
             {'_id': sample['_id']}, {'$set': sample})
@@ -79,6 +89,12 @@ def detect_faces(sample, goodnews, image_dir, face_dir, mtcnn, resnet):
         logger.warning(f"Document too large: {sample['_id']}")
 
 
+def add_to_store(sample, writer):
+    if writer is not None and sample['_id'] not in writer:
+        embeddings = sample['facenet_details']['embeddings']
+        writer.add(sample['_id'], np.array(embeddings).reshape(-1, 512))
+
+
 def main():
     args = docopt(__doc__, version='0.0.1')
     args = validate(args)
@@ -102,9 +118,19 @@ def main():
     mtcnn = MTCNN(keep_all=True, device='cuda')
     resnet = InceptionResnetV1(pretrained='vggface2').eval()
 
+    writer = None
+    if args['feature_dir']:
+        writer = FeatureStoreWriter(args['feature_dir'], row_shape=[512])
+
     logger.info('Detecting faces.')
-    for sample in tqdm(sample_cursor):
-        detect_faces(sample, goodnews, image_dir, face_dir, mtcnn, resnet)
+    for i, sample in enumerate(tqdm(sample_cursor)):
+        detect_faces(sample, goodnews, image_dir, face_dir, mtcnn, resnet,
+                     writer)
+        if writer is not None and i % 1000 == 0:
+            writer.flush()
+
+    if writer is not None:
+        writer.close()
 
 
 if __name__ == '__main__':
@@ -9,11 +9,15 @@ Options:
     -f --face-dir DIR   Image directory [default: ./data/nytimes/facenet].
     -b --batch INT      Batch number [default: 1]
     -h --host HOST      Mongo host name [default: localhost]
+    -e --feature-dir DIR
+                        Also store the face embeddings as float16 in a
+                        memory-mapped FeatureStore in this directory.
 
 """
 import os
 from datetime import datetime
 
+import numpy as np
 import ptvsd
 import torch
 from docopt import docopt
@@ -23,6 +27,7 @@ from pymongo.errors import DocumentTooLarge
 from schema import And, Or, Schema, Use
 from tqdm import tqdm
 
+from tell.data.stores import FeatureStoreWriter
 from tell.facenet import MTCNN, InceptionResnetV1
 from tell.utils import setup_logger
 
@@ -39,13 +44,17 @@ def validate(args):
         'face_dir': str,
         'batch': Use(int),
         'host': str,
+        'feature_dir': Or(None, str),
     })
     args = schema.validate(args)
     return args
 
 
-def detect_faces(article, nytimes, image_dir, face_dir, mtcnn, resnet):
+def detect_faces(article, nytimes, image_dir, face_dir, mtcnn, resnet,
+                 writer=None):
     if 'detected_face_positions' in article:
+        if writer is not None:
+            add_to_store(article, writer)
         return
 
     sections = article['parsed_section']
@@ -90,6 +99,9 @@ def detect_faces(article, nytimes, image_dir, face_dir, mtcnn, resnet):
 
     article['n_images_with_faces'] = len(article['detected_face_positions'])
 
+    if writer is not None:
+        add_to_store(article, writer)
+
     try:
         nytimes.articles.find_one_and_update(
             {'_id': article['_id']}, {'$set': article})
@@ -97,6 +109,15 @@ def detect_faces(article, nytimes, image_dir, face_dir, mtcnn, resnet):
         logger.warning(f"Document too large: {article['_id']}")
 
 
+def add_to_store(article, writer):
+    sections = article['parsed_section']
+    for pos in article['detected_face_positions']:
+        key = sections[pos]['hash']
+        if key not in writer and 'facenet_details' in sections[pos]:
+            embeddings = sections[pos]['facenet_details']['embeddings']
+            writer.add(key, np.array(embeddings).reshape(-1, 512))
+
+
 def main():
     args = docopt(__doc__, version='0.0.1')
     args = validate(args)
@@ -130,9 +151,19 @@ def main():
     mtcnn = MTCNN(keep_all=True, device='cuda')
     resnet = InceptionResnetV1(pretrained='vggface2').eval()
 
+    writer = None
+    if args['feature_dir']:
+        writer = FeatureStoreWriter(args['feature_dir'], row_shape=[512])
+
     logger.info('Detecting faces.')
-    for article in tqdm(article_cursor):
-        detect_faces(article, nytimes, image_dir, face_dir, mtcnn, resnet)
+    for i, article in enumerate(tqdm(article_cursor)):
+        detect_faces(article, nytimes, image_dir, face_dir, mtcnn, resnet,
+                     writer)
+        if writer is not None and i % 1000 == 0:
+            writer.flush()
+
+    if writer is not None:
+        writer.close()
 
     # with Parallel(n_jobs=8, backend='threading') as parallel:
     #     parallel(delayed(detect_faces)(article, nytimes, image_dir, face_dir, mtcnn, resnet)
@@ -1,5 +1,11 @@
-from allennlp.models import Model  # avoid segmentation errors on older GPUs
-
-import tell.data
-import tell.models
-import tell.training
+try:
+    from allennlp.models import Model  # avoid segmentation errors on older GPUs
+except ImportError as e:
+    # The exported decoder (tell.runtime) only needs PyTorch. Other import
+    # errors mean that AllenNLP is installed but broken.
+    if e.name != 'allennlp':
+        raise
+else:
+    import tell.data
+    import tell.models
+    import tell.training
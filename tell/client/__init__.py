@@ -1,2 +1,3 @@
+from .aio import AsyncTellClient
 from .base import TellClient
-from .caption import CaptioningClient
+from .caption import AsyncCaptioningClient, CaptioningClient
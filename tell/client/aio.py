@@ -0,0 +1,224 @@
+import asyncio
+import itertools
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import zmq
+import zmq.asyncio
+from zmq.utils import jsonapi
+
+from tell.server.protocol import JSON, PROTOCOLS, load_items
+
+from .base import TellClient, __version__
+
+
+class AsyncTellClient:
+    def __init__(self, ip='localhost', port=5555, port_out=5556, identity=None,
+                 timeout=-1, protocol=None, priority='normal'):
+        """Create an asyncio client for the Tell Server.
+
+        Every request returns an awaitable, so we can have many requests in
+        flight over the same connection. A single task receives all
+        responses and hands each one to the request that waits for it, so
+        the client is safe to use from many coroutines at once. The client
+        must be created and used in the same event loop.
+
+        Parameters
+        ----------
+        ip : str
+            The IP address of the server.
+        port: int
+            The port to push data from client to server.
+        port_out: int
+            The port for receiving results from server.
+        identity: str
+            The UUID of this client.
+        timeout : int
+            The default timeout (in milliseconds) of each request. -1 means
+            no timeout and wait until result returns.
+        protocol : str
+            Either 'json' or 'msgpack'. By default, we pick the best protocol
+            that both sides support when connecting.
+        priority : str
+            Either 'high' or 'normal'. We can override this in each call to
+            parse.
+
+        Examples
+        --------
+        We can use this as an asynchronous context manager, which checks the
+        server and closes the client once we're done parsing
+            async with AsyncTellClient() as tc:
+                outputs = await asyncio.gather(tc.parse(a), tc.parse(b))
+        """
+        self.context = zmq.asyncio.Context()
+        self.sender = self.context.socket(zmq.PUSH)
+        # Don't linger around when the socket has been closed
+        self.sender.setsockopt(zmq.LINGER, 0)
+        self.identity = identity or str(uuid.uuid4()).encode('ascii')
+        self.sender.connect(f'tcp://{ip}:{port}')
+
+        self.receiver = self.context.socket(zmq.SUB)
+        self.receiver.setsockopt(zmq.LINGER, 0)
+        self.receiver.setsockopt(zmq.SUBSCRIBE, self.identity)
+        self.receiver.connect(f'tcp://{ip}:{port_out}')
+
+        self.request_ids = itertools.count(1)
+        self.timeout = timeout
+        # The future of each pending request, or the queue of each streamed
+        # request
+        self.waiters: Dict[int, Any] = {}
+        self.receive_task = None
+        self.port = port
+        self.port_out = port_out
+        self.ip = ip
+        self.requested_protocol = protocol
+        self.protocol = protocol.encode('ascii') if protocol else JSON
+        self.priority = TellClient._get_priority(priority)
+
+    async def connect(self, verbose=False):
+        """Check the server version and pick the protocol."""
+        server_status = await self.server_status()
+        self.protocol = TellClient._check_server(server_status,
+                                                 self.requested_protocol)
+        if self.protocol not in PROTOCOLS:
+            raise AttributeError(f'The client does not support the '
+                                 f'{self.protocol.decode()} protocol. Is '
+                                 f'msgpack installed?')
+        if verbose:
+            TellClient._print_dict(server_status, 'Server config:')
+
+    def close(self):
+        """Close all connections of the client.
+
+        This is automatically called if we use the context manager syntax.
+        Requests that are still pending are cancelled.
+        """
+        if self.receive_task:
+            self.receive_task.cancel()
+        for waiter in self.waiters.values():
+            if isinstance(waiter, asyncio.Future) and not waiter.done():
+                waiter.cancel()
+        self.waiters.clear()
+        self.sender.close()
+        self.receiver.close()
+        self.context.term()
+
+    async def _receive(self):
+        try:
+            while True:
+                response = await self.receiver.recv_multipart()
+                waiter = self.waiters.get(int(response[-1]))
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(response)
+                elif waiter is not None and not waiter.done():
+                    waiter.set_result(response)
+                # Otherwise the request has timed out or was cancelled
+        except Exception as e:
+            # Fail every pending request, including the streamed ones
+            for waiter in self.waiters.values():
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(e)
+                elif not waiter.done():
+                    waiter.set_exception(e)
+            raise
+
+    def _start_receiving(self):
+        if self.receive_task is None or self.receive_task.done():
+            self.receive_task = asyncio.ensure_future(self._receive())
+
+    async def _request(self, msg, msg_len=0, frames=(), priority=None,
+                       timeout=None):
+        request_id = next(self.request_ids)
+        future = asyncio.get_event_loop().create_future()
+        self.waiters[request_id] = future
+        self._start_receiving()
+        try:
+            await self.sender.send_multipart(TellClient._make_request(
+                self.identity, request_id, msg, msg_len, frames,
+                priority or self.priority), copy=False)
+            return await self._wait(future, timeout)
+        finally:
+            self.waiters.pop(request_id, None)
+
+    async def _wait(self, awaitable, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(
+                awaitable, timeout / 1000 if timeout >= 0 else None)
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(
+                f'No response from the server (with "timeout"={timeout} ms), '
+                f'please check the following: Is the server still online? Is '
+                f'the network broken? Are "port" and "port_out" correct? Are '
+                f'you encoding a huge amount of data whereas the timeout is '
+                f'too small for that?') from e
+
+    @property
+    def status(self):
+        """Get the status of this client."""
+        return {
+            'identity': self.identity,
+            'num_pending_request': len(self.waiters),
+            'port': self.port,
+            'port_out': self.port_out,
+            'server_ip': self.ip,
+            'client_version': __version__,
+            'timeout': self.timeout,
+            'protocol': self.protocol.decode('ascii'),
+            'priority': self.priority.decode('ascii').lower(),
+        }
+
+    async def server_status(self, timeout=None):
+        """Get the current status of the server connected to this client."""
+        response = await self._request(b'SHOW_CONFIG', timeout=timeout)
+        return jsonapi.loads(response[1])
+
+    async def parse(self, texts, priority=None, timeout=None) -> List[Any]:
+        """Parse a list of texts.
+
+        `timeout` (in milliseconds) overrides the timeout of the client for
+        this request.
+        """
+        priority = priority and TellClient._get_priority(priority)
+        msg, frames = TellClient._encode_items(texts, self.protocol)
+        response = await self._request(msg, len(texts), frames, priority,
+                                       timeout)
+        return TellClient._load_items(response)
+
+    async def parse_stream(self, texts, priority=None,
+                           timeout=None) -> AsyncIterator[Tuple[int, List[Any]]]:
+        """Parse texts and yield the results of each part once it's ready.
+
+        We yield the position of the first text of each part and the results
+        of the part, in the order that the parts finish. `timeout` applies to
+        each part.
+        """
+        priority = priority and TellClient._get_priority(priority)
+        msg, frames = TellClient._encode_items(texts, self.protocol)
+        request_id = next(self.request_ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self.waiters[request_id] = queue
+        self._start_receiving()
+        try:
+            await self.sender.send_multipart(TellClient._make_request(
+                self.identity, request_id, msg, len(texts), frames,
+                priority or self.priority, stream=True), copy=False)
+            n_left = len(texts)
+            while n_left > 0:
+                response = await self._wait(queue.get(), timeout)
+                if isinstance(response, Exception):
+                    raise response
+                # response == [client_id, PARTIAL, protocol, start, *frames,
+                #              request_id]
+                outputs = load_items(response[4:-1], response[2])
+                n_left -= len(outputs)
+                yield int(response[3]), outputs
+        finally:
+            self.waiters.pop(request_id, None)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,10 +1,13 @@
 import uuid
-from collections import namedtuple
+from collections import defaultdict, deque, namedtuple
 from functools import wraps
 
 import zmq
 from zmq.utils import jsonapi
 
+from tell.server.protocol import JSON, MSGPACK, PROTOCOLS, dump_items, load_items
+from tell.server.utils import Priority
+
 # Client version must match server version
 __version__ = '0.0.1'
 
@@ -13,7 +16,8 @@ _Response = namedtuple('_Response', ['id', 'content'])
 
 class TellClient:
     def __init__(self, ip='localhost', port=5555, port_out=5556, identity=None,
-                 ignore_checks=False, timeout=-1, verbose=False):
+                 ignore_checks=False, timeout=-1, verbose=False,
+                 protocol=None, priority='normal'):
         """Create a client for the Tell Server.
 
         This creates a client that connects to a Tell Server. The server must
@@ -35,6 +39,16 @@ class TellClient:
         timeout : int
             Set the timeout (in milliseconds) for receiving operation on the
             client. -1 means no timeout and wait until result returns.
+        protocol : str
+            Either 'json' or 'msgpack'. With msgpack, images and arrays are
+            sent as raw bytes instead of base64 strings in JSON. By default,
+            we use msgpack if both the client and the server support it.
+            Without the server checks, we default to JSON.
+        priority : str
+            Either 'high' or 'normal'. The server serves high priority
+            requests first, e.g. interactive ones, and makes normal requests
+            wait until a worker is free. We can override this in each call to
+            parse.
 
         Examples
         --------
@@ -62,22 +76,27 @@ class TellClient:
         self.request_id = 0
         self.timeout = timeout
         self.pending_request = set()
-        # When we receive responses out-of-order, store them in a buffer
-        self.pending_response = {}
+        # When we receive responses out-of-order, store them in a buffer.
+        # Streamed requests have several responses.
+        self.pending_response = defaultdict(deque)
+        # Streamed requests that we stopped reading early. We drop the parts
+        # that arrive after that.
+        self.abandoned_request = set()
         self.port = port
         self.port_out = port_out
         self.ip = ip
+        self.protocol = protocol.encode('ascii') if protocol else JSON
+        self.priority = self._get_priority(priority)
 
         if not ignore_checks:
             sever_status = self.server_status
-            server_version = sever_status['server_version']
-            client_version = self.status['client_version']
-            if server_version != client_version:
-                raise AttributeError(f'Version mismatch! server version is '
-                                     f'{server_version} but client version is '
-                                     f'{client_version}.')
+            self.protocol = self._check_server(sever_status, protocol)
             if verbose:
                 self._print_dict(sever_status, 'Server config:')
+        if self.protocol not in PROTOCOLS:
+            raise AttributeError(f'The client does not support the '
+                                 f'{self.protocol.decode()} protocol. Is '
+                                 f'msgpack installed?')
 
     def close(self):
         """Close all connections of the client gracefully.
@@ -88,37 +107,99 @@ class TellClient:
         self.receiver.close()
         self.context.term()
 
-    def _send(self, msg, msg_len=0):
+    @staticmethod
+    def _check_server(server_status, protocol=None):
+        """Check the server version and pick the protocol."""
+        server_version = server_status['server_version']
+        if server_version != __version__:
+            raise AttributeError(f'Version mismatch! server version is '
+                                 f'{server_version} but client version is '
+                                 f'{__version__}.')
+
+        # Old servers don't list their protocols and only speak JSON
+        server_protocols = server_status.get('protocols', ['json'])
+        if protocol is None:
+            use_msgpack = MSGPACK in PROTOCOLS and \
+                'msgpack' in server_protocols
+            protocol = 'msgpack' if use_msgpack else 'json'
+        if protocol not in server_protocols:
+            raise AttributeError(f'The server does not support the '
+                                 f'{protocol} protocol.')
+        return protocol.encode('ascii')
+
+    @staticmethod
+    def _make_request(identity, request_id, msg, msg_len=0, frames=(),
+                      priority=Priority.normal, stream=False):
+        return [identity, msg, b'%d' % request_id, b'%d' % msg_len,
+                priority, b'1' if stream else b'0', *frames]
+
+    @staticmethod
+    def _encode_items(items, protocol):
+        if protocol == MSGPACK:
+            # The payload follows the usual frames
+            return MSGPACK, dump_items(items)
+        return jsonapi.dumps(items), []
+
+    def _send(self, msg, msg_len=0, frames=(), priority=Priority.normal,
+              stream=False):
         self.request_id += 1
         self.sender.send_multipart(
-            [self.identity, msg, b'%d' % self.request_id, b'%d' % msg_len])
+            self._make_request(self.identity, self.request_id, msg, msg_len,
+                               frames, priority, stream), copy=False)
         self.pending_request.add(self.request_id)
         return self.request_id
 
-    def _recv(self, wait_for_req_id=None):
+    def _send_items(self, items, priority=None, stream=False):
+        priority = self._get_priority(priority) if priority else self.priority
+        msg, frames = self._encode_items(items, self.protocol)
+        return self._send(msg, len(items), frames, priority, stream)
+
+    @staticmethod
+    def _get_priority(priority):
+        priority = priority.upper().encode('ascii')
+        if priority not in Priority.lanes:
+            raise ValueError(f'Unknown priority {priority.decode()}. Use one '
+                             f'of {[p.decode().lower() for p in Priority.lanes]}.')
+        return priority
+
+    @staticmethod
+    def _load_items(response):
+        # JSON: [client_id, output, request_id]
+        # msgpack: [client_id, b'msgpack', *frames, request_id]
+        if response[1] == MSGPACK:
+            return load_items(response[2:-1])
+        return jsonapi.loads(response[1])
+
+    def _recv(self, wait_for_req_id=None, keep_pending=False):
         try:
             while True:
                 # a request has been returned and found in pending_response
                 if wait_for_req_id in self.pending_response:
-                    response = self.pending_response.pop(wait_for_req_id)
+                    responses = self.pending_response[wait_for_req_id]
+                    response = responses.popleft()
+                    if not responses:
+                        del self.pending_response[wait_for_req_id]
                     return _Response(wait_for_req_id, response)
 
                 # receive a response
                 response = self.receiver.recv_multipart()
                 request_id = int(response[-1])
+                if request_id in self.abandoned_request:
+                    continue
 
                 # if not wait for particular response then simply return
                 if not wait_for_req_id or (wait_for_req_id == request_id):
-                    self.pending_request.remove(request_id)
+                    if not keep_pending:
+                        self.pending_request.discard(request_id)
                     return _Response(request_id, response)
                 elif wait_for_req_id != request_id:
-                    self.pending_response[request_id] = response
+                    self.pending_response[request_id].append(response)
                     # wait for the next response
         except Exception as e:
             raise e
         finally:
-            if wait_for_req_id in self.pending_request:
-                self.pending_request.remove(wait_for_req_id)
+            if not keep_pending:
+                self.pending_request.discard(wait_for_req_id)
 
     def _timeout(func):  # pylint: disable=no-self-argument
         @wraps(func)
@@ -162,7 +243,9 @@ class TellClient:
             'port_out': self.port_out,
             'server_ip': self.ip,
             'client_version': __version__,
-            'timeout': self.timeout
+            'timeout': self.timeout,
+            'protocol': self.protocol.decode('ascii'),
+            'priority': self.priority.decode('ascii').lower(),
         }
 
     @property  # type: ignore
@@ -180,23 +263,49 @@ class TellClient:
         return jsonapi.loads(self._recv(req_id).content[1])
 
     @_timeout
-    def parse(self, texts, blocking=True, **kwargs):
+    def parse(self, texts, blocking=True, priority=None, **kwargs):
         """Parse a text.
 
         Overwrite this method in subclasses for different NLP tasks.
         """
-        request_id = self._send(jsonapi.dumps(texts), len(texts))
+        request_id = self._send_items(texts, priority)
         if not blocking:
             return request_id
         request_id, response = self._recv(request_id)
-        client_id, output, request_id = response
-        return jsonapi.loads(output)
+        return self._load_items(response)
 
     @_timeout
     def fetch(self, request_id):
         request_id, response = self._recv(request_id)
-        client_id, output, request_id = response
-        return jsonapi.loads(output)
+        return self._load_items(response)
+
+    def parse_stream(self, texts, priority=None):
+        """Parse texts and yield the results of each part once it's ready.
+
+        The server splits large requests into parts of at most
+        ``max_batch_size`` texts. We yield the position of the first text of
+        each part and the results of the part, in the order that the parts
+        finish.
+        """
+        request_id = self._send_items(texts, priority, stream=True)
+        n_left = len(texts)
+        try:
+            while n_left > 0:
+                start, outputs = self._recv_part(request_id)
+                n_left -= len(outputs)
+                yield start, outputs
+        finally:
+            if n_left > 0:
+                self.abandoned_request.add(request_id)
+            self.pending_request.discard(request_id)
+            self.pending_response.pop(request_id, None)
+
+    @_timeout
+    def _recv_part(self, request_id):
+        request_id, response = self._recv(request_id, keep_pending=True)
+        # response == [client_id, PARTIAL, protocol, start, *frames,
+        #              request_id]
+        return int(response[3]), load_items(response[4:-1], response[2])
 
     @staticmethod
     def _print_dict(x, title=None):
@@ -1,18 +1,31 @@
 from overrides import overrides
-from zmq.utils import jsonapi
 
+from .aio import AsyncTellClient
 from .base import TellClient
 
 
 class CaptioningClient(TellClient):
     @overrides
     @TellClient._timeout
-    def parse(self, inputs, **kwargs):
-        """Parse a text.
+    def parse(self, inputs, priority=None, **kwargs):
+        """Caption the images of articles.
 
-        Overwrite this method in subclasses for different NLP tasks.
+        With the msgpack protocol, the 'image_data' of the sections and the
+        'image' of the outputs are raw bytes. With JSON, they are base64
+        strings.
         """
-        request_id = self._send(jsonapi.dumps(inputs), len(inputs))
+        request_id = self._send_items(inputs, priority)
         request_id, response = self._recv(request_id)
-        client_id, output, request_id = response
-        return jsonapi.loads(output)
+        return self._load_items(response)
+
+
+class AsyncCaptioningClient(AsyncTellClient):
+    @overrides
+    async def parse(self, inputs, priority=None, timeout=None):
+        """Caption the images of articles.
+
+        With the msgpack protocol, the 'image_data' of the sections and the
+        'image' of the outputs are raw bytes. With JSON, they are base64
+        strings.
+        """
+        return await super().parse(inputs, priority, timeout)
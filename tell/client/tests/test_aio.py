@@ -0,0 +1,176 @@
+import asyncio
+import unittest
+
+import zmq
+from zmq.utils import jsonapi
+
+from tell.client.aio import AsyncTellClient
+from tell.server.protocol import JSON
+from tell.server.utils import ServerCmd
+
+
+class FakePushSocket:
+    """The client end of the PUSH/PULL pair. The server pulls the requests."""
+
+    def __init__(self):
+        self.requests = asyncio.Queue()
+
+    async def send_multipart(self, frames, copy=True):
+        self.requests.put_nowait(list(frames))
+
+    def close(self):
+        pass
+
+
+class FakeSubSocket:
+    """The client end of the PUB/SUB pair. The server publishes responses.
+
+    Publishing an exception makes the receiving end fail.
+    """
+
+    def __init__(self):
+        self.responses = asyncio.Queue()
+
+    async def recv_multipart(self):
+        response = await self.responses.get()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+
+def make_client(**kwargs):
+    client = AsyncTellClient(protocol='json', **kwargs)
+    client.sender.close()
+    client.receiver.close()
+    client.sender = FakePushSocket()
+    client.receiver = FakeSubSocket()
+    return client
+
+
+async def pull_request(client):
+    # request == [client_id, msg, request_id, msg_len, priority, stream]
+    request = await client.sender.requests.get()
+    return int(request[2]), jsonapi.loads(request[1])
+
+
+def publish_result(client, req_id, items):
+    client.receiver.responses.put_nowait(
+        [client.identity, jsonapi.dumps(items), b'%d' % req_id])
+
+
+def publish_part(client, req_id, start, items):
+    client.receiver.responses.put_nowait(
+        [client.identity, ServerCmd.data_partial, JSON, b'%d' % start,
+         jsonapi.dumps(items), b'%d' % req_id])
+
+
+def run(test):
+    async def run_with_client():
+        client = make_client()
+        try:
+            await test(client)
+        finally:
+            client.close()
+    asyncio.run(run_with_client())
+
+
+class TestAsyncTellClient(unittest.TestCase):
+    def test_out_of_order_replies(self):
+        async def test(client):
+            texts = [[f'text {i}'] * (i + 1) for i in range(8)]
+            tasks = [asyncio.ensure_future(client.parse(t)) for t in texts]
+            requests = [await pull_request(client) for _ in texts]
+            self.assertEqual(client.status['num_pending_request'], 8)
+
+            for req_id, items in reversed(requests):
+                publish_result(client, req_id, [x.upper() for x in items])
+            outputs = await asyncio.gather(*tasks)
+            self.assertEqual(outputs, [[x.upper() for x in t] for t in texts])
+            self.assertEqual(client.waiters, {})
+
+        run(test)
+
+    def test_late_reply_after_timeout_is_dropped(self):
+        async def test(client):
+            slow = asyncio.ensure_future(client.parse(['a'], timeout=50))
+            fast = asyncio.ensure_future(client.parse(['b']))
+            slow_id, _ = await pull_request(client)
+            fast_id, _ = await pull_request(client)
+
+            with self.assertRaises(TimeoutError):
+                await slow
+            self.assertNotIn(slow_id, client.waiters)
+
+            # The late reply doesn't disturb the other requests
+            publish_result(client, slow_id, ['A'])
+            publish_result(client, fast_id, ['B'])
+            self.assertEqual(await fast, ['B'])
+            self.assertFalse(client.receive_task.done())
+            self.assertEqual(client.waiters, {})
+
+        run(test)
+
+    def test_parse_stream_counts_items(self):
+        async def test(client):
+            texts = ['a', 'b', 'c', 'd', 'e']
+            stream = client.parse_stream(texts, timeout=1000)
+            parts = asyncio.ensure_future(self._collect(stream))
+            req_id, items = await pull_request(client)
+            self.assertEqual(items, texts)
+
+            # The parts finish in any order. The stream ends once it has
+            # the results of every text, without waiting for more.
+            publish_part(client, req_id, 2, ['C', 'D'])
+            publish_part(client, req_id, 0, ['A', 'B'])
+            publish_part(client, req_id, 4, ['E'])
+            self.assertEqual(await parts, [(2, ['C', 'D']), (0, ['A', 'B']),
+                                           (4, ['E'])])
+            self.assertEqual(client.waiters, {})
+
+            # Each part has its own timeout
+            stream = client.parse_stream(texts, timeout=50)
+            first = asyncio.ensure_future(stream.__anext__())
+            req_id, _ = await pull_request(client)
+            publish_part(client, req_id, 0, ['A', 'B', 'C'])
+            self.assertEqual(await first, (0, ['A', 'B', 'C']))
+            with self.assertRaises(TimeoutError):
+                await stream.__anext__()
+            self.assertEqual(client.waiters, {})
+
+        run(test)
+
+    def test_receive_error_fails_every_request(self):
+        async def test(client):
+            tasks = [asyncio.ensure_future(client.parse([f'text {i}']))
+                     for i in range(3)]
+            stream = asyncio.ensure_future(self._collect(
+                client.parse_stream(['a', 'b'], timeout=1000)))
+            for _ in range(4):
+                await pull_request(client)
+
+            error = zmq.ZMQError(zmq.ETERM)
+            client.receiver.responses.put_nowait(error)
+            for task in tasks + [stream]:
+                with self.assertRaises(zmq.ZMQError) as cm:
+                    await task
+                self.assertIs(cm.exception, error)
+            self.assertEqual(client.waiters, {})
+
+            # The next request starts receiving again
+            task = asyncio.ensure_future(client.parse(['x']))
+            req_id, _ = await pull_request(client)
+            publish_result(client, req_id, ['X'])
+            self.assertEqual(await task, ['X'])
+
+        run(test)
+
+    @staticmethod
+    async def _collect(stream):
+        return [part async for part in stream]
+
+
+if __name__ == '__main__':
+    unittest.main()
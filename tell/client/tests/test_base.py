@@ -0,0 +1,94 @@
+import unittest
+
+from zmq.utils import jsonapi
+
+from tell.client.base import TellClient
+from tell.server.protocol import JSON
+from tell.server.utils import ServerCmd
+
+
+class FakeSocket:
+    """Replay the messages that the sink publishes to the client."""
+
+    def __init__(self, messages=()):
+        self.messages = list(messages)
+        self.sent = []
+
+    def send_multipart(self, frames, copy=True):
+        self.sent.append(frames)
+
+    def recv_multipart(self):
+        return self.messages.pop(0)
+
+    def setsockopt(self, option, value):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_client():
+    client = TellClient(ignore_checks=True, protocol='json')
+    client.sender.close()
+    client.receiver.close()
+    client.sender = FakeSocket()
+    client.receiver = FakeSocket()
+    return client
+
+
+def make_part(client, req_id, start, items):
+    return [client.identity, ServerCmd.data_partial, JSON, b'%d' % start,
+            jsonapi.dumps(items), b'%d' % req_id]
+
+
+def make_result(client, req_id, items):
+    return [client.identity, jsonapi.dumps(items), b'%d' % req_id]
+
+
+class TestParseStream(unittest.TestCase):
+    def test_parts_arrive_out_of_order(self):
+        client = make_client()
+        client.receiver.messages = [
+            make_part(client, 2, 2, ['C', 'D']),
+            make_result(client, 1, ['X']),
+            make_part(client, 2, 0, ['A', 'B']),
+        ]
+        req_id = client.parse(['x'], blocking=False)
+        parts = list(client.parse_stream(['a', 'b', 'c', 'd']))
+        self.assertEqual(parts, [(2, ['C', 'D']), (0, ['A', 'B'])])
+        # Only the second request asks the sink to stream the parts
+        self.assertEqual([frames[5] for frames in client.sender.sent],
+                         [b'0', b'1'])
+
+        # The reply to the other request waits for us
+        self.assertEqual(client.fetch(req_id), ['X'])
+        self.assertEqual(client.abandoned_request, set())
+        self.assertEqual(client.pending_request, set())
+        self.assertFalse(client.pending_response)
+        client.close()
+
+    def test_drop_parts_of_abandoned_stream(self):
+        client = make_client()
+        client.receiver.messages = [
+            make_part(client, 1, 0, ['A', 'B']),
+            make_part(client, 1, 2, ['C', 'D']),
+            make_result(client, 2, ['Y']),
+            make_part(client, 1, 4, ['E']),
+            make_result(client, 3, ['Z']),
+        ]
+        stream = client.parse_stream(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(next(stream), (0, ['A', 'B']))
+        stream.close()
+        self.assertEqual(client.abandoned_request, {1})
+        self.assertEqual(client.pending_request, set())
+
+        # The parts that arrive later are neither returned nor kept
+        self.assertEqual(client.parse(['y']), ['Y'])
+        self.assertEqual(client.parse(['z']), ['Z'])
+        self.assertFalse(client.pending_response)
+        self.assertEqual(client.pending_request, set())
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,13 @@
 
 Usage:
     tell (train|evaluate) [options] PARAM_PATH
+    tell extract-image-features [options] PARAM_PATH
+    tell cache-images [options] PARAM_PATH
+    tell extract-article-features [options] PARAM_PATH
+    tell compile-dataset [options] PARAM_PATH
+    tell export-decoder [options] PARAM_PATH
+    tell quantize [options] PARAM_PATH
+    tell benchmark [options] PARAM_PATH
     tell (-h | --help)
     tell (-v | --version)
 
@@ -27,6 +34,23 @@ Options:
     -s --eval-suffix S  Evaluation generation file name [default: ]
     PARAM_PATH          Path to file describing the model parameters.
     -m --model-path PATH Path the the best model.
+    -d --out-dir DIR    Output directory of precomputed features.
+    -b --batch-size INT
+                        Batch size when precomputing features or benchmarking
+                        [default: 64].
+    -l --layers MODE    RoBERTa layers to precompute: last, all, or mixed.
+    -t --split SPLIT    Dataset split to compile [default: train].
+    -z --int8           Evaluate or benchmark with int8 dynamic quantization
+                        on the CPU.
+    -n --n-samples INT  Number of held-out captions used to check the
+                        quantized model [default: 200].
+    --article-len INT   Number of article tokens to benchmark with
+                        [default: 512].
+    --n-faces INT       Number of faces to benchmark with [default: 4].
+    --n-objects INT     Number of objects to benchmark with [default: 16].
+    --gen-len INT       Number of caption tokens to benchmark with
+                        [default: 40].
+    --n-runs INT        Number of timed benchmark runs [default: 10].
 
 Examples:
     tell train -r -g expt/writing-prompts/lstm/config.yaml
@@ -42,7 +66,14 @@ from schema import And, Or, Schema, Use
 
 from tell.utils import setup_logger
 
+from .benchmark import benchmark_from_file
+from .compile_dataset import compile_dataset_from_file
 from .evaluate import evaluate_from_file
+from .export_decoder import export_decoder_from_file
+from .extract_article_features import extract_article_features_from_file
+from .extract_image_features import (cache_images_from_file,
+                                     extract_image_features_from_file)
+from .quantize import quantize_from_file
 from .train import train_model_from_file
 
 logger = setup_logger()
@@ -57,6 +88,13 @@ def validate(args):
         'model_path': Or(None, os.path.exists),
         'ptvsd': Or(None, And(Use(int), lambda port: 1 <= port <= 65535)),
         'eval_suffix': str,
+        'batch_size': Use(int),
+        'n_samples': Use(int),
+        'article_len': Use(int),
+        'n_faces': Use(int),
+        'n_objects': Use(int),
+        'gen_len': Use(int),
+        'n_runs': Use(int),
         object: object,
     })
     args = schema.validate(args)
@@ -96,7 +134,45 @@ def main():
 
     elif args['evaluate']:
         evaluate_from_file(args['param_path'], args['model_path'],
-                           args['overrides'], args['eval_suffix'])
+                           args['overrides'], args['eval_suffix'],
+                           quantize=args['int8'])
+
+    elif args['extract_image_features']:
+        extract_image_features_from_file(args['param_path'], args['out_dir'],
+                                         args['overrides'], args['batch_size'])
+
+    elif args['cache_images']:
+        cache_images_from_file(args['param_path'], args['out_dir'],
+                               args['overrides'])
+
+    elif args['extract_article_features']:
+        extract_article_features_from_file(
+            args['param_path'], args['out_dir'], args['model_path'],
+            args['overrides'], args['layers'], args['batch_size'])
+
+    elif args['compile_dataset']:
+        compile_dataset_from_file(args['param_path'], args['out_dir'],
+                                  args['split'], args['overrides'])
+
+    elif args['export_decoder']:
+        export_decoder_from_file(args['param_path'], args['model_path'],
+                                 args['out_dir'], args['overrides'])
+
+    elif args['quantize']:
+        quantize_from_file(args['param_path'], args['model_path'],
+                           args['out_dir'], args['overrides'],
+                           args['n_samples'])
+
+    elif args['benchmark']:
+        benchmark_from_file(args['param_path'], args['overrides'],
+                            batch_size=args['batch_size'],
+                            article_len=args['article_len'],
+                            n_faces=args['n_faces'],
+                            n_objects=args['n_objects'],
+                            gen_len=args['gen_len'],
+                            n_runs=args['n_runs'],
+                            out_dir=args['out_dir'],
+                            quantize=args['int8'])
 
 
 if __name__ == '__main__':
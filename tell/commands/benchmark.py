@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict
+
+import numpy as np
+import torch
+from allennlp.common.util import prepare_environment
+from allennlp.data.vocabulary import Vocabulary
+from allennlp.models import Model
+
+from tell.modules import quantize_model
+
+from .train import yaml_to_params
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def benchmark_from_file(parameter_filename: str,
+                        overrides: str = '',
+                        batch_size: int = 16,
+                        article_len: int = 512,
+                        n_faces: int = 4,
+                        n_objects: int = 16,
+                        gen_len: int = 40,
+                        n_runs: int = 10,
+                        n_warmup: int = 2,
+                        out_dir: str = None,
+                        quantize: bool = False) -> Dict[str, Any]:
+    """Measure the generation speed of a captioning model.
+
+    The model is built from the config with random weights and fed with
+    synthetic inputs, so this needs neither the database, the images nor
+    spaCy. We time each phase of generation:
+
+    - roberta: encoding the article.
+    - resnet: embedding the image.
+    - decoder_step: one step of the decoder, given the previous token.
+    - softmax: picking the next token from the decoder output.
+    - attention_capture: copying the attention of a step into the buffers.
+    - attention: turning the captured attention into word-level attention.
+    - decode: the whole decoding loop. It always runs for `gen_len` steps,
+      so that runs are comparable.
+    - generate: ``_generate`` as used in evaluation, which stops when all
+      captions have ended.
+
+    Only the first `n_warmup` runs are excluded from the timings. The report
+    is logged as JSON and saved to ``benchmark.json`` in `out_dir`.
+
+    Parameters
+    ----------
+    parameter_filename : ``str``
+        The experiment config. The model must be a
+        ``transformer_faces_objects`` model.
+    batch_size : ``int``
+        Number of captions generated together.
+    article_len : ``int``
+        Number of article tokens, including <s> and </s>.
+    n_faces : ``int``
+        Number of faces in each image.
+    n_objects : ``int``
+        Number of objects in each image.
+    gen_len : ``int``
+        Number of tokens generated in the decoding loop.
+    n_runs : ``int``
+        Number of timed runs.
+    quantize : ``bool``
+        Benchmark the int8 quantized model on the CPU.
+    """
+    config = yaml_to_params(parameter_filename, overrides)
+    prepare_environment(config)
+    vocab = Vocabulary.from_params(config.pop('vocabulary'))
+    model = Model.from_params(vocab=vocab, params=config.pop('model'))
+    model.eval()
+
+    if quantize:
+        quantize_model(model)
+    if torch.cuda.is_available() and not quantize:
+        device = torch.device('cuda')
+    else:
+        device = torch.device('cpu')
+    model.to(device)
+
+    inputs = _make_inputs(model, batch_size, article_len, n_faces, n_objects,
+                          device)
+
+    timer = PhaseTimer(device)
+    n_generated = 0
+    with torch.no_grad():
+        for run in range(n_warmup + n_runs):
+            if run == n_warmup:
+                timer.reset()
+                n_generated = 0
+            n_generated += _run_once(model, inputs, gen_len, timer)
+            logger.info(f'Finished run {run + 1} of {n_warmup + n_runs}.')
+
+    phases = timer.summary()
+    report = {
+        'settings': {
+            'config': parameter_filename,
+            'device': str(device),
+            'quantize': quantize,
+            'batch_size': batch_size,
+            'article_len': article_len,
+            'n_faces': n_faces,
+            'n_objects': n_objects,
+            'gen_len': gen_len,
+            'n_runs': n_runs,
+            'n_warmup': n_warmup,
+        },
+        'phases': phases,
+        'decode_tokens_per_sec': batch_size * gen_len /
+        (phases['decode']['mean_ms'] / 1000),
+        'generate_tokens_per_sec': n_generated /
+        (phases['generate']['total_ms'] / 1000),
+    }
+
+    logger.info(json.dumps(report, indent=4))
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = os.path.join(out_dir, 'benchmark.json')
+        with open(out_path, 'w') as f:
+            json.dump(report, f, indent=4)
+        logger.info(f'Saved the benchmark to {out_path}')
+
+    return report
+
+
+class PhaseTimer:
+    """Collect the wall-clock time of named phases.
+
+    On the GPU we synchronize before and after each phase, so that the time
+    is spent in the phase rather than in whichever phase waits for it.
+    """
+
+    def __init__(self, device: torch.device) -> None:
+        self.device = device
+        self.timings: Dict[str, list] = defaultdict(list)
+
+    @contextmanager
+    def __call__(self, phase: str):
+        self._synchronize()
+        start = time.perf_counter()
+        yield
+        self._synchronize()
+        self.timings[phase].append(time.perf_counter() - start)
+
+    def _synchronize(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def reset(self):
+        self.timings = defaultdict(list)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for phase, timings in self.timings.items():
+            timings = np.array(timings) * 1000
+            summary[phase] = {
+                'n': len(timings),
+                'total_ms': timings.sum(),
+                'mean_ms': timings.mean(),
+                'median_ms': np.median(timings),
+                'p90_ms': np.percentile(timings, 90),
+            }
+        return summary
+
+
+def _make_inputs(model, batch_size, article_len, n_faces, n_objects, device):
+    dictionary = model.roberta.task.source_dictionary
+
+    # We only use real BPE tokens, which the attention post-processing can
+    # decode, i.e. no special or made-up symbols.
+    word_ids = torch.LongTensor([i for i, symbol in enumerate(dictionary.symbols)
+                                 if symbol.isdigit()])
+    is_word = torch.zeros(len(dictionary), dtype=torch.bool)
+    is_word[word_ids] = True
+
+    article_ids = word_ids[torch.randint(
+        len(word_ids), (batch_size, article_len))]
+    article_ids[:, 0] = dictionary.bos()
+    article_ids[:, -1] = dictionary.eos()
+
+    context_attns = model.decoder.layers[0].context_attns
+    return {
+        'article_ids': article_ids.to(device),
+        'image': torch.randn(batch_size, 3, 224, 224, device=device),
+        'faces': torch.randn(batch_size, n_faces,
+                             context_attns['faces'].kdim, device=device),
+        'obj': torch.randn(batch_size, n_objects,
+                           context_attns['obj'].kdim, device=device),
+        'word_ids': word_ids.to(device),
+        'is_word': is_word.to(device),
+    }
+
+
+def _run_once(model, inputs, gen_len, timer):
+    article_ids = inputs['article_ids']
+    B = article_ids.shape[0]
+
+    with timer('roberta'):
+        X_article = model._encode_article(article_ids)
+        # X_article.shape == [batch_size, article_len, embed_size]
+
+    with timer('resnet'):
+        X_image = model._embed_image(inputs['image'])
+        # X_image.shape == [batch_size, 49, 2048]
+
+    faces, obj = inputs['faces'], inputs['obj']
+    contexts = {
+        'image': X_image.transpose(0, 1),
+        'image_mask': X_image.new_zeros(B, X_image.shape[1]).bool(),
+        'article': X_article.transpose(0, 1),
+        'article_mask': article_ids == model.padding_idx,
+        'sections': None,
+        'sections_mask': None,
+        'faces': faces.transpose(0, 1),
+        'faces_mask': faces.new_zeros(B, faces.shape[1]).bool(),
+        'obj': obj.transpose(0, 1),
+        'obj_mask': obj.new_zeros(B, obj.shape[1]).bool(),
+    }
+
+    incremental_state: Dict[str, Any] = {}
+    prev_ids = article_ids.new_zeros(B, 1)
+    token_list = [prev_ids]
+    attn_buffers: Dict[Any, torch.Tensor] = {}
+    rows = article_ids.new_ones(B, dtype=torch.bool)
+
+    model._set_attn_capture(True, all_attns=True)
+    try:
+        with timer('decode'):
+            for i in range(gen_len):
+                with timer('decoder_step'):
+                    decoder_out = model.decoder(
+                        {model.index: prev_ids}, contexts,
+                        incremental_state=incremental_state)
+
+                with timer('softmax'):
+                    _, prev_ids = model._sample_next(decoder_out)
+                    # prev_ids.shape == [batch_size, 1]
+
+                with timer('attention_capture'):
+                    model._capture_step_attns(attn_buffers, i, rows,
+                                              decoder_out, gen_len)
+
+                token_list.append(prev_ids)
+    finally:
+        model._set_attn_capture(False)
+
+    with timer('attention'):
+        # The random weights can generate special tokens, which
+        # get_word_attns can't decode.
+        token_ids = torch.cat(token_list, dim=1)
+        is_word = inputs['is_word'][token_ids.clamp(
+            max=len(inputs['is_word']) - 1)]
+        token_ids[:, 1:] = torch.where(
+            is_word[:, 1:], token_ids[:, 1:], inputs['word_ids'][0])
+
+        attns = model._collect_attns(attn_buffers, gen_len)
+        attn_tensors = model.get_attn_tensors(attns)
+        for i, caption_ids in enumerate(token_ids.tolist()):
+            model.get_word_attns(
+                article_ids[i], caption_ids,
+                {modal: attn[i] for modal, attn in attn_tensors.items()})
+
+    with timer('generate'):
+        _, gen_ids, _ = model._generate(article_ids.new_zeros(B, 1), contexts,
+                                        capture_attns=True, all_attns=True)
+
+    return (gen_ids[:, 1:] != model.padding_idx).sum().item()
@@ -0,0 +1,53 @@
+import logging
+import os
+
+from allennlp.data.dataset_readers.dataset_reader import DatasetReader
+from tqdm import tqdm
+
+from tell.data.stores import RecordWriter, get_image_key
+
+from .train import yaml_to_params
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def compile_dataset_from_file(parameter_filename: str,
+                              out_dir: str,
+                              split: str = 'train',
+                              overrides: str = '') -> None:
+    """Materialise one split of a dataset into sharded record files.
+
+    We run the dataset reader of the config once, against MongoDB and the
+    image directory, and store the inputs of every instance together with the
+    bytes of its (already resized) image. The ``nytimes_compiled`` reader can
+    then build the same instances without any database access.
+
+    Parameters
+    ----------
+    parameter_filename : ``str``
+        The experiment config. Its dataset reader must implement
+        ``read_samples``, e.g. ``nytimes_faces_ner_matched``.
+    out_dir : ``str``
+        The split is written to ``{out_dir}/{split}``.
+    """
+    if not out_dir:
+        raise ValueError('Specify the output directory with --out-dir.')
+
+    params = yaml_to_params(parameter_filename, overrides)
+    reader = DatasetReader.from_params(params.pop('dataset_reader'))
+    if not hasattr(reader, 'read_samples'):
+        raise ValueError(f'{type(reader).__name__} cannot be compiled.')
+
+    split_dir = os.path.join(out_dir, split)
+    with RecordWriter(split_dir) as writer:
+        for sample in tqdm(reader.read_samples(split)):
+            try:
+                with open(sample['image_path'], 'rb') as f:
+                    sample['image_bytes'] = f.read()
+            except (FileNotFoundError, OSError):
+                continue
+            sample['image_key'] = get_image_key(
+                reader.image_dir, sample['image_path'])
+            writer.add(sample)
+
+    logger.info(f'Wrote {len(writer)} records to {split_dir}')
@@ -23,12 +23,15 @@ from allennlp.training.util import HasBeenWarned, datasets_from_params
 from nltk.tokenize import word_tokenize
 from spacy.tokens import Doc
 
+from tell.modules import is_quantized, load_model_state, quantize_model
+
 from .train import yaml_to_params
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
-def evaluate_from_file(archive_path, model_path, overrides=None, eval_suffix='', device=0):
+def evaluate_from_file(archive_path, model_path, overrides=None, eval_suffix='', device=0,
+                       quantize=False):
     if archive_path.endswith('gz'):
         archive = load_archive(archive_path, device, overrides)
         config = archive.config
@@ -54,15 +57,24 @@ def evaluate_from_file(archive_path, model_path, overrides=None, eval_suffix='',
     model = Model.from_params(vocab=vocab, params=config.pop('model'))
 
     if model_path:
-        best_model_state = torch.load(model_path)
-        model.load_state_dict(best_model_state)
+        best_model_state = torch.load(model_path, map_location='cpu')
+        quantize = quantize or is_quantized(best_model_state)
+        load_model_state(model, best_model_state, quantize)
+    elif quantize:
+        quantize_model(model)
+
+    if quantize:
+        # Quantized models only run on the CPU
+        device = -1
 
     instances = all_datasets.get('test')
     iterator = DataIterator.from_params(
         config.pop("validation_iterator"))
 
     iterator.index_with(model.vocab)
-    model.eval().to(device)
+    model.eval()
+    if device >= 0:
+        model.to(device)
     model.evaluate_mode = True
 
     metrics = evaluate(model, instances, iterator,
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+
+import torch
+from allennlp.data.vocabulary import Vocabulary
+
+from tell.models.decoder_base import Decoder
+from tell.models.export import MODALITIES, ContextEncoder, DecoderStep
+from tell.modules.token_embedders import AdaptiveEmbedding
+
+from .train import yaml_to_params
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def export_decoder_from_file(parameter_filename: str,
+                             model_path: str,
+                             out_dir: str,
+                             overrides: str = '') -> None:
+    """Export the caption decoder of a trained model to TorchScript.
+
+    We trace two functions that only take and return tensors:
+
+    - ``encoder.pt`` projects the contexts into the keys and values of the
+      context attentions (see ``ContextEncoder``).
+    - ``step.pt`` generates the next token from the previous one and the
+      explicit decoding state (see ``DecoderStep``).
+
+    Together with ``meta.json``, these can be loaded by ``tell.runtime``
+    without AllenNLP. Only the decoder is exported. The contexts (the RoBERTa
+    and ResNet features, faces and objects) are computed by the caller.
+
+    Parameters
+    ----------
+    parameter_filename : ``str``
+        The experiment config. The model must use the decoder of
+        ``transformer_faces_objects``.
+    model_path : ``str``
+        The trained model weights.
+    out_dir : ``str``
+        Where to write the exported files.
+    """
+    if not model_path:
+        raise ValueError('Specify the trained model with --model-path.')
+    if not out_dir:
+        raise ValueError('Specify the output directory with --out-dir.')
+
+    params = yaml_to_params(parameter_filename, overrides)
+    vocab = Vocabulary.from_params(params.pop('vocabulary'))
+    model_params = params.pop('model')
+    index = model_params.pop('index', 'roberta')
+    padding_idx = model_params.pop('padding_value', 1)
+    topk = model_params.pop('sampling_topk', 1)
+
+    # We don't need RoBERTa or the ResNet, so we only build the decoder
+    decoder = Decoder.from_params(vocab=vocab,
+                                  params=model_params.pop('decoder'))
+    state_dict = torch.load(model_path, map_location='cpu')
+    prefix = 'decoder.'
+    decoder.load_state_dict({k[len(prefix):]: v for k, v in state_dict.items()
+                             if k.startswith(prefix)})
+    decoder = decoder.eval()
+
+    encoder = ContextEncoder(decoder)
+    step = DecoderStep(decoder, index, topk)
+
+    # Start the example with a word from every band of the adaptive input,
+    # and check the trace on a batch that misses some bands.
+    cutoff = [0]
+    for module in decoder.modules():
+        if isinstance(module, AdaptiveEmbedding):
+            cutoff += module.cutoff[:-1]
+
+    with torch.no_grad():
+        example = _get_example(decoder, step, cutoff,
+                               {'image': 49, 'article': 20, 'faces': 3, 'obj': 5})
+        check = _get_example(decoder, step, cutoff[-1:] + cutoff[:1],
+                             {'image': 49, 'article': 33, 'faces': 1, 'obj': 2})
+
+        # The graph check of torch.jit.trace also flags harmless changes in
+        # the order of constants, so we compare the outputs instead.
+        logger.info('Tracing the context encoder.')
+        traced_encoder = torch.jit.trace(
+            encoder, example['contexts'], check_trace=False)
+        _check_outputs(traced_encoder, encoder, check['contexts'])
+
+        logger.info('Tracing the decoder step.')
+        traced_step = torch.jit.trace(
+            step, example['step'], check_trace=False)
+        _check_outputs(traced_step, step, check['step'])
+
+    os.makedirs(out_dir, exist_ok=True)
+    traced_encoder.save(os.path.join(out_dir, 'encoder.pt'))
+    traced_step.save(os.path.join(out_dir, 'step.pt'))
+
+    n_layers, n_history, _, conv_dim = step.get_conv_state_shape(1)
+    meta = {
+        'modalities': MODALITIES,
+        'context_dims': {m: decoder.layers[0].context_attns[m].kdim
+                         for m in MODALITIES},
+        'n_layers': n_layers,
+        'n_history': n_history,
+        'conv_dim': conv_dim,
+        'topk': topk,
+        'bos': 0,
+        'eos': 2,
+        'padding_idx': padding_idx,
+    }
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    logger.info(f'Exported the decoder to {out_dir}')
+
+
+def _check_outputs(traced, module, inputs):
+    for traced_out, out in zip(traced(*inputs), module(*inputs)):
+        if traced_out.shape != out.shape or \
+                not torch.allclose(traced_out.float(), out.float(), atol=1e-5):
+            raise RuntimeError('The traced decoder differs from the original. '
+                               'It may contain untraceable code.')
+
+
+def _get_example(decoder, step, prev_ids, lengths):
+    B = len(prev_ids)
+    contexts = []
+    for modal in MODALITIES:
+        dim = decoder.layers[0].context_attns[modal].kdim
+        X = torch.randn(B, lengths[modal], dim)
+        mask = torch.zeros(B, lengths[modal], dtype=torch.bool)
+        if modal != 'image':
+            # Right padding, as in the model
+            mask[0, lengths[modal] // 2:] = True
+        contexts += [X, mask]
+
+    keys_values = ContextEncoder(decoder)(*contexts)
+    masks = contexts[1::2]
+
+    prev_ids = torch.LongTensor(prev_ids).unsqueeze(1)
+    positions = torch.arange(B)
+    conv_state = torch.randn(*step.get_conv_state_shape(B))
+    step_inputs = (prev_ids, positions, conv_state, *masks, *keys_values)
+
+    return {
+        'contexts': tuple(contexts),
+        'step': step_inputs,
+    }
@@ -0,0 +1,140 @@
+import logging
+
+import torch
+import torch.nn.functional as F
+from allennlp.data.iterators import BasicIterator
+from allennlp.data.vocabulary import Vocabulary
+from allennlp.training.util import datasets_from_params
+from tqdm import tqdm
+
+from tell.data.stores import LAYER_MODES, FeatureStoreWriter, get_article_key
+
+from .train import yaml_to_params
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def extract_article_features_from_file(parameter_filename: str,
+                                       out_dir: str = None,
+                                       model_path: str = None,
+                                       overrides: str = '',
+                                       layers: str = None,
+                                       batch_size: int = 64,
+                                       device: int = 0) -> None:
+    """Precompute the RoBERTa-large hidden states of every article context.
+
+    RoBERTa is frozen during training, so we only need to encode each context
+    once. We go through all splits of the dataset and store the hidden states
+    of each context, keyed by a hash of its token ids. Set
+    ``article_feature_dir`` in the model config to make the model look up
+    these hidden states instead of running RoBERTa.
+
+    Parameters
+    ----------
+    parameter_filename : ``str``
+        The experiment config. We use its dataset reader to generate the
+        contexts exactly as the model would see them.
+    out_dir : ``str``, optional
+        Where to store the features. Defaults to the ``article_feature_dir``
+        in the model config.
+    model_path : ``str``, optional
+        A trained model. Only needed to get the layer weights when
+        ``layers`` is ``mixed``.
+    layers : ``str``, optional
+        One of ``last``, ``all``, or ``mixed``. By default we store the final
+        layer if ``weigh_bert`` is disabled. Otherwise we store the mixed
+        layers if a trained model is given, and all layers if not.
+    """
+    params = yaml_to_params(parameter_filename, overrides)
+    model_params = params.pop('model')
+    weigh_bert = model_params.pop('weigh_bert', False)
+    index = model_params.pop('index', 'roberta')
+    padding_idx = model_params.pop('padding_value', 1)
+    config_out_dir = model_params.pop('article_feature_dir', None)
+    out_dir = out_dir or config_out_dir
+    if not out_dir:
+        raise ValueError('Specify the output directory with --out-dir or set '
+                         'article_feature_dir in the model config.')
+
+    if layers is None:
+        if not weigh_bert:
+            layers = 'last'
+        elif model_path:
+            layers = 'mixed'
+        else:
+            layers = 'all'
+    if layers not in LAYER_MODES:
+        raise ValueError(f'Unknown layers: {layers}. Expected one of '
+                         f'{LAYER_MODES}.')
+
+    if device >= 0 and torch.cuda.is_available():
+        device = torch.device(f'cuda:{device}')
+    else:
+        device = torch.device('cpu')
+
+    roberta = torch.hub.load('pytorch/fairseq:2f7e3f3323', 'roberta.large')
+    roberta = roberta.to(device).eval()
+    n_layers = roberta.model.args.encoder_layers + 1
+    embed_dim = roberta.model.args.encoder_embed_dim
+
+    weight = None
+    if layers == 'mixed':
+        if not model_path:
+            raise ValueError('We need a trained model (--model-path) to get '
+                             'the layer weights.')
+        state_dict = torch.load(model_path, map_location='cpu')
+        weight = F.softmax(state_dict['bert_weight'].float(), dim=0)
+        weight = weight.to(device).view(1, 1, -1, 1)
+        # weight.shape == [1, 1, n_layers, 1]
+
+    row_shape = [n_layers, embed_dim] if layers == 'all' else [embed_dim]
+
+    all_datasets = datasets_from_params(params)
+    vocab = Vocabulary.from_params(params.pop('vocabulary'))
+    iterator = BasicIterator(batch_size=batch_size)
+    iterator.index_with(vocab)
+
+    with FeatureStoreWriter(out_dir, row_shape=row_shape,
+                            meta={'layers': layers}) as writer:
+        for split, instances in all_datasets.items():
+            logger.info(f'Encoding articles in the {split} split.')
+            for batch in tqdm(iterator(instances, num_epochs=1, shuffle=False)):
+                article_ids = batch['context'][index]
+                _write_batch(roberta, writer, article_ids, padding_idx,
+                             layers, weight, device)
+            writer.flush()
+
+    logger.info(f'Wrote article features to {out_dir}')
+
+
+def _write_batch(roberta, writer, article_ids, padding_idx, layers, weight,
+                 device):
+    # The same context appears once for every image in the article, so most
+    # rows are usually in the store already.
+    ids = article_ids.numpy()
+    keys = [get_article_key(row[row != padding_idx]) for row in ids]
+    todo = [i for i, key in enumerate(keys) if key not in writer]
+    if not todo:
+        return
+
+    article_ids = article_ids[todo].to(device)
+    with torch.no_grad():
+        X_sections_hiddens = roberta.extract_features(
+            article_ids, return_all_hiddens=True)
+
+        if layers == 'last':
+            X_article = X_sections_hiddens[-1]
+            # X_article.shape == [batch_size, seq_len, embed_size]
+        else:
+            X_article = torch.stack(X_sections_hiddens, dim=2)
+            # X_article.shape == [batch_size, seq_len, 25, embed_size]
+
+        if layers == 'mixed':
+            X_article = (X_article * weight).sum(dim=2)
+            # X_article.shape == [batch_size, seq_len, embed_size]
+
+    lengths = (article_ids != padding_idx).sum(dim=1).tolist()
+    X_article = X_article.cpu().numpy()
+    for i, length, feats in zip(todo, lengths, X_article):
+        if keys[i] not in writer:
+            writer.add(keys[i], feats[:length])
@@ -0,0 +1,154 @@
+import logging
+import os
+from glob import glob
+
+import numpy as np
+import torch
+from allennlp.data.dataset_readers.dataset_reader import DatasetReader
+from PIL import Image
+from torchvision.transforms import Compose, Normalize, ToTensor
+from tqdm import tqdm
+
+from tell.data.stores import FeatureStoreWriter, get_image_key
+from tell.models.resnet import resnet152
+
+from .train import yaml_to_params
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def extract_image_features_from_file(parameter_filename: str,
+                                     out_dir: str = None,
+                                     overrides: str = '',
+                                     batch_size: int = 64,
+                                     device: int = 0) -> None:
+    """Precompute the ResNet-152 image grid of every image in a dataset.
+
+    The ResNet is frozen during training (it is listed under ``no_grad`` in
+    all of our configs), so its output never changes. We run it once over all
+    images in ``image_dir`` and store the [49, 2048] grids as float16 in a
+    ``FeatureStore``. Set ``image_feature_dir`` in the dataset reader config to
+    make the reader return these grids instead of the raw image tensor.
+
+    Parameters
+    ----------
+    parameter_filename : ``str``
+        The experiment config. We use its dataset reader to get the image
+        directory and the image preprocessing steps.
+    out_dir : ``str``, optional
+        Where to store the features. Defaults to the ``image_feature_dir`` in
+        the config.
+    """
+    params = yaml_to_params(parameter_filename, overrides)
+    reader_params = params.pop('dataset_reader')
+    config_out_dir = reader_params.pop('image_feature_dir', None)
+    reader_params.pop('image_cache_dir', None)
+    out_dir = out_dir or config_out_dir
+    if not out_dir:
+        raise ValueError('Specify the output directory with --out-dir or set '
+                         'image_feature_dir in the dataset reader config.')
+
+    reader = DatasetReader.from_params(reader_params)
+    image_dir = reader.image_dir
+    preprocess = reader.preprocess
+
+    if device >= 0 and torch.cuda.is_available():
+        device = torch.device(f'cuda:{device}')
+    else:
+        device = torch.device('cpu')
+    resnet = resnet152().to(device).eval()
+
+    image_paths = sorted(glob(os.path.join(image_dir, '**', '*.jpg'),
+                              recursive=True))
+    logger.info(f'Found {len(image_paths)} images in {image_dir}')
+
+    with FeatureStoreWriter(out_dir, row_shape=[2048]) as writer:
+        keys, images = [], []
+        for image_path in tqdm(image_paths):
+            key = get_image_key(image_dir, image_path)
+            if key in writer:
+                continue
+            try:
+                image = Image.open(image_path)
+                images.append(preprocess(image))
+            except (FileNotFoundError, OSError):
+                continue
+            keys.append(key)
+
+            if len(images) == batch_size:
+                _write_batch(resnet, writer, keys, images, device)
+                keys, images = [], []
+
+        if images:
+            _write_batch(resnet, writer, keys, images, device)
+
+    logger.info(f'Wrote image features to {out_dir}')
+
+
+def cache_images_from_file(parameter_filename: str,
+                           out_dir: str = None,
+                           overrides: str = '') -> None:
+    """Decode every image in a dataset once into a uint8 pixel cache.
+
+    We apply the resizing and cropping steps of the reader's preprocessing,
+    and store the [224, 224, 3] uint8 pixels in a ``FeatureStore``. Set
+    ``image_cache_dir`` in the dataset reader config to make the reader
+    return a view into this cache instead of a normalised float32 tensor. The
+    model then normalises the whole batch on the GPU. This takes a quarter of
+    the memory and avoids decoding the JPEGs on every epoch.
+
+    Parameters
+    ----------
+    parameter_filename : ``str``
+        The experiment config. We use its dataset reader to get the image
+        directory and the image preprocessing steps.
+    out_dir : ``str``, optional
+        Where to store the pixels. Defaults to the ``image_cache_dir`` in the
+        config.
+    """
+    params = yaml_to_params(parameter_filename, overrides)
+    reader_params = params.pop('dataset_reader')
+    config_out_dir = reader_params.pop('image_cache_dir', None)
+    reader_params.pop('image_feature_dir', None)
+    out_dir = out_dir or config_out_dir
+    if not out_dir:
+        raise ValueError('Specify the output directory with --out-dir or set '
+                         'image_cache_dir in the dataset reader config.')
+
+    reader = DatasetReader.from_params(reader_params)
+    image_dir = reader.image_dir
+    # ToTensor and Normalize are applied by the model
+    resize = Compose([t for t in reader.preprocess.transforms
+                      if not isinstance(t, (ToTensor, Normalize))])
+
+    image_paths = sorted(glob(os.path.join(image_dir, '**', '*.jpg'),
+                              recursive=True))
+    logger.info(f'Found {len(image_paths)} images in {image_dir}')
+
+    with FeatureStoreWriter(out_dir, row_shape=[224, 3], dtype='uint8') as writer:
+        for image_path in tqdm(image_paths):
+            key = get_image_key(image_dir, image_path)
+            if key in writer:
+                continue
+            try:
+                with Image.open(image_path) as image:
+                    image = resize(image.convert('RGB'))
+            except (FileNotFoundError, OSError):
+                continue
+            writer.add(key, np.asarray(image))
+
+    logger.info(f'Wrote image cache to {out_dir}')
+
+
+def _write_batch(resnet, writer, keys, images, device):
+    with torch.no_grad():
+        X_image = resnet(torch.stack(images).to(device))
+    # X_image.shape == [batch_size, 2048, 7, 7]
+
+    B, C, H, W = X_image.shape
+    X_image = X_image.permute(0, 2, 3, 1).reshape(B, H * W, C)
+    # X_image.shape == [batch_size, 49, 2048]
+
+    X_image = X_image.cpu().numpy()
+    for key, feats in zip(keys, X_image):
+        writer.add(key, feats)
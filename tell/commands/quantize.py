@@ -0,0 +1,134 @@
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict
+
+import torch
+from allennlp.common.tqdm import Tqdm
+from allennlp.common.util import prepare_environment
+from allennlp.data.iterators import DataIterator
+from allennlp.data.vocabulary import Vocabulary
+from allennlp.models import Model
+from allennlp.training.util import datasets_from_params
+from pycocoevalcap.bleu.bleu_scorer import BleuScorer
+from pycocoevalcap.cider.cider_scorer import CiderScorer
+
+from tell.modules import quantize_model
+
+from .train import yaml_to_params
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# We warn if the quantized model loses more than this fraction of a score
+MAX_RELATIVE_DROP = 0.05
+
+
+def quantize_from_file(parameter_filename: str,
+                       model_path: str,
+                       out_dir: str = None,
+                       overrides: str = '',
+                       n_samples: int = 200) -> Dict[str, Dict[str, float]]:
+    """Quantize a trained model to int8 for CPU inference.
+
+    We apply dynamic quantization to the linear layers (see
+    ``tell.modules.quantize_model``) and caption a held-out slice with both
+    the float and the quantized model, to see how much BLEU-4 and CIDEr
+    drift. The quantized weights are saved to ``best-int8.th``, which
+    ``tell evaluate`` and the captioning server can load directly.
+
+    Parameters
+    ----------
+    parameter_filename : ``str``
+        The experiment config.
+    model_path : ``str``
+        The trained model weights.
+    out_dir : ``str``, optional
+        Where to save the quantized weights and the metrics. Defaults to the
+        directory of `model_path`.
+    n_samples : ``int``
+        Number of captions in the held-out slice. We use the validation set
+        if there is one, and the test set otherwise.
+    """
+    if not model_path:
+        raise ValueError('Specify the trained model with --model-path.')
+    out_dir = out_dir or os.path.dirname(model_path)
+
+    config = yaml_to_params(parameter_filename, overrides)
+    prepare_environment(config)
+    all_datasets = datasets_from_params(config)
+    instances = all_datasets.get('validation') or all_datasets.get('test')
+    instances = list(itertools.islice(instances, n_samples))
+
+    vocab = Vocabulary.from_params(config.pop('vocabulary'))
+    model = Model.from_params(vocab=vocab, params=config.pop('model'))
+    model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    model.eval()
+    model.evaluate_mode = True
+
+    iterator = DataIterator.from_params(config.pop('validation_iterator'))
+    iterator.index_with(model.vocab)
+
+    logger.info(f'Captioning {len(instances)} held-out samples with the '
+                f'float model.')
+    metrics = {'fp32': score_captions(model, instances, iterator)}
+
+    logger.info('Quantizing the model.')
+    quantize_model(model)
+    metrics['int8'] = score_captions(model, instances, iterator)
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, 'best-int8.th')
+    torch.save(model.state_dict(), out_path)
+    metrics['fp32']['size_mb'] = os.path.getsize(model_path) / 2 ** 20
+    metrics['int8']['size_mb'] = os.path.getsize(out_path) / 2 ** 20
+    logger.info(f'Saved the quantized model to {out_path}')
+
+    for key, value in metrics['fp32'].items():
+        logger.info(f'{key}: {value:.4f} (fp32), '
+                    f'{metrics["int8"][key]:.4f} (int8)')
+
+    for key in ['BLEU-4', 'CIDEr']:
+        fp32, int8 = metrics['fp32'][key], metrics['int8'][key]
+        if int8 < fp32 * (1 - MAX_RELATIVE_DROP):
+            logger.warning(f'Quantization drops {key} from {fp32:.4f} to '
+                           f'{int8:.4f}. Check the captions before serving '
+                           f'the quantized model.')
+
+    with open(os.path.join(out_dir, 'quantize-metrics.json'), 'w') as f:
+        json.dump(metrics, f, indent=4)
+
+    return metrics
+
+
+def score_captions(model, instances, iterator) -> Dict[str, float]:
+    """Compute corpus BLEU-4 and CIDEr of the generated captions."""
+    bleu_scorer = BleuScorer(n=4)
+    cider_scorer = CiderScorer(n=4, sigma=6.0)
+
+    start = time.time()
+    with torch.no_grad():
+        batches = iterator(instances, num_epochs=1, shuffle=False)
+        for batch in Tqdm.tqdm(batches):
+            output_dict = model(**batch)
+            for gen, ref in zip(output_dict['generations'],
+                                output_dict['captions']):
+                # Remove punctuation, as the model does
+                gen = re.sub(r'[^\w\s]', '', gen)
+                ref = re.sub(r'[^\w\s]', '', ref)
+                bleu_scorer += (gen, [ref])
+                cider_scorer += (gen, [ref])
+    seconds = time.time() - start
+
+    # Reset the running metrics of the model
+    model.get_metrics(reset=True)
+
+    bleu_scores, _ = bleu_scorer.compute_score(option='closest')
+    cider_score, _ = cider_scorer.compute_score()
+    return {
+        'BLEU-4': bleu_scores[3],
+        'CIDEr': cider_score,
+        'seconds': seconds,
+    }
@@ -3,6 +3,7 @@ from .goodnews_face_ner_matched import GoodNewsFaceNERMatchedReader
 from .goodnews_flattened import FlattenedGoodNewsReader
 from .goodnews_flattened_glove import FlattenedGloveGoodNewsReader
 from .nytimes import NYTimesReader
+from .nytimes_compiled import NYTimesCompiledReader
 from .nytimes_copy_matched import NYTimesCopyMatchedReader
 from .nytimes_faces_ner_matched import NYTimesFacesNERMatchedReader
 from .nytimes_glove import NYTimesGloveReader
@@ -0,0 +1,80 @@
+from typing import Callable, List, Optional, Tuple
+
+
+def get_token_counts(article,
+                     to_token_ids: Callable[[str], List[int]]) -> Tuple[int, List[int]]:
+    """Get the number of BPE tokens in the title and in each section.
+
+    We use the counts stored in the database by scripts/count_tokens.py
+    (`headline.n_tokens` and `parsed_section.n_tokens`). Any missing count is
+    computed here. This is done once per article, so that all images of the
+    article share the same counts. Sections that are not paragraphs are never
+    part of the context, so their count is 0.
+    """
+    title_count = 0
+    headline = article.get('headline', {})
+    if 'main' in headline:
+        title_count = headline.get('n_tokens')
+        if title_count is None:
+            title_count = len(to_token_ids(headline['main'].strip()))
+
+    counts = []
+    for section in article['parsed_section']:
+        count = section.get('n_tokens')
+        if count is None:
+            count = 0
+            if section['type'] == 'paragraph':
+                count = len(to_token_ids(section['text']))
+        counts.append(count)
+
+    return title_count, counts
+
+
+def get_context_window(section_types: List[str],
+                       counts: List[int],
+                       pos: int,
+                       n_title_tokens: int = 0,
+                       max_tokens: int = 510) -> Tuple[Optional[int], List[int], List[int]]:
+    """Choose the paragraphs that make up the context of the image at `pos`.
+
+    We always include the first paragraph. We then alternate between the
+    paragraph before and the paragraph after the image, moving outwards,
+    until we have at least `max_tokens` tokens or run out of paragraphs. Note
+    that the first paragraph does not count towards the limit.
+
+    Returns
+    -------
+    first : int, optional
+        The index of the first paragraph, or None if there are no paragraphs.
+    before : List[int]
+        The indices of the paragraphs before the image, in document order.
+    after : List[int]
+        The indices of the paragraphs after the image, in document order.
+    """
+    n_sections = len(section_types)
+    first = None
+    for k, section_type in enumerate(section_types):
+        if section_type == 'paragraph':
+            first = k
+            break
+
+    n_words = n_title_tokens
+    before: List[int] = []
+    after: List[int] = []
+    i = pos - 1
+    j = pos + 1
+    while True:
+        if i > k and section_types[i] == 'paragraph':
+            before.insert(0, i)
+            n_words += counts[i]
+        i -= 1
+
+        if k < j < n_sections and section_types[j] == 'paragraph':
+            after.append(j)
+            n_words += counts[j]
+        j += 1
+
+        if n_words >= max_tokens or (i <= k and j >= n_sections):
+            break
+
+    return first, before, after
@@ -18,6 +18,10 @@ from torchvision.transforms import (CenterCrop, Compose, Normalize, Resize,
 from tqdm import tqdm
 
 from tell.data.fields import ImageField, ListTextField
+from tell.data.stores import FeatureStore, get_image_key
+
+from .parallel import read_in_parallel
+from .prefetch import prefetch_documents
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -48,7 +52,13 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
                  use_caption_names: bool = True,
                  use_objects: bool = False,
                  n_faces: int = None,
-                 lazy: bool = True, 
+                 image_feature_dir: str = None,
+                 image_cache_dir: str = None,
+                 face_feature_dir: str = None,
+                 object_feature_dir: str = None,
+                 fetch_batch_size: int = 64,
+                 n_workers: int = 1,
+                 lazy: bool = True,
                  context_key: str = 'context',
                  with_abstract: bool = False,
                  with_ner: bool = False,
@@ -57,8 +67,9 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
         super().__init__(lazy)
         self._tokenizer = tokenizer
         self._token_indexers = token_indexers
-        self.client = MongoClient(host=mongo_host, port=mongo_port)
-        self.db = self.client.goodnews
+        self.mongo_host = mongo_host
+        self.mongo_port = mongo_port
+        self._connect()
         self.image_dir = image_dir
         self.preprocess = Compose([
             Resize(256), CenterCrop(224),
@@ -68,6 +79,20 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
         self.use_caption_names = use_caption_names
         self.use_objects = use_objects
         self.n_faces = n_faces
+        self.image_feature_store = None
+        if image_feature_dir:
+            self.image_feature_store = FeatureStore(image_feature_dir)
+        self.image_cache = None
+        if image_cache_dir:
+            self.image_cache = FeatureStore(image_cache_dir)
+        self.face_store = None
+        if face_feature_dir:
+            self.face_store = FeatureStore(face_feature_dir)
+        self.object_store = None
+        if object_feature_dir:
+            self.object_store = FeatureStore(object_feature_dir)
+        self.fetch_batch_size = fetch_batch_size
+        self.n_workers = n_workers
         random.seed(1234)
         self.rs = np.random.RandomState(1234)
 
@@ -77,8 +102,22 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
         self.pog = pog
         self.max_end = 500
 
+    def _connect(self):
+        self.client = MongoClient(host=self.mongo_host, port=self.mongo_port)
+        self.db = self.client.goodnews
+
     @overrides
     def _read(self, split: str):
+        ids = self._get_ids(split)
+        if self.n_workers > 1:
+            groups = read_in_parallel(self, ids, self.n_workers)
+        else:
+            groups = self._read_ids(ids)
+
+        for instances in groups:
+            yield from instances
+
+    def _get_ids(self, split):
         # split can be either train, valid, or test
         if split not in ['train', 'val', 'test']:
             raise ValueError(f'Unknown split: {split}')
@@ -95,17 +134,25 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
         ids = np.array([article['_id'] for article in tqdm(sample_cursor)])
         sample_cursor.close()
         self.rs.shuffle(ids)
-
-        for sample_id in ids:
-            sample = self.db.splits.find_one({'_id': {'$eq': sample_id}})
-            projection = ['_id', self.context_key, 'images', 'web_url', 'caption_ner', f'{self.context_key}_ner']
-            if self.with_abstract:
-                projection.append('context_abstract')
-
-            # Find the corresponding article
-            article = self.db.articles.find_one({
-                '_id': {'$eq': sample['article_id']},
-            }, projection=projection)
+        return ids
+
+    def _read_ids(self, ids):
+        # Yield the instance of each sample as a singleton list
+        # Decoding the embeddings from BSON is slow, so we skip them if
+        # they are in a sidecar file.
+        projection = None
+        if self.face_store is not None:
+            projection = {'facenet_details': False}
+
+        samples = prefetch_documents(self.db.splits, ids, projection,
+                                     self.fetch_batch_size,
+                                     join=self._join_articles)
+
+        for sample in samples:
+            # The corresponding article was fetched along with the sample
+            article = sample['article']
+            if article is None:
+                continue
 
             # Grace: If the key is None, continue even for no_headline case
             if self.with_abstract and article.get('context_abstract', None) is None:
@@ -114,9 +161,8 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
 
             # Load the image
             image_path = os.path.join(self.image_dir, f"{sample['_id']}.jpg")
-            try:
-                image = Image.open(image_path)
-            except (FileNotFoundError, OSError):
+            image = self._load_image(image_path)
+            if image is None:
                 print(f"Image not found {image_path}")
                 continue
 
@@ -130,28 +176,68 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
             else:
                 n_persons = 4
 
-            if 'facenet_details' not in sample or n_persons == 0:
-                face_embeds = np.array([[]])
-            else:
-                face_embeds = sample['facenet_details']['embeddings']
-                # Keep only the top faces (sorted by size)
-                face_embeds = np.array(face_embeds[:n_persons])
+            face_embeds = self._get_face_embeds(sample, n_persons)
 
             obj_feats = None
             if self.use_objects:
-                obj = self.db.objects.find_one({'_id': sample['_id']})
-                if obj is not None:
-                    obj_feats = obj['object_features']
-                    if len(obj_feats) == 0:
-                        obj_feats = np.array([[]])
-                    else:
-                        obj_feats = np.array(obj_feats)
-                else:
-                    obj_feats = np.array([[]])
-
-            yield self.article_to_instance(article, face_embeds,
-                                           image, sample['image_index'],
-                                           image_path, obj_feats)
+                obj_feats = self._get_object_feats(sample)
+
+            yield [self.article_to_instance(article, face_embeds,
+                                            image, sample['image_index'],
+                                            image_path, obj_feats)]
+
+    def _join_articles(self, samples):
+        # Fetch the articles (and the detected objects) of the whole batch
+        projection = ['_id', self.context_key, 'images', 'web_url', 'caption_ner', f'{self.context_key}_ner']
+        if self.with_abstract:
+            projection.append('context_abstract')
+
+        article_ids = list({s['article_id'] for s in samples})
+        cursor = self.db.articles.find({'_id': {'$in': article_ids}},
+                                       projection=projection)
+        articles = {a['_id']: a for a in cursor}
+
+        objects = {}
+        if self.use_objects and self.object_store is None:
+            cursor = self.db.objects.find(
+                {'_id': {'$in': [s['_id'] for s in samples]}},
+                projection=['_id', 'object_features'])
+            objects = {obj['_id']: obj for obj in cursor}
+
+        for sample in samples:
+            sample['article'] = articles.get(sample['article_id'])
+            sample['object'] = objects.get(sample['_id'])
+
+    def _get_face_embeds(self, sample, n_persons):
+        if n_persons == 0:
+            return np.array([[]])
+
+        # A float16 view into the sidecar file written by detect_facenet_*.py
+        if self.face_store is not None:
+            face_embeds = self.face_store.get(sample['_id'])
+            if face_embeds is None or len(face_embeds) == 0:
+                return np.array([[]])
+            # Keep only the top faces (sorted by size)
+            return face_embeds[:n_persons]
+
+        if 'facenet_details' not in sample:
+            return np.array([[]])
+        face_embeds = sample['facenet_details']['embeddings']
+        # Keep only the top faces (sorted by size)
+        return np.array(face_embeds[:n_persons])
+
+    def _get_object_feats(self, sample):
+        # A float16 view into the sidecar file written by annotate_yolo3.py
+        if self.object_store is not None:
+            obj_feats = self.object_store.get(sample['_id'])
+            if obj_feats is None or len(obj_feats) == 0:
+                return np.array([[]])
+            return obj_feats
+
+        obj = sample['object']
+        if obj is None or len(obj['object_features']) == 0:
+            return np.array([[]])
+        return np.array(obj['object_features'])
 
     def article_to_instance(self, article, face_embeds, image,
                             image_index, image_path, obj_feats) -> Instance:
@@ -182,7 +268,7 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
         fields = {
             'context': TextField(context_tokens, self._token_indexers),
             'names': ListTextField(name_field),
-            'image': ImageField(image, self.preprocess),
+            'image': self._get_image_field(image),
             'caption': TextField(caption_tokens, self._token_indexers),
             'face_embeds': ArrayField(face_embeds, padding_value=np.nan),
         }
@@ -199,6 +285,31 @@ class GoodNewsFaceNERMatchedReader(DatasetReader):
 
         return Instance(fields)
 
+    def _load_image(self, image_path):
+        # The precomputed ResNet grid is returned in place of the raw image.
+        if self.image_feature_store is not None:
+            key = get_image_key(self.image_dir, image_path)
+            return self.image_feature_store.get(key)
+
+        # The decoded uint8 pixels. The model normalises the whole batch.
+        if self.image_cache is not None:
+            key = get_image_key(self.image_dir, image_path)
+            return self.image_cache.get(key)
+
+        try:
+            return Image.open(image_path)
+        except (FileNotFoundError, OSError):
+            return None
+
+    def _get_image_field(self, image):
+        if self.image_feature_store is not None:
+            # image.shape == [49, 2048]
+            return ArrayField(image)
+        if self.image_cache is not None:
+            # image.shape == [224, 224, 3]
+            return ArrayField(image.transpose(2, 0, 1), dtype=np.uint8)
+        return ImageField(image, self.preprocess)
+
     def _get_named_entities(self, article):
         # These name indices have the right end point excluded
         names = set()
@@ -0,0 +1,60 @@
+import numpy as np
+from allennlp.data.fields import ArrayField, MetadataField, TextField
+from allennlp.data.instance import Instance
+
+from tell.data.fields import ImageField, ListTextField
+
+
+class FacesInstanceMixin:
+    """Build the instances of the NYTimes faces and objects readers.
+
+    The reader needs ``_tokenizer``, ``_token_indexers``, ``preprocess``,
+    ``image_feature_store`` and ``image_cache``. The live and the compiled
+    readers share this, so that they always produce the same instances.
+    """
+
+    def article_to_instance(self, paragraphs, named_entities, image, caption,
+                            image_path, web_url, pos, face_embeds, obj_feats) -> Instance:
+        context = '\n'.join(paragraphs).strip()
+
+        context_tokens = self._tokenizer.tokenize(context)
+        caption_tokens = self._tokenizer.tokenize(caption)
+        name_token_list = [self._tokenizer.tokenize(n) for n in named_entities]
+
+        if name_token_list:
+            name_field = [TextField(tokens, self._token_indexers)
+                          for tokens in name_token_list]
+        else:
+            stub_field = ListTextField(
+                [TextField(caption_tokens, self._token_indexers)])
+            name_field = stub_field.empty_field()
+
+        fields = {
+            'context': TextField(context_tokens, self._token_indexers),
+            'names': ListTextField(name_field),
+            'image': self._get_image_field(image),
+            'caption': TextField(caption_tokens, self._token_indexers),
+            'face_embeds': ArrayField(face_embeds, padding_value=np.nan),
+        }
+
+        if obj_feats is not None:
+            fields['obj_embeds'] = ArrayField(obj_feats, padding_value=np.nan)
+
+        metadata = {'context': context,
+                    'caption': caption,
+                    'names': named_entities,
+                    'web_url': web_url,
+                    'image_path': image_path,
+                    'image_pos': pos}
+        fields['metadata'] = MetadataField(metadata)
+
+        return Instance(fields)
+
+    def _get_image_field(self, image):
+        if self.image_feature_store is not None:
+            # image.shape == [49, 2048]
+            return ArrayField(image)
+        if self.image_cache is not None:
+            # image.shape == [224, 224, 3]
+            return ArrayField(image.transpose(2, 0, 1), dtype=np.uint8)
+        return ImageField(image, self.preprocess)
@@ -19,6 +19,8 @@ from tqdm import tqdm
 
 from tell.data.fields import ImageField
 
+from .prefetch import prefetch_documents
+
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
@@ -44,6 +46,7 @@ class NYTimesReader(DatasetReader):
                  image_dir: str,
                  mongo_host: str = 'localhost',
                  mongo_port: int = 27017,
+                 fetch_batch_size: int = 64,
                  lazy: bool = True) -> None:
         super().__init__(lazy)
         self._tokenizer = tokenizer
@@ -54,6 +57,7 @@ class NYTimesReader(DatasetReader):
         self.preprocess = Compose([
             ToTensor(),
             Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
+        self.fetch_batch_size = fetch_batch_size
         random.seed(1234)
 
         self.rs = np.random.RandomState(1234)
@@ -77,9 +81,10 @@ class NYTimesReader(DatasetReader):
                       'parsed_section.hash',
                       'image_positions', 'headline', 'web_url']
 
-        for article_id in ids:
-            article = self.db.articles.find_one(
-                {'_id': {'$eq': article_id}}, projection=projection)
+        articles = prefetch_documents(self.db.articles, ids, projection,
+                                      self.fetch_batch_size)
+
+        for article in articles:
             sections = article['parsed_section']
             image_positions = article['image_positions']
             for pos in image_positions:
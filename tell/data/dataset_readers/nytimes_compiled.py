@@ -0,0 +1,91 @@
+import io
+import logging
+import os
+from typing import Dict
+
+import numpy as np
+from allennlp.data.dataset_readers.dataset_reader import DatasetReader
+from allennlp.data.token_indexers import TokenIndexer
+from allennlp.data.tokenizers import Tokenizer
+from overrides import overrides
+from PIL import Image
+from torchvision.transforms import Compose, Normalize, ToTensor
+
+from tell.data.stores import FeatureStore, RecordStore
+
+from .instances import FacesInstanceMixin
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+@DatasetReader.register('nytimes_compiled')
+class NYTimesCompiledReader(FacesInstanceMixin, DatasetReader):
+    """Read a dataset split compiled by ``tell compile-dataset``.
+
+    The records contain everything needed to build an instance, including
+    the image, so we need neither MongoDB nor the image directory. This
+    produces the same instances as ``NYTimesFacesNERMatchedReader``.
+
+    Parameters
+    ----------
+    tokenizer : ``Tokenizer``
+        We use this ``Tokenizer`` for both the premise and the hypothesis.
+        See :class:`Tokenizer`.
+    token_indexers : ``Dict[str, TokenIndexer]``
+        We similarly use this for both the premise and the hypothesis.
+        See :class:`TokenIndexer`.
+    data_dir : ``str``
+        The output directory of ``tell compile-dataset``. It contains one
+        subdirectory per split.
+    shuffle : ``bool``
+        If True, we read the records in a random order. Otherwise we stream
+        the shards sequentially, in the order they were compiled.
+    """
+
+    def __init__(self,
+                 tokenizer: Tokenizer,
+                 token_indexers: Dict[str, TokenIndexer],
+                 data_dir: str,
+                 shuffle: bool = True,
+                 image_feature_dir: str = None,
+                 image_cache_dir: str = None,
+                 lazy: bool = True) -> None:
+        super().__init__(lazy)
+        self._tokenizer = tokenizer
+        self._token_indexers = token_indexers
+        self.data_dir = data_dir
+        self.shuffle = shuffle
+        self.preprocess = Compose([
+            ToTensor(),
+            Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
+        self.image_feature_store = None
+        if image_feature_dir:
+            self.image_feature_store = FeatureStore(image_feature_dir)
+        self.image_cache = None
+        if image_cache_dir:
+            self.image_cache = FeatureStore(image_cache_dir)
+        self.rs = np.random.RandomState(1234)
+
+    @overrides
+    def _read(self, split: str):
+        store = RecordStore(os.path.join(self.data_dir, split))
+        logger.info(f'Reading {len(store)} records from the {split} split.')
+
+        records = iter(store)
+        if self.shuffle:
+            order = self.rs.permutation(len(store))
+            records = (store[i] for i in order)
+
+        for record in records:
+            image_bytes = record.pop('image_bytes')
+            image_key = record.pop('image_key')
+            if self.image_feature_store is not None:
+                image = self.image_feature_store.get(image_key)
+            elif self.image_cache is not None:
+                image = self.image_cache.get(image_key)
+            else:
+                image = Image.open(io.BytesIO(image_bytes))
+            if image is None:
+                continue
+
+            yield self.article_to_instance(image=image, **record)
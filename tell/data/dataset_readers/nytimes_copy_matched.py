@@ -7,7 +7,6 @@ from typing import Dict
 
 import numpy as np
 import pymongo
-import torch
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
 from allennlp.data.fields import ArrayField, MetadataField, TextField
 from allennlp.data.instance import Instance
@@ -20,6 +19,10 @@ from torchvision.transforms import Compose, Normalize, ToTensor
 from tqdm import tqdm
 
 from tell.data.fields import CopyTextField, ImageField, ListTextField
+from tell.utils.roberta import get_roberta_bpe
+
+from .context import get_context_window, get_token_counts
+from .prefetch import prefetch_documents
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -57,6 +60,7 @@ class NYTimesCopyMatchedReader(DatasetReader):
                  mongo_port: int = 27017,
                  use_caption_names: bool = True,
                  n_faces: int = None,
+                 fetch_batch_size: int = 64,
                  lazy: bool = True) -> None:
         super().__init__(lazy)
         self._tokenizer = tokenizer
@@ -69,12 +73,12 @@ class NYTimesCopyMatchedReader(DatasetReader):
             Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
         self.use_caption_names = use_caption_names
         self.n_faces = n_faces
+        self.fetch_batch_size = fetch_batch_size
         random.seed(1234)
         self.rs = np.random.RandomState(1234)
 
-        roberta = torch.hub.load('pytorch/fairseq:2f7e3f3323', 'roberta.base')
-        self.bpe = roberta.bpe
-        self.indices = roberta.task.source_dictionary.indices
+        self.bpe, dictionary = get_roberta_bpe()
+        self.indices = dictionary.indices
 
     @overrides
     def _read(self, split: str):
@@ -95,14 +99,17 @@ class NYTimesCopyMatchedReader(DatasetReader):
                       'parsed_section.hash', 'parsed_section.parts_of_speech',
                       'parsed_section.facenet_details',
                       'parsed_section.named_entities',
-                      'image_positions', 'headline',
+                      'parsed_section.n_tokens', 'image_positions', 'headline',
                       'web_url', 'n_images_with_faces']
 
-        for article_id in ids:
-            article = self.db.articles.find_one(
-                {'_id': {'$eq': article_id}}, projection=projection)
+        articles = prefetch_documents(self.db.articles, ids, projection,
+                                      self.fetch_batch_size)
+
+        for article in articles:
             sections = article['parsed_section']
             image_positions = article['image_positions']
+            section_types = [section['type'] for section in sections]
+            title_count, counts = get_token_counts(article, self.to_token_ids)
             for pos in image_positions:
                 title = ''
                 if 'main' in article['headline']:
@@ -111,14 +118,14 @@ class NYTimesCopyMatchedReader(DatasetReader):
                 pos_pars = []
                 ner_pars = []
                 named_entities = set()
-                n_words = 0
+                n_title_tokens = 0
                 if title:
                     paragraphs.append(title)
                     pos_pars.append(article['headline']['parts_of_speech'])
                     ners = self._get_named_entities(article['headline'])
                     ner_pars.append(ners)
                     named_entities.union(ners)
-                    n_words += len(self.to_token_ids(title))
+                    n_title_tokens = title_count
 
                 caption = sections[pos]['text'].strip()
                 if not caption:
@@ -133,46 +140,27 @@ class NYTimesCopyMatchedReader(DatasetReader):
                 else:
                     n_persons = 4
 
-                before = []
-                before_pos = []
-                before_ners = []
-                after = []
-                after_pos = []
-                after_ners = []
-                i = pos - 1
-                j = pos + 1
-                for k, section in enumerate(sections):
-                    if section['type'] == 'paragraph':
-                        paragraphs.append(section['text'])
-                        pos_pars.append(section['parts_of_speech'])
-                        ners = self._get_named_entities(section)
-                        ner_pars.append(ners)
-                        named_entities |= ners
-                        break
-
-                while True:
-                    if i > k and sections[i]['type'] == 'paragraph':
-                        text = sections[i]['text']
-                        before.insert(0, text)
-                        before_pos.insert(0, sections[i]['parts_of_speech'])
-                        ners = self._get_named_entities(sections[i])
-                        before_ners.append(ners)
-                        named_entities |= ners
-                        n_words += len(self.to_token_ids(text))
-                    i -= 1
-
-                    if k < j < len(sections) and sections[j]['type'] == 'paragraph':
-                        text = sections[j]['text']
-                        after.append(text)
-                        after_pos.append(sections[j]['parts_of_speech'])
-                        ners = self._get_named_entities(sections[j])
-                        after_ners.append(ners)
-                        named_entities |= ners
-                        n_words += len(self.to_token_ids(text))
-                    j += 1
-
-                    if n_words >= 510 or (i <= k and j >= len(sections)):
-                        break
+                k, before_idx, after_idx = get_context_window(
+                    section_types, counts, pos, n_title_tokens)
+
+                if k is not None:
+                    paragraphs.append(sections[k]['text'])
+                    pos_pars.append(sections[k]['parts_of_speech'])
+                    ners = self._get_named_entities(sections[k])
+                    ner_pars.append(ners)
+                    named_entities |= ners
+
+                before = [sections[i]['text'] for i in before_idx]
+                before_pos = [sections[i]['parts_of_speech'] for i in before_idx]
+                # The names before the image are in reverse document order
+                before_ners = [self._get_named_entities(sections[i])
+                               for i in reversed(before_idx)]
+                after = [sections[j]['text'] for j in after_idx]
+                after_pos = [sections[j]['parts_of_speech'] for j in after_idx]
+                after_ners = [self._get_named_entities(sections[j])
+                              for j in after_idx]
+                for ners in before_ners + after_ners:
+                    named_entities |= ners
 
                 image_path = os.path.join(
                     self.image_dir, f"{sections[pos]['hash']}.jpg")
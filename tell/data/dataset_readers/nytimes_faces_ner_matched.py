@@ -6,10 +6,7 @@ from typing import Dict
 
 import numpy as np
 import pymongo
-import torch
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
-from allennlp.data.fields import ArrayField, MetadataField, TextField
-from allennlp.data.instance import Instance
 from allennlp.data.token_indexers import TokenIndexer
 from allennlp.data.tokenizers import Tokenizer
 from overrides import overrides
@@ -18,7 +15,13 @@ from pymongo import MongoClient
 from torchvision.transforms import Compose, Normalize, ToTensor
 from tqdm import tqdm
 
-from tell.data.fields import ImageField, ListTextField
+from tell.data.stores import FeatureStore, get_image_key
+from tell.utils.roberta import get_roberta_bpe
+
+from .context import get_context_window, get_token_counts
+from .instances import FacesInstanceMixin
+from .parallel import read_in_parallel
+from .prefetch import prefetch_documents
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -33,7 +36,7 @@ def tokenize_line(line):
 
 
 @DatasetReader.register('nytimes_faces_ner_matched')
-class NYTimesFacesNERMatchedReader(DatasetReader):
+class NYTimesFacesNERMatchedReader(FacesInstanceMixin, DatasetReader):
     """Read from the New York Times dataset.
 
     See the repo README for more instruction on how to download the dataset.
@@ -57,12 +60,19 @@ class NYTimesFacesNERMatchedReader(DatasetReader):
                  use_caption_names: bool = True,
                  use_objects: bool = False,
                  n_faces: int = None,
+                 image_feature_dir: str = None,
+                 image_cache_dir: str = None,
+                 face_feature_dir: str = None,
+                 object_feature_dir: str = None,
+                 fetch_batch_size: int = 64,
+                 n_workers: int = 1,
                  lazy: bool = True) -> None:
         super().__init__(lazy)
         self._tokenizer = tokenizer
         self._token_indexers = token_indexers
-        self.client = MongoClient(host=mongo_host, port=mongo_port)
-        self.db = self.client.nytimes
+        self.mongo_host = mongo_host
+        self.mongo_port = mongo_port
+        self._connect()
         self.image_dir = image_dir
         self.preprocess = Compose([
             ToTensor(),
@@ -70,15 +80,62 @@ class NYTimesFacesNERMatchedReader(DatasetReader):
         self.use_caption_names = use_caption_names
         self.use_objects = use_objects
         self.n_faces = n_faces
+        self.image_feature_store = None
+        if image_feature_dir:
+            self.image_feature_store = FeatureStore(image_feature_dir)
+        self.image_cache = None
+        if image_cache_dir:
+            self.image_cache = FeatureStore(image_cache_dir)
+        self.face_store = None
+        if face_feature_dir:
+            self.face_store = FeatureStore(face_feature_dir)
+        self.object_store = None
+        if object_feature_dir:
+            self.object_store = FeatureStore(object_feature_dir)
+        self.fetch_batch_size = fetch_batch_size
+        self.n_workers = n_workers
         random.seed(1234)
         self.rs = np.random.RandomState(1234)
 
-        roberta = torch.hub.load('pytorch/fairseq:2f7e3f3323', 'roberta.base')
-        self.bpe = roberta.bpe
-        self.indices = roberta.task.source_dictionary.indices
+        self.bpe, dictionary = get_roberta_bpe()
+        self.indices = dictionary.indices
+
+    def _connect(self):
+        self.client = MongoClient(host=self.mongo_host, port=self.mongo_port)
+        self.db = self.client.nytimes
 
     @overrides
     def _read(self, split: str):
+        ids = self._get_ids(split)
+        if self.n_workers > 1:
+            groups = read_in_parallel(self, ids, self.n_workers)
+        else:
+            groups = self._read_ids(ids)
+
+        for instances in groups:
+            yield from instances
+
+    def read_samples(self, split: str):
+        """Yield the raw inputs of each instance, without the image.
+
+        These are the keyword arguments of ``article_to_instance``. This is
+        also what ``tell compile-dataset`` stores.
+        """
+        for article in self._get_articles(self._get_ids(split)):
+            yield from self._get_samples(article)
+
+    def _read_ids(self, ids):
+        # Yield the instances of each article as one list
+        for article in self._get_articles(ids):
+            instances = []
+            for sample in self._get_samples(article):
+                image = self._load_image(sample['image_path'])
+                if image is not None:
+                    instances.append(
+                        self.article_to_instance(image=image, **sample))
+            yield instances
+
+    def _get_ids(self, split):
         # split can be either train, valid, or test
         # validation and test sets contain 10K examples each
         if split not in ['train', 'valid', 'test']:
@@ -91,140 +148,148 @@ class NYTimesFacesNERMatchedReader(DatasetReader):
         ids = np.array([article['_id'] for article in tqdm(sample_cursor)])
         sample_cursor.close()
         self.rs.shuffle(ids)
+        return ids
 
+    def _get_articles(self, ids):
         projection = ['_id', 'parsed_section.type', 'parsed_section.text',
                       'parsed_section.hash', 'parsed_section.parts_of_speech',
-                      'parsed_section.facenet_details', 'parsed_section.named_entities',
-                      'image_positions', 'headline',
+                      'parsed_section.named_entities',
+                      'parsed_section.n_tokens', 'image_positions', 'headline',
                       'web_url', 'n_images_with_faces']
-
-        for article_id in ids:
-            article = self.db.articles.find_one(
-                {'_id': {'$eq': article_id}}, projection=projection)
-            sections = article['parsed_section']
-            image_positions = article['image_positions']
-            for pos in image_positions:
-                title = ''
-                if 'main' in article['headline']:
-                    title = article['headline']['main'].strip()
-                paragraphs = []
-                named_entities = set()
-                n_words = 0
-                if title:
-                    paragraphs.append(title)
-                    named_entities.union(
-                        self._get_named_entities(article['headline']))
-                    n_words += len(self.to_token_ids(title))
-
-                caption = sections[pos]['text'].strip()
-                if not caption:
-                    continue
-
-                if self.n_faces is not None:
-                    n_persons = self.n_faces
-                elif self.use_caption_names:
-                    n_persons = len(self._get_person_names(sections[pos]))
-                else:
-                    n_persons = 4
-
-                before = []
-                after = []
-                i = pos - 1
-                j = pos + 1
-                for k, section in enumerate(sections):
-                    if section['type'] == 'paragraph':
-                        paragraphs.append(section['text'])
-                        named_entities |= self._get_named_entities(section)
-                        break
-
-                while True:
-                    if i > k and sections[i]['type'] == 'paragraph':
-                        text = sections[i]['text']
-                        before.insert(0, text)
-                        named_entities |= self._get_named_entities(sections[i])
-                        n_words += len(self.to_token_ids(text))
-                    i -= 1
-
-                    if k < j < len(sections) and sections[j]['type'] == 'paragraph':
-                        text = sections[j]['text']
-                        after.append(text)
-                        named_entities |= self._get_named_entities(sections[j])
-                        n_words += len(self.to_token_ids(text))
-                    j += 1
-
-                    if n_words >= 510 or (i <= k and j >= len(sections)):
-                        break
-
-                image_path = os.path.join(
-                    self.image_dir, f"{sections[pos]['hash']}.jpg")
-                try:
-                    image = Image.open(image_path)
-                except (FileNotFoundError, OSError):
-                    continue
-
-                if 'facenet_details' not in sections[pos] or n_persons == 0:
-                    face_embeds = np.array([[]])
-                else:
-                    face_embeds = sections[pos]['facenet_details']['embeddings']
-                    # Keep only the top faces (sorted by size)
-                    face_embeds = np.array(face_embeds[:n_persons])
-
-                paragraphs = paragraphs + before + after
-                named_entities = sorted(named_entities)
-
-                obj_feats = None
-                if self.use_objects:
-                    obj = self.db.objects.find_one(
-                        {'_id': sections[pos]['hash']})
-                    if obj is not None:
-                        obj_feats = obj['object_features']
-                        if len(obj_feats) == 0:
-                            obj_feats = np.array([[]])
-                        else:
-                            obj_feats = np.array(obj_feats)
-                    else:
-                        obj_feats = np.array([[]])
-
-                yield self.article_to_instance(
-                    paragraphs, named_entities, image, caption, image_path,
-                    article['web_url'], pos, face_embeds, obj_feats)
-
-    def article_to_instance(self, paragraphs, named_entities, image, caption,
-                            image_path, web_url, pos, face_embeds, obj_feats) -> Instance:
-        context = '\n'.join(paragraphs).strip()
-
-        context_tokens = self._tokenizer.tokenize(context)
-        caption_tokens = self._tokenizer.tokenize(caption)
-        name_token_list = [self._tokenizer.tokenize(n) for n in named_entities]
-
-        if name_token_list:
-            name_field = [TextField(tokens, self._token_indexers)
-                          for tokens in name_token_list]
-        else:
-            stub_field = ListTextField(
-                [TextField(caption_tokens, self._token_indexers)])
-            name_field = stub_field.empty_field()
-
-        fields = {
-            'context': TextField(context_tokens, self._token_indexers),
-            'names': ListTextField(name_field),
-            'image': ImageField(image, self.preprocess),
-            'caption': TextField(caption_tokens, self._token_indexers),
-            'face_embeds': ArrayField(face_embeds, padding_value=np.nan),
-        }
-
-        if obj_feats is not None:
-            fields['obj_embeds'] = ArrayField(obj_feats, padding_value=np.nan)
-
-        metadata = {'context': context,
-                    'caption': caption,
-                    'names': named_entities,
-                    'web_url': web_url,
-                    'image_path': image_path,
-                    'image_pos': pos}
-        fields['metadata'] = MetadataField(metadata)
-
-        return Instance(fields)
+        # Decoding the embeddings from BSON is slow, so we skip them if
+        # they are in a sidecar file.
+        if self.face_store is None:
+            projection.append('parsed_section.facenet_details')
+
+        join = None
+        if self.use_objects and self.object_store is None:
+            join = self._join_objects
+
+        return prefetch_documents(self.db.articles, ids, projection,
+                                  self.fetch_batch_size, join=join)
+
+    def _get_samples(self, article):
+        sections = article['parsed_section']
+        image_positions = article['image_positions']
+        section_types = [section['type'] for section in sections]
+        title_count, counts = get_token_counts(article, self.to_token_ids)
+        for pos in image_positions:
+            title = ''
+            if 'main' in article['headline']:
+                title = article['headline']['main'].strip()
+            paragraphs = []
+            named_entities = set()
+            n_title_tokens = 0
+            if title:
+                paragraphs.append(title)
+                named_entities.union(
+                    self._get_named_entities(article['headline']))
+                n_title_tokens = title_count
+
+            caption = sections[pos]['text'].strip()
+            if not caption:
+                continue
+
+            if self.n_faces is not None:
+                n_persons = self.n_faces
+            elif self.use_caption_names:
+                n_persons = len(self._get_person_names(sections[pos]))
+            else:
+                n_persons = 4
+
+            k, before_idx, after_idx = get_context_window(
+                section_types, counts, pos, n_title_tokens)
+
+            if k is not None:
+                paragraphs.append(sections[k]['text'])
+                named_entities |= self._get_named_entities(sections[k])
+
+            before = [sections[i]['text'] for i in before_idx]
+            after = [sections[j]['text'] for j in after_idx]
+            for i in before_idx + after_idx:
+                named_entities |= self._get_named_entities(sections[i])
+
+            image_path = os.path.join(
+                self.image_dir, f"{sections[pos]['hash']}.jpg")
+
+            face_embeds = self._get_face_embeds(
+                sections[pos]['hash'], sections[pos], n_persons)
+
+            paragraphs = paragraphs + before + after
+            named_entities = sorted(named_entities)
+
+            obj_feats = None
+            if self.use_objects:
+                obj_feats = self._get_object_feats(
+                    sections[pos]['hash'], article.get('objects'))
+
+            yield {
+                'paragraphs': paragraphs,
+                'named_entities': named_entities,
+                'caption': caption,
+                'image_path': image_path,
+                'web_url': article['web_url'],
+                'pos': pos,
+                'face_embeds': face_embeds,
+                'obj_feats': obj_feats,
+            }
+
+    def _get_face_embeds(self, key, section, n_persons):
+        if n_persons == 0:
+            return np.array([[]])
+
+        # A float16 view into the sidecar file written by detect_facenet_*.py
+        if self.face_store is not None:
+            face_embeds = self.face_store.get(key)
+            if face_embeds is None or len(face_embeds) == 0:
+                return np.array([[]])
+            # Keep only the top faces (sorted by size)
+            return face_embeds[:n_persons]
+
+        if 'facenet_details' not in section:
+            return np.array([[]])
+        face_embeds = section['facenet_details']['embeddings']
+        # Keep only the top faces (sorted by size)
+        return np.array(face_embeds[:n_persons])
+
+    def _get_object_feats(self, key, objects):
+        # A float16 view into the sidecar file written by annotate_yolo3.py
+        if self.object_store is not None:
+            obj_feats = self.object_store.get(key)
+            if obj_feats is None or len(obj_feats) == 0:
+                return np.array([[]])
+            return obj_feats
+
+        obj = objects.get(key)
+        if obj is None or len(obj['object_features']) == 0:
+            return np.array([[]])
+        return np.array(obj['object_features'])
+
+    def _join_objects(self, articles):
+        # Fetch the detected objects of all images in the batch at once
+        hashes = [a['parsed_section'][pos]['hash']
+                  for a in articles for pos in a['image_positions']]
+        cursor = self.db.objects.find({'_id': {'$in': hashes}},
+                                      projection=['_id', 'object_features'])
+        objects = {obj['_id']: obj for obj in cursor}
+        for article in articles:
+            article['objects'] = objects
+
+    def _load_image(self, image_path):
+        # The precomputed ResNet grid is returned in place of the raw image.
+        if self.image_feature_store is not None:
+            key = get_image_key(self.image_dir, image_path)
+            return self.image_feature_store.get(key)
+
+        # The decoded uint8 pixels. The model normalises the whole batch.
+        if self.image_cache is not None:
+            key = get_image_key(self.image_dir, image_path)
+            return self.image_cache.get(key)
+
+        try:
+            return Image.open(image_path)
+        except (FileNotFoundError, OSError):
+            return None
 
     def _get_named_entities(self, section):
         # These name indices have the right end point excluded
@@ -6,7 +6,6 @@ from typing import Dict
 
 import numpy as np
 import pymongo
-import torch
 from allennlp.data.dataset_readers.dataset_reader import DatasetReader
 from allennlp.data.fields import MetadataField, TextField
 from allennlp.data.instance import Instance
@@ -20,6 +19,10 @@ from torchvision.transforms import (CenterCrop, Compose, Normalize, Resize,
 from tqdm import tqdm
 
 from tell.data.fields import ImageField
+from tell.utils.roberta import get_roberta_bpe
+
+from .context import get_context_window, get_token_counts
+from .prefetch import prefetch_documents
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -54,6 +57,7 @@ class NYTimesPositionReader(DatasetReader):
                  image_dir: str,
                  mongo_host: str = 'localhost',
                  mongo_port: int = 27017,
+                 fetch_batch_size: int = 64,
                  lazy: bool = True) -> None:
         super().__init__(lazy)
         self._tokenizer = tokenizer
@@ -64,12 +68,12 @@ class NYTimesPositionReader(DatasetReader):
         self.preprocess = Compose([
             ToTensor(),
             Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
+        self.fetch_batch_size = fetch_batch_size
         random.seed(1234)
         self.rs = np.random.RandomState(1234)
 
-        roberta = torch.hub.load('pytorch/fairseq:2f7e3f3323', 'roberta.base')
-        self.bpe = roberta.bpe
-        self.indices = roberta.task.source_dictionary.indices
+        self.bpe, dictionary = get_roberta_bpe()
+        self.indices = dictionary.indices
 
     @overrides
     def _read(self, split: str):
@@ -87,52 +91,39 @@ class NYTimesPositionReader(DatasetReader):
         self.rs.shuffle(ids)
 
         projection = ['_id', 'parsed_section.type', 'parsed_section.text',
-                      'parsed_section.hash',
+                      'parsed_section.hash', 'parsed_section.n_tokens',
                       'image_positions', 'headline', 'web_url']
 
-        for article_id in ids:
-            article = self.db.articles.find_one(
-                {'_id': {'$eq': article_id}}, projection=projection)
+        articles = prefetch_documents(self.db.articles, ids, projection,
+                                      self.fetch_batch_size)
+
+        for article in articles:
             sections = article['parsed_section']
             image_positions = article['image_positions']
+            section_types = [section['type'] for section in sections]
+            title_count, counts = get_token_counts(article, self.to_token_ids)
             for pos in image_positions:
                 title = ''
                 if 'main' in article['headline']:
                     title = article['headline']['main'].strip()
                 paragraphs = []
-                n_words = 0
+                n_title_tokens = 0
                 if title:
                     paragraphs.append(title)
-                    n_words += len(self.to_token_ids(title))
+                    n_title_tokens = title_count
 
                 caption = sections[pos]['text'].strip()
                 if not caption:
                     continue
 
-                before = []
-                after = []
-                i = pos - 1
-                j = pos + 1
-                for k, section in enumerate(sections):
-                    if section['type'] == 'paragraph':
-                        paragraphs.append(section['text'])
-                        break
-
-                while True:
-                    if i > k and sections[i]['type'] == 'paragraph':
-                        text = sections[i]['text']
-                        before.insert(0, text)
-                        n_words += len(self.to_token_ids(text))
-                    i -= 1
-
-                    if k < j < len(sections) and sections[j]['type'] == 'paragraph':
-                        text = sections[j]['text']
-                        after.append(text)
-                        n_words += len(self.to_token_ids(text))
-                    j += 1
-
-                    if n_words >= 510 or (i <= k and j >= len(sections)):
-                        break
+                k, before_idx, after_idx = get_context_window(
+                    section_types, counts, pos, n_title_tokens)
+
+                if k is not None:
+                    paragraphs.append(sections[k]['text'])
+
+                before = [sections[i]['text'] for i in before_idx]
+                after = [sections[j]['text'] for j in after_idx]
 
                 image_path = os.path.join(
                     self.image_dir, f"{sections[pos]['hash']}.jpg")
@@ -0,0 +1,78 @@
+import logging
+import queue
+from typing import Any, Iterator, List, Sequence
+
+import torch.multiprocessing as mp
+from allennlp.data.instance import Instance
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_DONE = 'done'
+
+
+def read_in_parallel(reader,
+                     ids: Sequence[Any],
+                     n_workers: int,
+                     queue_size: int = 16) -> Iterator[List[Instance]]:
+    """Build instances in a pool of worker processes.
+
+    The ids are sharded round-robin across ``n_workers`` processes. Each
+    worker calls ``reader._read_ids(shard)``, which must yield one list of
+    instances per id, and sends the lists back through its own bounded
+    queue. We then take one list from each worker in turn. The output order
+    therefore only depends on ``ids`` (which the readers shuffle with a fixed
+    seed), not on how fast each worker is. It is the same as reading
+    sequentially, unless some ids are skipped.
+
+    The workers are forked, so the reader does not need to be picklable. The
+    reader may define ``_connect`` to reopen its MongoDB connection in each
+    worker, since MongoClient is not fork-safe.
+    """
+    ctx = mp.get_context('fork')
+    queues = [ctx.Queue(maxsize=queue_size) for _ in range(n_workers)]
+    workers = [ctx.Process(target=_work,
+                           args=(reader, ids[i::n_workers], queues[i]),
+                           daemon=True)
+               for i in range(n_workers)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        active = list(range(n_workers))
+        while active:
+            for i in list(active):
+                item = _get(queues[i], workers[i])
+                if isinstance(item, str) and item == _DONE:
+                    active.remove(i)
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+
+def _get(q, worker):
+    while True:
+        try:
+            return q.get(timeout=1)
+        except queue.Empty:
+            if not worker.is_alive():
+                raise RuntimeError(f'Reader worker {worker.pid} died with '
+                                   f'exit code {worker.exitcode}.')
+
+
+def _work(reader, ids, q):
+    try:
+        if hasattr(reader, '_connect'):
+            reader._connect()  # pylint: disable=protected-access
+        for instances in reader._read_ids(ids):  # pylint: disable=protected-access
+            q.put(instances)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception('Reader worker failed')
+        q.put(e)
+    else:
+        q.put(_DONE)
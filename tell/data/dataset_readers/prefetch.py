@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Union
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_DONE = object()
+
+
+def prefetch_documents(collection,
+                       ids: Sequence[Any],
+                       projection: Union[List[str], Dict[str, bool]] = None,
+                       batch_size: int = 64,
+                       join: Callable[[List[Dict[str, Any]]], None] = None,
+                       queue_size: int = 4) -> Iterator[Dict[str, Any]]:
+    """Fetch Mongo documents in batches on a background thread.
+
+    Instead of issuing one ``find_one`` per document, we fetch the documents
+    with ``$in`` queries of ``batch_size`` ids. The documents are yielded in
+    the same order as ``ids``, so a shuffled list of ids stays shuffled. Up to
+    ``queue_size`` batches are fetched ahead while the caller is busy
+    building instances. Documents that no longer exist are skipped.
+
+    Parameters
+    ----------
+    collection : ``pymongo.collection.Collection``
+        The collection to fetch from. MongoClient is thread-safe, so this can
+        be shared with the reader.
+    ids : ``Sequence[Any]``
+        The ``_id`` of each document to fetch.
+    projection : ``List[str]`` or ``Dict[str, bool]``, optional
+        The fields to return (or to exclude), as in ``find``.
+    batch_size : ``int``
+        Number of documents to fetch in a single query.
+    join : ``Callable``, optional
+        Called on the background thread with each batch of documents. Use
+        this to look up related documents (e.g. the detected objects) in bulk
+        and attach them to the documents in place.
+    queue_size : ``int``
+        Maximum number of batches to fetch ahead.
+    """
+    batches: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the consumer has stopped reading.
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch():
+        try:
+            for start in range(0, len(ids), batch_size):
+                batch_ids = list(ids[start:start + batch_size])
+                cursor = collection.find({'_id': {'$in': batch_ids}},
+                                         projection=projection)
+                docs = {doc['_id']: doc for doc in cursor}
+                docs = [docs[i] for i in batch_ids if i in docs]
+                if join is not None:
+                    join(docs)
+                if not put(docs):
+                    return
+        except Exception as e:  # pylint: disable=broad-except
+            put(e)
+        else:
+            put(_DONE)
+
+    thread = threading.Thread(target=fetch, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            docs = batches.get()
+            if docs is _DONE:
+                break
+            if isinstance(docs, Exception):
+                raise docs
+            yield from docs
+    finally:
+        stop.set()
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from allennlp.data.token_indexers import SingleIdTokenIndexer
+from allennlp.data.tokenizers import Token
+
+from tell.commands.compile_dataset import compile_dataset_from_file
+from tell.data.dataset_readers import (NYTimesCompiledReader,
+                                       NYTimesFacesNERMatchedReader)
+from tell.data.stores import FeatureStore, FeatureStoreWriter, get_image_key
+
+
+class SplitTokenizer:
+    def tokenize(self, text):
+        return [Token(word) for word in text.split()]
+
+
+def make_articles(image_dir, n_articles):
+    rs = np.random.RandomState(0)
+    articles = []
+    for i in range(n_articles):
+        samples = []
+        for pos in range(1, 1 + i % 3):
+            image_path = os.path.join(image_dir, f'{i}-{pos}.jpg')
+            samples.append({
+                'paragraphs': [f'Title {i}', f'Paragraph {pos} of {i}'],
+                'named_entities': [f'Person {j}' for j in range(pos - 1)],
+                'caption': f'Caption {pos} of article {i}',
+                'image_path': image_path,
+                'web_url': f'https://www.nytimes.com/{i}',
+                'pos': pos,
+                'face_embeds': rs.randn(pos, 512).astype(np.float32),
+                'obj_feats': rs.randn(3, 2048).astype(np.float32),
+            })
+        articles.append({'_id': i, 'samples': samples})
+    return articles
+
+
+def describe(instance):
+    """Turn the fields of an instance into plain Python values."""
+    fields = {}
+    for name, field in instance.fields.items():
+        if hasattr(field, 'tokens'):
+            fields[name] = [t.text for t in field.tokens]
+        elif hasattr(field, 'field_list'):
+            fields[name] = [[t.text for t in f.tokens]
+                            for f in field.field_list]
+        elif hasattr(field, 'metadata'):
+            fields[name] = field.metadata
+        else:
+            fields[name] = np.asarray(field.array).tolist()
+    return fields
+
+
+class TestNYTimesCompiledReader(unittest.TestCase):
+    def test_compiled_instances_match_live_samples(self):
+        with tempfile.TemporaryDirectory() as root:
+            image_dir = os.path.join(root, 'images')
+            feature_dir = os.path.join(root, 'features')
+            os.makedirs(image_dir)
+            articles = make_articles(image_dir, 6)
+
+            rs = np.random.RandomState(1)
+            with FeatureStoreWriter(feature_dir, [8], 'float32') as writer:
+                for article in articles:
+                    for sample in article['samples']:
+                        with open(sample['image_path'], 'wb') as f:
+                            f.write(rs.bytes(64))
+                        key = get_image_key(image_dir, sample['image_path'])
+                        writer.add(key, rs.randn(49, 8))
+
+            tokenizer = SplitTokenizer()
+            token_indexers = {'roberta': SingleIdTokenIndexer()}
+
+            # The live reader gets its articles from MongoDB
+            live_reader = NYTimesFacesNERMatchedReader.__new__(
+                NYTimesFacesNERMatchedReader)
+            live_reader._tokenizer = tokenizer
+            live_reader._token_indexers = token_indexers
+            live_reader.image_dir = image_dir
+            live_reader.image_feature_store = None
+            live_reader.image_cache = None
+            with mock.patch.object(live_reader, '_get_ids'), \
+                    mock.patch.object(live_reader, '_get_articles',
+                                      return_value=articles), \
+                    mock.patch.object(live_reader, '_get_samples',
+                                      side_effect=lambda a: a['samples']):
+                samples = [dict(sample)
+                           for sample in live_reader.read_samples('train')]
+
+                # tell compile-dataset builds the reader from the config
+                module = 'tell.commands.compile_dataset'
+                with mock.patch(f'{module}.yaml_to_params'), \
+                        mock.patch(f'{module}.DatasetReader.from_params',
+                                   return_value=live_reader):
+                    compile_dataset_from_file('config.yaml', root, 'train')
+
+            self.assertEqual(len(samples), sum(i % 3 for i in range(6)))
+
+            # The instances that the live reader builds from the samples
+            live_reader.image_feature_store = FeatureStore(feature_dir)
+            expected = [describe(live_reader.article_to_instance(
+                image=live_reader.image_feature_store[
+                    get_image_key(image_dir, sample['image_path'])],
+                **sample)) for sample in samples]
+            image_paths = [sample['image_path'] for sample in samples]
+
+            for shuffle in [False, True]:
+                reader = NYTimesCompiledReader(
+                    tokenizer, token_indexers, root, shuffle=shuffle,
+                    image_feature_dir=feature_dir)
+                instances = [describe(x) for x in reader.read('train')]
+                paths = [x['metadata']['image_path'] for x in instances]
+                if shuffle:
+                    self.assertNotEqual(paths, image_paths)
+                    self.assertEqual(sorted(paths), sorted(image_paths))
+                    instances.sort(
+                        key=lambda x: image_paths.index(
+                            x['metadata']['image_path']))
+                else:
+                    self.assertEqual(paths, image_paths)
+                self.assertEqual(instances, expected)
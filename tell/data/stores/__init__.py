@@ -0,0 +1,3 @@
+from .article_store import LAYER_MODES, ArticleFeatureStore, get_article_key
+from .feature_store import FeatureStore, FeatureStoreWriter, get_image_key
+from .record_store import RecordStore, RecordWriter
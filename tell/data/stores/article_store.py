@@ -0,0 +1,66 @@
+import hashlib
+from typing import Optional
+
+import numpy as np
+import torch
+
+from .feature_store import FeatureStore
+
+# Which RoBERTa hidden states we keep for each article token:
+#   last  - only the final layer, row shape [1024].
+#   all   - every hidden state, row shape [n_layers, 1024], to be mixed by
+#           a trainable bert_weight in the model.
+#   mixed - the hidden states already mixed with a frozen bert_weight taken
+#           from a trained model, row shape [1024].
+LAYER_MODES = ('last', 'all', 'mixed')
+
+
+def get_article_key(token_ids) -> str:
+    """Hash the (unpadded) token ids of an article context."""
+    token_ids = np.asarray(token_ids, dtype=np.int64)
+    return hashlib.sha1(token_ids.tobytes()).hexdigest()
+
+
+class ArticleFeatureStore(FeatureStore):
+    """RoBERTa hidden states of article contexts, keyed by their token ids.
+
+    Written by ``tell extract-article-features``. Each record has one row per
+    non-padding token of the context.
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.layers = self.meta.get('layers', 'last')
+
+    def check_compatible(self, weigh_bert: bool) -> None:
+        if self.layers == 'last' and weigh_bert:
+            raise ValueError(f'{self.root} only contains the final RoBERTa '
+                             f'layer, but weigh_bert is enabled.')
+        if self.layers in ['all', 'mixed'] and not weigh_bert:
+            raise ValueError(f'{self.root} contains {self.layers} RoBERTa '
+                             f'layers, but weigh_bert is disabled.')
+
+    def lookup(self, article_ids: torch.LongTensor, padding_idx: int,
+               dtype: torch.dtype = torch.float) -> Optional[torch.Tensor]:
+        """Get the cached hidden states of a padded batch of articles.
+
+        Returns a tensor of shape [batch_size, seq_len, *row_shape] on the same
+        device as ``article_ids``, or None if any article is not in the store.
+        The padding positions are filled with zeros.
+        """
+        ids = article_ids.cpu().numpy()
+        B, S = ids.shape
+
+        records = []
+        for row in ids:
+            key = get_article_key(row[row != padding_idx])
+            if key not in self.index:
+                return None
+            records.append(self[key])
+
+        X_article = np.zeros((B, S) + self.row_shape, dtype=self.dtype)
+        for i, record in enumerate(records):
+            X_article[i, :len(record)] = record
+
+        X_article = torch.from_numpy(X_article)
+        return X_article.to(device=article_ids.device, dtype=dtype)
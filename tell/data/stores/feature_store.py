@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+from glob import glob
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.json'
+SHARD_PATTERN = 'shard-{:05d}.bin'
+
+
+def get_image_key(image_dir, image_path):
+    """Turn an image path into the key used by the feature stores.
+
+    For NYTimes800k this is simply the image hash, and for GoodNews it is the
+    sample ID, since both datasets name their images `{key}.jpg`.
+    """
+    rel_path = os.path.relpath(image_path, image_dir)
+    return os.path.splitext(rel_path)[0]
+
+
+class FeatureStore:
+    """Read-only access to features precomputed by ``FeatureStoreWriter``.
+
+    Each record is a 2D array of shape [n_rows, *row_shape]. The number of
+    rows can vary between records (e.g. article lengths), but the row shape
+    and the dtype are fixed for the whole store. Records are stored
+    contiguously in flat binary shards, which we memory-map lazily so that
+    looking up a record only returns a view into the page cache.
+
+    Parameters
+    ----------
+    root : str
+        The directory created by ``FeatureStoreWriter``.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        with open(os.path.join(root, META_FILE)) as f:
+            meta = json.load(f)
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            self.index: Dict[str, Tuple[int, int, int]] = json.load(f)
+
+        self.dtype = np.dtype(meta['dtype'])
+        self.row_shape = tuple(meta['row_shape'])
+        self.meta = meta
+        self._shards: Dict[int, np.memmap] = {}
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        shard, start, length = self.index[key]
+        return self._get_shard(shard)[start:start + length]
+
+    def get(self, key, default=None):
+        if key not in self.index:
+            return default
+        return self[key]
+
+    def keys(self):
+        return self.index.keys()
+
+    def _get_shard(self, shard):
+        if shard not in self._shards:
+            path = os.path.join(self.root, SHARD_PATTERN.format(shard))
+            self._shards[shard] = np.memmap(path, dtype=self.dtype, mode='r').reshape(
+                (-1,) + self.row_shape)
+        return self._shards[shard]
+
+    def __getstate__(self):
+        # Memory maps are not picklable. Worker processes will re-open the
+        # shards on first access.
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+
+class FeatureStoreWriter:
+    """Append records to a sharded, memory-mappable feature store.
+
+    Re-opening an existing store resumes it: previously written records are
+    kept and new records go to a fresh shard.
+
+    Parameters
+    ----------
+    root : str
+        Output directory.
+    row_shape : List[int]
+        Shape of a single row, e.g. [2048] for the ResNet image grid where each
+        image has 49 rows.
+    dtype : str
+        Numpy dtype of the stored features. We default to float16 to halve
+        the disk footprint and the page cache pressure.
+    max_shard_bytes : int
+        Start a new shard once the current one grows beyond this size.
+    meta : Dict[str, Any], optional
+        Extra information to store alongside the dtype and the row shape. It
+        must match when resuming a store.
+    """
+
+    def __init__(self, root: str, row_shape: List[int], dtype: str = 'float16',
+                 max_shard_bytes: int = 1 << 30,
+                 meta: Dict[str, Any] = None) -> None:
+        self.root = root
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(root, exist_ok=True)
+
+        extra_meta = meta
+        meta_path = os.path.join(root, META_FILE)
+        self.index: Dict[str, Tuple[int, int, int]] = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if tuple(meta['row_shape']) != self.row_shape or \
+                    np.dtype(meta['dtype']) != self.dtype:
+                raise ValueError(f'Existing store at {root} has row shape '
+                                 f'{meta["row_shape"]} and dtype {meta["dtype"]}.')
+            for key, value in (extra_meta or {}).items():
+                if meta.get(key) != value:
+                    raise ValueError(f'Existing store at {root} has {key} '
+                                     f'{meta.get(key)}, not {value}.')
+            with open(os.path.join(root, INDEX_FILE)) as f:
+                self.index = json.load(f)
+            logger.info(f'Resuming feature store with {len(self.index)} records.')
+
+        self.meta = {'dtype': self.dtype.name, 'row_shape': list(self.row_shape),
+                     **(extra_meta or {})}
+        with open(meta_path, 'w') as f:
+            json.dump(self.meta, f)
+
+        n_shards = len(glob(os.path.join(root, 'shard-*.bin')))
+        self.shard = n_shards - 1
+        self.n_rows = 0
+        self.file = None
+        self._new_shard()
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def add(self, key: str, array: np.ndarray) -> None:
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        assert array.shape[1:] == self.row_shape, \
+            f'Expected rows of shape {self.row_shape}, got {array.shape[1:]}'
+
+        if self.n_rows > 0 and self.file.tell() + array.nbytes > self.max_shard_bytes:
+            self._new_shard()
+
+        self.file.write(array.tobytes())
+        self.index[key] = (self.shard, self.n_rows, array.shape[0])
+        self.n_rows += array.shape[0]
+
+    def flush(self):
+        """Persist the index so that the records written so far are usable."""
+        self.file.flush()
+        tmp_path = os.path.join(self.root, INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, os.path.join(self.root, INDEX_FILE))
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def _new_shard(self):
+        if self.file is not None:
+            self.file.close()
+        self.shard += 1
+        self.n_rows = 0
+        path = os.path.join(self.root, SHARD_PATTERN.format(self.shard))
+        self.file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
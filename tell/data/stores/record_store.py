@@ -0,0 +1,120 @@
+import logging
+import os
+import pickle
+from glob import glob
+from typing import Any, Dict, Iterator
+
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+INDEX_FILE = 'index.npy'
+SHARD_PATTERN = 'records-{:05d}.bin'
+
+
+class RecordStore:
+    """Read records written by ``RecordWriter``.
+
+    Records can either be streamed in the order they were written, which
+    only does sequential reads, or accessed at random by their position.
+
+    Parameters
+    ----------
+    root : str
+        The directory created by ``RecordWriter``.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.index = np.load(os.path.join(root, INDEX_FILE))
+        # index.shape == [n_records, 3], where the columns are the shard, the
+        # byte offset, and the byte length.
+        self._shards: Dict[int, np.memmap] = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        shard, offset, length = self.index[i]
+        data = self._get_shard(shard)[offset:offset + length]
+        return pickle.loads(data.tobytes())
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        shards = np.unique(self.index[:, 0])
+        for shard in shards:
+            rows = self.index[self.index[:, 0] == shard]
+            path = os.path.join(self.root, SHARD_PATTERN.format(shard))
+            with open(path, 'rb') as f:
+                for _, offset, length in rows:
+                    f.seek(offset)
+                    yield pickle.loads(f.read(length))
+
+    def _get_shard(self, shard):
+        if shard not in self._shards:
+            path = os.path.join(self.root, SHARD_PATTERN.format(shard))
+            self._shards[shard] = np.memmap(path, dtype=np.uint8, mode='r')
+        return self._shards[shard]
+
+    def __getstate__(self):
+        # Memory maps are not picklable.
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+
+class RecordWriter:
+    """Write a sequence of records (dicts of numpy arrays, strings, etc.) to
+    sharded binary files with an offset index.
+
+    Any existing records in ``root`` are overwritten.
+
+    Parameters
+    ----------
+    root : str
+        Output directory.
+    max_shard_bytes : int
+        Start a new shard once the current one grows beyond this size.
+    """
+
+    def __init__(self, root: str, max_shard_bytes: int = 1 << 30) -> None:
+        self.root = root
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(root, exist_ok=True)
+        for path in glob(os.path.join(root, 'records-*.bin')):
+            os.remove(path)
+
+        self.index = []
+        self.shard = -1
+        self.file = None
+        self._new_shard()
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, record: Dict[str, Any]) -> None:
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self.file.tell()
+        if offset > 0 and offset + len(data) > self.max_shard_bytes:
+            self._new_shard()
+            offset = 0
+
+        self.file.write(data)
+        self.index.append((self.shard, offset, len(data)))
+
+    def close(self):
+        self.file.close()
+        index = np.array(self.index, dtype=np.int64).reshape(-1, 3)
+        np.save(os.path.join(self.root, INDEX_FILE), index)
+
+    def _new_shard(self):
+        if self.file is not None:
+            self.file.close()
+        self.shard += 1
+        path = os.path.join(self.root, SHARD_PATTERN.format(self.shard))
+        self.file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
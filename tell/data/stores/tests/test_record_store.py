@@ -0,0 +1,78 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from tell.data.stores import RecordStore, RecordWriter
+
+
+def make_records(n):
+    rs = np.random.RandomState(0)
+    return [{'caption': f'Caption {i}',
+             'named_entities': [f'Name {j}' for j in range(i % 3)],
+             'face_embeds': rs.randn(i % 4, 512).astype(np.float32),
+             'image_bytes': rs.bytes(100 + 50 * i)}
+            for i in range(n)]
+
+
+class TestRecordStore(unittest.TestCase):
+    def assertRecordEqual(self, record, expected):
+        self.assertEqual(record.keys(), expected.keys())
+        for key, value in expected.items():
+            if isinstance(value, np.ndarray):
+                np.testing.assert_array_equal(record[key], value)
+            else:
+                self.assertEqual(record[key], value)
+
+    def test_round_trip(self):
+        records = make_records(10)
+        with tempfile.TemporaryDirectory() as root:
+            # Small shards, so that the records span several of them
+            with RecordWriter(root, max_shard_bytes=4096) as writer:
+                for record in records:
+                    writer.add(record)
+            self.assertEqual(len(writer), 10)
+
+            store = RecordStore(root)
+            self.assertEqual(len(store), 10)
+            self.assertEqual(store.index.shape, (10, 3))
+            n_shards = len(np.unique(store.index[:, 0]))
+            self.assertGreater(n_shards, 1)
+            self.assertEqual(
+                len([f for f in os.listdir(root) if f.endswith('.bin')]),
+                n_shards)
+
+            # Random access in any order
+            for i in [7, 0, 9, 3, 3]:
+                self.assertRecordEqual(store[i], records[i])
+
+            # Streaming returns the records in the order they were written
+            streamed = list(store)
+            self.assertEqual(len(streamed), 10)
+            for record, expected in zip(streamed, records):
+                self.assertRecordEqual(record, expected)
+
+            # The store can be sent to data loader workers after use
+            store = pickle.loads(pickle.dumps(store))
+            self.assertRecordEqual(store[5], records[5])
+
+    def test_writer_overwrites_existing_records(self):
+        with tempfile.TemporaryDirectory() as root:
+            with RecordWriter(root, max_shard_bytes=1024) as writer:
+                for record in make_records(10):
+                    writer.add(record)
+
+            records = make_records(2)
+            with RecordWriter(root) as writer:
+                for record in records:
+                    writer.add(record)
+
+            store = RecordStore(root)
+            self.assertEqual(len(store), 2)
+            self.assertEqual(
+                [f for f in os.listdir(root) if f.endswith('.bin')],
+                ['records-00000.bin'])
+            for record, expected in zip(store, records):
+                self.assertRecordEqual(record, expected)
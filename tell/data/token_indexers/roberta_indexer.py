@@ -9,6 +9,8 @@ from allennlp.data.vocabulary import Vocabulary
 from overrides import overrides
 from spacy.tokens import Doc
 
+from tell.utils.roberta import get_roberta_bpe
+
 SPACE_NORMALIZER = re.compile(r"\s+")
 
 
@@ -43,10 +45,9 @@ class RobertaTokenIndexer(TokenIndexer[int]):
                  padding_value: int = 1,
                  max_len: int = 512) -> None:
         super().__init__(token_min_padding_length)
-        roberta = torch.hub.load('pytorch/fairseq:2f7e3f3323', 'roberta.base')
-        self.source_dictionary = roberta.task.source_dictionary
-        self.bpe = roberta.bpe.bpe
-        self.bpe_legacy = roberta.bpe
+        bpe, self.source_dictionary = get_roberta_bpe()
+        self.bpe = bpe.bpe
+        self.bpe_legacy = bpe
         self._added_to_vocabulary = False
         self._namespace = namespace
         self._padding_on_right = padding_on_right
@@ -3,7 +3,45 @@ from allennlp.common.registrable import Registrable
 
 
 class Decoder(Registrable, nn.Module):
-    pass
+    def reorder_incremental_state(self, incremental_state, new_order):
+        """Reorder the incremental state of every submodule.
+
+        Each module knows which dimension of its buffers is the batch, so we
+        let them reorder their own state. Use this to drop finished captions
+        and to follow the surviving hypotheses in beam search.
+        """
+        if incremental_state is None:
+            return
+
+        def apply_reorder(module):
+            if module is not self and hasattr(module, 'reorder_incremental_state'):
+                module.reorder_incremental_state(incremental_state, new_order)
+
+        self.apply(apply_reorder)
+
+    def extend_incremental_state(self, incremental_state, n_new):
+        """Append `n_new` sequences with an empty history to the batch.
+
+        This lets us start new captions while the rest of the batch is still
+        being generated. The new sequences come after the existing ones, and
+        the contexts passed to the next step must follow the same order.
+        """
+        if incremental_state is None:
+            return
+
+        def apply_extend(module):
+            if module is not self and hasattr(module, 'extend_incremental_state'):
+                module.extend_incremental_state(incremental_state, n_new)
+
+        self.apply(apply_extend)
+
+    def set_beam_size(self, beam_size):
+        """Tell the submodules how many hypotheses share each context."""
+        def apply_set_beam_size(module):
+            if module is not self and hasattr(module, 'set_beam_size'):
+                module.set_beam_size(beam_size)
+
+        self.apply(apply_set_beam_size)
 
 
 class DecoderLayer(Registrable, nn.Module):
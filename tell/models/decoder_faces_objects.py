@@ -173,12 +173,19 @@ class DynamicConvFacesObjectsDecoder(Decoder):
         else:
             return F.softmax(logits, dim=-1)
 
+    def get_topk_log_probs(self, net_output, k):
+        """Get the k most likely next words and their log probs."""
+        if hasattr(self, 'adaptive_softmax') and self.adaptive_softmax is not None:
+            return self.adaptive_softmax.topk_log_prob(net_output[0], k)
+
+        lprobs = self.get_normalized_probs(net_output, log_probs=True)
+        return lprobs.topk(k)
+
     def filter_incremental_state(self, incremental_state, active_idx):
-        if incremental_state is None:
+        if incremental_state is None or active_idx.all():
             return
-        for key in incremental_state:
-            if 'DynamicConv1dTBC' in key:
-                incremental_state[key] = incremental_state[key][:, active_idx]
+        new_order = active_idx.nonzero().squeeze(1)
+        self.reorder_incremental_state(incremental_state, new_order)
 
 
 @DecoderLayer.register('dynamic_conv_faces_objects')
@@ -224,22 +231,22 @@ class DynamicConvDecoderLayer(DecoderLayer):
 
         self.context_attns['image'] = MultiHeadAttention(
             self.embed_dim, decoder_attention_heads, kdim=C, vdim=C,
-            dropout=attention_dropout)
+            dropout=attention_dropout, encoder_decoder_attention=True)
         self.context_attn_lns['image'] = nn.LayerNorm(self.embed_dim)
 
         self.context_attns['article'] = MultiHeadAttention(
             self.embed_dim, decoder_attention_heads, kdim=1024, vdim=1024,
-            dropout=attention_dropout)
+            dropout=attention_dropout, encoder_decoder_attention=True)
         self.context_attn_lns['article'] = nn.LayerNorm(self.embed_dim)
 
         self.context_attns['faces'] = MultiHeadAttention(
             self.embed_dim, decoder_attention_heads, kdim=512, vdim=512,
-            dropout=attention_dropout)
+            dropout=attention_dropout, encoder_decoder_attention=True)
         self.context_attn_lns['faces'] = nn.LayerNorm(self.embed_dim)
 
         self.context_attns['obj'] = MultiHeadAttention(
             self.embed_dim, decoder_attention_heads, kdim=2048, vdim=2048,
-            dropout=attention_dropout)
+            dropout=attention_dropout, encoder_decoder_attention=True)
         self.context_attn_lns['obj'] = nn.LayerNorm(self.embed_dim)
 
         context_size = self.embed_dim * 4
@@ -250,7 +257,8 @@ class DynamicConvDecoderLayer(DecoderLayer):
         self.fc2 = GehringLinear(decoder_ffn_embed_dim, self.embed_dim)
 
         self.final_layer_norm = nn.LayerNorm(self.embed_dim)
-        self.need_attn = True
+        self.need_attn = False
+        self.attn_modalities = None
         self.swap = swap
 
     def forward(self, X, contexts, incremental_state):
@@ -278,16 +286,16 @@ class DynamicConvDecoderLayer(DecoderLayer):
             key=contexts['image'],
             value=contexts['image'],
             key_padding_mask=contexts['image_mask'],
-            incremental_state=None,
+            incremental_state=incremental_state,
             static_kv=True,
-            need_weights=(not self.training and self.need_attn))
+            need_weights=self._need_weights('image'))
         X_image = F.dropout(X_image, p=self.dropout, training=self.training)
         X_image = residual + X_image
         X_image = self.maybe_layer_norm(
             self.context_attn_lns['image'], X_image, after=True)
         X_contexts.append(X_image)
         if attn is not None:
-            attns['image'] = attn.cpu().detach().numpy()
+            attns['image'] = attn.detach()
 
         # Article attention
         residual = X
@@ -298,9 +306,9 @@ class DynamicConvDecoderLayer(DecoderLayer):
             key=contexts['article'],
             value=contexts['article'],
             key_padding_mask=contexts['article_mask'],
-            incremental_state=None,
+            incremental_state=incremental_state,
             static_kv=True,
-            need_weights=(not self.training and self.need_attn))
+            need_weights=self._need_weights('article'))
         X_article = F.dropout(X_article, p=self.dropout,
                               training=self.training)
         X_article = residual + X_article
@@ -308,7 +316,7 @@ class DynamicConvDecoderLayer(DecoderLayer):
             self.context_attn_lns['article'], X_article, after=True)
         X_contexts.append(X_article)
         if attn is not None:
-            attns['article'] = attn.cpu().detach().numpy()
+            attns['article'] = attn.detach()
 
         # Face attention
         residual = X
@@ -319,9 +327,9 @@ class DynamicConvDecoderLayer(DecoderLayer):
             key=contexts['faces'],
             value=contexts['faces'],
             key_padding_mask=contexts['faces_mask'],
-            incremental_state=None,
+            incremental_state=incremental_state,
             static_kv=True,
-            need_weights=(not self.training and self.need_attn))
+            need_weights=self._need_weights('faces'))
         X_faces = F.dropout(X_faces, p=self.dropout,
                             training=self.training)
         X_faces = residual + X_faces
@@ -329,7 +337,7 @@ class DynamicConvDecoderLayer(DecoderLayer):
             self.context_attn_lns['faces'], X_faces, after=True)
         X_contexts.append(X_faces)
         if attn is not None:
-            attns['faces'] = attn.cpu().detach().numpy()
+            attns['faces'] = attn.detach()
 
         # Object attention
         residual = X
@@ -340,9 +348,9 @@ class DynamicConvDecoderLayer(DecoderLayer):
             key=contexts['obj'],
             value=contexts['obj'],
             key_padding_mask=contexts['obj_mask'],
-            incremental_state=None,
+            incremental_state=incremental_state,
             static_kv=True,
-            need_weights=(not self.training and self.need_attn))
+            need_weights=self._need_weights('obj'))
         X_objs = F.dropout(X_objs, p=self.dropout,
                            training=self.training)
         X_objs = residual + X_objs
@@ -350,7 +358,7 @@ class DynamicConvDecoderLayer(DecoderLayer):
             self.context_attn_lns['obj'], X_objs, after=True)
         X_contexts.append(X_objs)
         if attn is not None:
-            attns['obj'] = attn.cpu().detach().numpy()
+            attns['obj'] = attn.detach()
 
         X_context = torch.cat(X_contexts, dim=-1)
         X = self.context_fc(X_context)
@@ -372,8 +380,16 @@ class DynamicConvDecoderLayer(DecoderLayer):
         else:
             return X
 
-    def make_generation_fast_(self, need_attn=False, **kwargs):
+    def make_generation_fast_(self, need_attn=False, attn_modalities=None, **kwargs):
         self.need_attn = need_attn
+        self.attn_modalities = attn_modalities
+
+    def _need_weights(self, modality):
+        # The attention weights are only returned when the model asks for
+        # them, and they stay on the device.
+        if self.training or not self.need_attn:
+            return False
+        return self.attn_modalities is None or modality in self.attn_modalities
 
     def extra_repr(self):
         return 'dropout={}, relu_dropout={}, input_dropout={}, normalize_before={}'.format(
@@ -173,11 +173,10 @@ class DynamicConvFacesParallelDecoder(Decoder):
             return F.softmax(logits, dim=-1)
 
     def filter_incremental_state(self, incremental_state, active_idx):
-        if incremental_state is None:
+        if incremental_state is None or active_idx.all():
             return
-        for key in incremental_state:
-            if 'DynamicConv1dTBC' in key:
-                incremental_state[key] = incremental_state[key][:, active_idx]
+        new_order = active_idx.nonzero().squeeze(1)
+        self.reorder_incremental_state(incremental_state, new_order)
 
 
 @DecoderLayer.register('dynamic_conv_faces_parallel')
@@ -0,0 +1,184 @@
+from typing import Dict, List, Tuple
+
+import torch
+import torch.nn as nn
+
+from tell.modules import DynamicConv1dTBC, LightweightConv1dTBC
+from tell.modules.token_embedders import (LearnedPositionalEmbedding,
+                                          SinusoidalPositionalEmbedding)
+from tell.utils import get_incremental_state, set_incremental_state
+
+MODALITIES = ['image', 'article', 'faces', 'obj']
+
+
+class ContextEncoder(nn.Module):
+    """Project the contexts into the keys and values of every context attention.
+
+    This is the part of the first decoding step that doesn't depend on the
+    caption. The keys and values of each modality are stacked over the
+    layers, with shape [n_layers, batch_size, n_heads, source_len, head_dim].
+    The source length includes the positions added by the attention (bias
+    and no attention).
+
+    The inputs are the contexts built by the model, except that the
+    embeddings are batch first: [batch_size, source_len, embed_size].
+    """
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self,  # type: ignore
+                image, image_mask, article, article_mask,
+                faces, faces_mask, obj, obj_mask) -> Tuple[torch.Tensor, ...]:
+        contexts = {
+            'image': (image.transpose(0, 1), image_mask),
+            'article': (article.transpose(0, 1), article_mask),
+            'faces': (faces.transpose(0, 1), faces_mask),
+            'obj': (obj.transpose(0, 1), obj_mask),
+        }
+        B = image.shape[0]
+
+        keys: Dict[str, List[torch.Tensor]] = {m: [] for m in MODALITIES}
+        values: Dict[str, List[torch.Tensor]] = {m: [] for m in MODALITIES}
+        for layer in self.decoder.layers:
+            for modal in MODALITIES:
+                attention = layer.context_attns[modal]
+                X, mask = contexts[modal]
+                query = X.new_zeros(1, B, attention.embed_dim)
+                incremental_state: Dict[str, Dict[str, torch.Tensor]] = {}
+                attention(query, X, X, key_padding_mask=mask,
+                          incremental_state=incremental_state,
+                          static_kv=True, need_weights=False)
+                saved_state = attention._get_input_buffer(incremental_state)
+                keys[modal].append(saved_state['prev_key'])
+                values[modal].append(saved_state['prev_value'])
+
+        outputs = []
+        for modal in MODALITIES:
+            outputs.append(torch.stack(keys[modal]))
+            outputs.append(torch.stack(values[modal]))
+        return tuple(outputs)
+
+
+class DecoderStep(nn.Module):
+    """Generate one token with the decoding state passed in explicitly.
+
+    The dict-based incremental state is built from the inputs at the start
+    of each call and read back at the end, so the traced graph only sees
+    tensors:
+
+    - `positions` has shape [batch_size]. It is the number of tokens that
+      each caption has seen so far.
+    - `conv_state` has shape [n_layers, max_kernel_size - 1, batch_size,
+      conv_dim]. It keeps the latest inputs of each convolution, oldest
+      first. A layer with a smaller kernel only uses the last rows.
+    - The context keys and values come from ``ContextEncoder``.
+
+    Instead of the ring position of the convolutions, which would be traced
+    as a constant, we always put the newest input into the last slot.
+
+    Returns the top k log probabilities and word indices of the next token,
+    and the new positions and convolution state.
+    """
+
+    def __init__(self, decoder, index: str, topk: int = 1):
+        super().__init__()
+        self.decoder = decoder
+        self.index = index
+        self.topk = topk
+        self.kernel_sizes = [layer.conv.kernel_size for layer in decoder.layers]
+        self.max_kernel_size = max(self.kernel_sizes)
+        self.conv_dim = decoder.layers[0].conv_dim
+        for layer in decoder.layers:
+            assert not getattr(layer.conv, 'in_proj', False)
+        self.positional = [m for m in decoder.modules() if isinstance(
+            m, (LearnedPositionalEmbedding, SinusoidalPositionalEmbedding))]
+
+    def forward(self,  # type: ignore
+                prev_ids, positions, conv_state,
+                image_mask, article_mask, faces_mask, obj_mask,
+                image_key, image_value, article_key, article_value,
+                faces_key, faces_value, obj_key, obj_value) -> Tuple[torch.Tensor, ...]:
+        # prev_ids.shape == [batch_size, 1]
+        incremental_state: Dict[str, torch.Tensor] = {}
+
+        for embedder in self.positional:
+            set_incremental_state(embedder, incremental_state, 'position',
+                                  positions)
+            # The position table is big enough for any caption
+            set_incremental_state(embedder, incremental_state,
+                                  'max_position', 0)
+
+        _, B, C = conv_state[0].shape
+        for l, layer in enumerate(self.decoder.layers):
+            K = self.kernel_sizes[l]
+            buffer = torch.cat([conv_state[l, self.max_kernel_size - K:],
+                                conv_state.new_zeros(1, B, C)])
+            if isinstance(layer.conv, DynamicConv1dTBC):
+                set_incremental_state(layer.conv, incremental_state,
+                                      'ring_buffer', buffer)
+                set_incremental_state(layer.conv, incremental_state,
+                                      'ring_step', K - 1)
+            elif isinstance(layer.conv, LightweightConv1dTBC):
+                set_incremental_state(layer.conv, incremental_state,
+                                      'input_buffer', buffer)
+                set_incremental_state(layer.conv, incremental_state,
+                                      'step', K - 1)
+
+        static_kv = {
+            'image': (image_key, image_value),
+            'article': (article_key, article_value),
+            'faces': (faces_key, faces_value),
+            'obj': (obj_key, obj_value),
+        }
+        for l, layer in enumerate(self.decoder.layers):
+            for modal in MODALITIES:
+                key, value = static_kv[modal]
+                layer.context_attns[modal]._set_input_buffer(
+                    incremental_state, {'prev_key': key[l],
+                                        'prev_value': value[l]})
+
+        # The keys and values are cached, so the contexts themselves are
+        # not needed.
+        contexts = {
+            'image': None,
+            'image_mask': image_mask,
+            'article': None,
+            'article_mask': article_mask,
+            'faces': None,
+            'faces_mask': faces_mask,
+            'obj': None,
+            'obj_mask': obj_mask,
+            'sections': None,
+            'sections_mask': None,
+        }
+        decoder_out = self.decoder({self.index: prev_ids}, contexts,
+                                   incremental_state=incremental_state)
+
+        # The adaptive top k takes data-dependent branches, which can't be
+        # traced. Computing the full distribution can.
+        lprobs = self.decoder.get_normalized_probs(
+            (decoder_out[0][:, -1:], None), log_probs=True)
+        topk_lprobs, topk_indices = lprobs.squeeze(1).topk(self.topk)
+        # topk_lprobs.shape == [batch_size, topk]
+
+        new_positions = get_incremental_state(
+            self.positional[0], incremental_state, 'position')
+
+        new_conv_state = []
+        for l, layer in enumerate(self.decoder.layers):
+            K = self.kernel_sizes[l]
+            key = 'ring_buffer' if isinstance(
+                layer.conv, DynamicConv1dTBC) else 'input_buffer'
+            buffer = get_incremental_state(layer.conv, incremental_state, key)
+            new_conv_state.append(torch.cat([
+                conv_state.new_zeros(self.max_kernel_size - K, B, C),
+                buffer[1:]]))
+
+        return (topk_lprobs, topk_indices, new_positions,
+                torch.stack(new_conv_state))
+
+    def get_conv_state_shape(self, batch_size):
+        return (len(self.kernel_sizes), self.max_kernel_size - 1,
+                batch_size, self.conv_dim)
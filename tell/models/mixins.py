@@ -0,0 +1,130 @@
+from typing import Any, Dict
+
+import torch
+import torch.nn.functional as F
+
+from tell.modules import BeamSearch
+from tell.utils import normalize_image
+
+
+class ImageEncoderMixin:
+    """Embed the image with ``self.resnet`` into a grid of 49 features."""
+
+    def _embed_image(self, image):
+        # The dataset reader can give us the precomputed ResNet grid instead
+        # of the raw image (see `tell extract-image-features`).
+        if image.dim() == 3:
+            # image.shape == [batch_size, 49, 2048]
+            return image
+
+        if image.dtype == torch.uint8:
+            # The reader gave us the raw pixels from the image cache
+            dtype = next(self.resnet.parameters()).dtype
+            image = normalize_image(image, dtype)
+
+        X_image = self.resnet(image)
+        # X_image.shape == [batch_size, 2048, 7, 7]
+
+        X_image = X_image.permute(0, 2, 3, 1)
+        # X_image.shape == [batch_size, 7, 7, 2048]
+
+        # Flatten out the image
+        B, H, W, C = X_image.shape
+        P = H * W  # number of pixels
+        X_image = X_image.view(B, P, C)
+        # X_image.shape == [batch_size, 49, 2048]
+
+        return X_image
+
+
+class ArticleEncoderMixin:
+    """Encode the article with ``self.roberta``, or look up its hidden states.
+
+    The model needs ``roberta``, ``padding_idx``, ``weigh_bert``,
+    ``article_feature_store`` and, if ``weigh_bert`` is set, ``bert_weight``.
+    """
+
+    def _encode_article(self, article_ids):
+        # Look up the hidden states precomputed by
+        # `tell extract-article-features`. We only skip RoBERTa if every
+        # article in the batch is in the store.
+        X_article = None
+        if self.article_feature_store is not None:
+            dtype = next(self.roberta.parameters()).dtype
+            X_article = self.article_feature_store.lookup(
+                article_ids, self.padding_idx, dtype)
+
+        if X_article is None:
+            X_sections_hiddens = self.roberta.extract_features(
+                article_ids, return_all_hiddens=True)
+            if not self.weigh_bert:
+                return X_sections_hiddens[-1]
+            X_article = torch.stack(X_sections_hiddens, dim=2)
+            # X_article.shape == [batch_size, seq_len, 25, embed_size]
+
+        elif X_article.dim() == 3:
+            # The store has either the final layer or the already mixed layers
+            return X_article
+
+        weight = F.softmax(self.bert_weight, dim=0)
+        weight = weight.unsqueeze(0).unsqueeze(1).unsqueeze(3)
+        # weight.shape == [1, 1, 25, 1]
+
+        X_article = (X_article * weight).sum(dim=2)
+        # X_article.shape == [batch_size, seq_len, embed_size]
+
+        return X_article
+
+
+class BeamSearchMixin:
+    """Generate captions with ``BeamSearch`` over the decoder contexts."""
+
+    def _search_beam(self, caption_ids, contexts, modalities):
+        incremental_state: Dict[str, Any] = {}
+        contexts_i = contexts
+
+        def step(prev_ids):
+            decoder_out = self.decoder(
+                {self.index: prev_ids},
+                contexts_i,
+                incremental_state=incremental_state)
+
+            # We're only interested in the current final word
+            decoder_out = (decoder_out[0][:, -1:], None)
+
+            lprobs = self.decoder.get_normalized_probs(
+                decoder_out, log_probs=True)
+            # lprobs.shape == [batch_size * beam_size, 1, vocab_size]
+
+            return lprobs.squeeze(1)
+
+        def reorder(hypo_order, caption_order):
+            nonlocal contexts_i
+            self.decoder.reorder_incremental_state(
+                incremental_state, hypo_order)
+            if caption_order is not None:
+                # The contexts are never copied to beam width. The context
+                # attentions share them among the hypotheses of each caption.
+                contexts_i = select_contexts(
+                    contexts_i, caption_order, modalities)
+
+        search = BeamSearch(self.beam_size, eos=2,
+                            padding_idx=self.padding_idx)
+        self.decoder.set_beam_size(self.beam_size)
+        try:
+            return search.search(caption_ids[:, 0:1], step, reorder)
+        finally:
+            self.decoder.set_beam_size(None)
+
+
+def select_contexts(contexts, index, modalities):
+    """Select the captions in `index` from the contexts of each modality.
+
+    The embeddings have shape [seq_len, batch_size, ...] and the masks have
+    shape [batch_size, seq_len].
+    """
+    selected = {'sections': None, 'sections_mask': None}
+    for modality in modalities:
+        selected[modality] = contexts[modality][:, index]
+        selected[f'{modality}_mask'] = contexts[f'{modality}_mask'][index]
+    return selected
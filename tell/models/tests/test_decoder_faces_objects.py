@@ -0,0 +1,58 @@
+import unittest
+
+import torch
+from allennlp.data.vocabulary import Vocabulary
+
+from tell.models.export import MODALITIES
+from tell.models.tests.utils import build_model
+
+
+def make_contexts(decoder, lengths, n_padded):
+    """Make random contexts in the layout of the model, with right padding."""
+    B = len(n_padded)
+    contexts = {'sections': None, 'sections_mask': None}
+    for modal in MODALITIES:
+        dim = decoder.layers[0].context_attns[modal].kdim
+        contexts[modal] = torch.randn(lengths[modal], B, dim)
+        mask = torch.zeros(B, lengths[modal], dtype=torch.bool)
+        if modal != 'image':
+            for i, n in enumerate(n_padded):
+                mask[i, lengths[modal] - n:] = True
+        contexts[f'{modal}_mask'] = mask
+    return contexts
+
+
+class TestDynamicConvFacesObjectsDecoder(unittest.TestCase):
+    def test_incremental_decoding_matches_teacher_forcing(self):
+        for conv_type in ['dynamic', 'lightweight']:
+            torch.manual_seed(0)
+            model = build_model(Vocabulary(), conv_type)
+            model._set_attn_capture(True, all_attns=True)
+            decoder = model.decoder
+            contexts = make_contexts(
+                decoder, {'image': 49, 'article': 11, 'faces': 4, 'obj': 6},
+                [3, 0, 5])
+            caption_ids = torch.randint(3, 200, (3, 6))
+            caption_ids[:, 0] = 0
+
+            with torch.no_grad():
+                expected, expected_out = decoder(
+                    {'roberta': caption_ids}, contexts)
+
+                # The context attention caches the projected contexts in the
+                # first step and reuses them afterwards.
+                incremental_state = {}
+                for i in range(caption_ids.shape[1]):
+                    X, out = decoder({'roberta': caption_ids[:, i:i + 1]},
+                                     contexts,
+                                     incremental_state=incremental_state)
+                    self.assertLess(
+                        (X - expected[:, i:i + 1]).abs().max().item(), 1e-4,
+                        (conv_type, i))
+                    for attns, expected_attns in zip(out['attn'],
+                                                     expected_out['attn']):
+                        for modal in MODALITIES:
+                            diff = attns[modal] - \
+                                expected_attns[modal][:, i:i + 1]
+                            self.assertLess(diff.abs().max().item(), 1e-5,
+                                            (conv_type, i, modal))
@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+import unittest
+
+import torch
+from allennlp.data.vocabulary import Vocabulary
+
+from tell.models.export import MODALITIES, ContextEncoder, DecoderStep
+from tell.models.tests.utils import build_model
+from tell.runtime import CaptionDecoder
+
+
+def make_contexts(decoder, lengths, n_padded):
+    """Make random batch-first contexts, with right padding in some rows."""
+    B = len(n_padded)
+    contexts = []
+    for modal in MODALITIES:
+        dim = decoder.layers[0].context_attns[modal].kdim
+        X = torch.randn(B, lengths[modal], dim)
+        mask = torch.zeros(B, lengths[modal], dtype=torch.bool)
+        if modal != 'image':
+            for i, n in enumerate(n_padded):
+                mask[i, lengths[modal] - n:] = True
+        contexts += [X, mask]
+    return contexts
+
+
+def export(model, out_dir):
+    decoder = model.decoder
+    encoder = ContextEncoder(decoder)
+    step = DecoderStep(decoder, model.index, topk=1)
+
+    contexts = make_contexts(
+        decoder, {'image': 49, 'article': 20, 'faces': 3, 'obj': 5}, [0, 1, 2])
+    keys_values = encoder(*contexts)
+    B = 3
+    step_inputs = (torch.LongTensor([[0], [50], [100]]), torch.arange(B),
+                   torch.randn(*step.get_conv_state_shape(B)),
+                   *contexts[1::2], *keys_values)
+
+    torch.jit.trace(encoder, tuple(contexts), check_trace=False).save(
+        os.path.join(out_dir, 'encoder.pt'))
+    torch.jit.trace(step, step_inputs, check_trace=False).save(
+        os.path.join(out_dir, 'step.pt'))
+
+    n_layers, n_history, _, conv_dim = step.get_conv_state_shape(1)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump({'modalities': MODALITIES,
+                   'context_dims': {m: decoder.layers[0].context_attns[m].kdim
+                                    for m in MODALITIES},
+                   'n_layers': n_layers,
+                   'n_history': n_history, 'conv_dim': conv_dim, 'topk': 1,
+                   'bos': 0, 'eos': 2, 'padding_idx': model.padding_idx}, f)
+
+
+class TestExport(unittest.TestCase):
+    def test_runtime_matches_greedy_generation(self):
+        for conv_type in ['dynamic', 'lightweight']:
+            torch.manual_seed(0)
+            model = build_model(Vocabulary(), conv_type)
+            with torch.no_grad(), tempfile.TemporaryDirectory() as out_dir:
+                export(model, out_dir)
+                runtime = CaptionDecoder(out_dir)
+
+                # Different lengths from the traced example
+                contexts = make_contexts(
+                    model.decoder,
+                    {'image': 49, 'article': 11, 'faces': 4, 'obj': 6},
+                    [3, 0, 5, 1])
+                _, token_ids = runtime.generate(*contexts)
+
+                model_contexts = {'sections': None, 'sections_mask': None}
+                for i, modal in enumerate(MODALITIES):
+                    model_contexts[modal] = contexts[2 * i].transpose(0, 1)
+                    model_contexts[f'{modal}_mask'] = contexts[2 * i + 1]
+                caption_ids = token_ids.new_zeros(4, 1)
+                _, expected_ids, _ = model._generate(caption_ids,
+                                                     model_contexts)
+
+            self.assertEqual(token_ids.tolist(), expected_ids.tolist(),
+                             conv_type)
@@ -0,0 +1,50 @@
+from unittest import mock
+
+import torch.nn as nn
+
+from tell.models.decoder_faces_objects import DynamicConvFacesObjectsDecoder
+from tell.models.transformer_faces_objects import TransformerFacesObjectModel
+from tell.modules.token_embedders import (AdaptiveEmbedding,
+                                          SinusoidalPositionalEmbedding,
+                                          SumTextFieldEmbedder)
+
+
+class FakeRoberta(nn.Module):
+    """Embed the article tokens in place of RoBERTa."""
+
+    def __init__(self, n_tokens, embed_dim):
+        super().__init__()
+        self.embed = nn.Embedding(n_tokens, embed_dim)
+
+    def extract_features(self, tokens, return_all_hiddens=False):
+        return [self.embed(tokens)]
+
+
+def build_model(vocab, conv_type, padding_value=1):
+    """Build a small random ``TransformerFacesObjectModel``.
+
+    The articles are embedded by ``FakeRoberta``, and the image is expected
+    to be the precomputed grid of ResNet features.
+    """
+    E, V = 32, 200
+    embedder = SumTextFieldEmbedder({
+        'adaptive': AdaptiveEmbedding(
+            None, 'bpe', padding_idx=1, initial_dim=E, factor=1,
+            output_dim=E, cutoff=[50, 100], vocab_size=V, scale_embeds=True),
+        'position': SinusoidalPositionalEmbedding(
+            None, E, padding_idx=1, left_pad=False, init_size=128),
+    }, {'adaptive': ['roberta'], 'position': ['roberta']}, True)
+    decoder = DynamicConvFacesObjectsDecoder(
+        None, embedder, 128, 0.1, True, E, E, True, conv_type, True, 4, 0.1,
+        0.0, 0.1, False, 0.1, 64, [3, 7], adaptive_softmax_cutoff=[50, 100],
+        tie_adaptive_weights=True, adaptive_softmax_factor=1,
+        decoder_layers=2, final_norm=False, padding_idx=1, vocab_size=V)
+
+    article_dim = decoder.layers[0].context_attns['article'].kdim
+    roberta = FakeRoberta(vocab.get_vocab_size('tokens'), article_dim)
+    with mock.patch('torch.hub.load', return_value=roberta), \
+            mock.patch('tell.models.transformer_faces_objects.resnet152',
+                       return_value=nn.Identity()):
+        model = TransformerFacesObjectModel(vocab, decoder, criterion=None,
+                                            padding_value=padding_value)
+    return model.eval()
@@ -5,21 +5,22 @@ from typing import Any, Dict, List
 
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
 from allennlp.data.vocabulary import Vocabulary
 from allennlp.models.model import Model
 from allennlp.nn.initializers import InitializerApplicator
 from overrides import overrides
 from pycocoevalcap.bleu.bleu_scorer import BleuScorer
 
+from tell.data.stores import ArticleFeatureStore
 from tell.modules.criteria import Criterion
 
 from .decoder_flattened import Decoder
+from .mixins import ArticleEncoderMixin, ImageEncoderMixin
 from .resnet import resnet152
 
 
 @Model.register("transformer_faces")
-class TransformerFacesModel(Model):
+class TransformerFacesModel(ArticleEncoderMixin, ImageEncoderMixin, Model):
     def __init__(self,
                  vocab: Vocabulary,
                  decoder: Decoder,
@@ -37,6 +38,7 @@ class TransformerFacesModel(Model):
                  sampling_topk: int = 1,
                  sampling_temp: float = 1.0,
                  weigh_bert: bool = False,
+                 article_feature_dir: str = None,
                  initializer: InitializerApplicator = InitializerApplicator()) -> None:
         super().__init__(vocab)
         self.decoder = decoder
@@ -57,6 +59,12 @@ class TransformerFacesModel(Model):
             self.bert_weight = nn.Parameter(torch.Tensor(25))
             nn.init.uniform_(self.bert_weight)
 
+        self.article_feature_store = None
+        if article_feature_dir:
+            self.article_feature_store = ArticleFeatureStore(
+                article_feature_dir)
+            self.article_feature_store.check_compatible(weigh_bert)
+
         self.n_batches = 0
         self.n_samples = 0
         self.sample_history: Dict[str, float] = defaultdict(float)
@@ -177,18 +185,11 @@ class TransformerFacesModel(Model):
         caption[self.index] = caption_ids
 
         # Embed the image
-        X_image = self.resnet(image)
-        # X_image.shape == [batch_size, 2048, 7, 7]
-
-        X_image = X_image.permute(0, 2, 3, 1)
-        # X_image.shape == [batch_size, 7, 7, 2048]
-
-        # Flatten out the image
-        B, H, W, C = X_image.shape
-        P = H * W  # number of pixels
-        X_image = X_image.view(B, P, C)
+        X_image = self._embed_image(image)
         # X_image.shape == [batch_size, 49, 2048]
 
+        B, P, _ = X_image.shape
+
         article_ids = context[self.index]
         # article_ids.shape == [batch_size, seq_len]
 
@@ -197,23 +198,8 @@ class TransformerFacesModel(Model):
 
         B, S = article_ids.shape
 
-        X_sections_hiddens = self.roberta.extract_features(
-            article_ids, return_all_hiddens=True)
-
-        if self.weigh_bert:
-            X_article = torch.stack(X_sections_hiddens, dim=2)
-            # X_article.shape == [batch_size, seq_len, 13, embed_size]
-
-            weight = F.softmax(self.bert_weight, dim=0)
-            weight = weight.unsqueeze(0).unsqueeze(1).unsqueeze(3)
-            # weight.shape == [1, 1, 13, 1]
-
-            X_article = (X_article * weight).sum(dim=2)
-            # X_article.shape == [batch_size, seq_len, embed_size]
-
-        else:
-            X_article = X_sections_hiddens[-1]
-            # X_article.shape == [batch_size, seq_len, embed_size]
+        X_article = self._encode_article(article_ids)
+        # X_article.shape == [batch_size, seq_len, embed_size]
 
         # Create padding mask (1 corresponds to the padding index)
         image_padding_mask = X_image.new_zeros(B, P).bool()
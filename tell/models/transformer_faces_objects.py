@@ -1,26 +1,29 @@
-import copy
 import math
 import re
 from collections import defaultdict
 from typing import Any, Dict, List
 
+import numpy as np
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
 from allennlp.data.vocabulary import Vocabulary
 from allennlp.models.model import Model
 from allennlp.nn.initializers import InitializerApplicator
 from overrides import overrides
 from pycocoevalcap.bleu.bleu_scorer import BleuScorer
 
+from tell.data.stores import ArticleFeatureStore
 from tell.modules.criteria import Criterion
+from tell.utils import segment_mean
 
 from .decoder_flattened import Decoder
+from .mixins import ArticleEncoderMixin, BeamSearchMixin, ImageEncoderMixin
 from .resnet import resnet152
 
 
 @Model.register("transformer_faces_objects")
-class TransformerFacesObjectModel(Model):
+class TransformerFacesObjectModel(ArticleEncoderMixin, BeamSearchMixin,
+                                  ImageEncoderMixin, Model):
     def __init__(self,
                  vocab: Vocabulary,
                  decoder: Decoder,
@@ -37,7 +40,12 @@ class TransformerFacesObjectModel(Model):
                  use_context: bool = True,
                  sampling_topk: int = 1,
                  sampling_temp: float = 1.0,
+                 beam_size: int = 1,
+                 capture_attns: bool = False,
+                 capture_layers: List[int] = None,
+                 capture_modalities: List[str] = None,
                  weigh_bert: bool = False,
+                 article_feature_dir: str = None,
                  initializer: InitializerApplicator = InitializerApplicator()) -> None:
         super().__init__(vocab)
         self.decoder = decoder
@@ -53,11 +61,21 @@ class TransformerFacesObjectModel(Model):
         self.evaluate_mode = evaluate_mode
         self.sampling_topk = sampling_topk
         self.sampling_temp = sampling_temp
+        self.beam_size = beam_size
+        self.capture_attns = capture_attns
+        self.capture_layers = capture_layers
+        self.capture_modalities = capture_modalities
         self.weigh_bert = weigh_bert
         if weigh_bert:
             self.bert_weight = nn.Parameter(torch.Tensor(25))
             nn.init.uniform_(self.bert_weight)
 
+        self.article_feature_store = None
+        if article_feature_dir:
+            self.article_feature_store = ArticleFeatureStore(
+                article_feature_dir)
+            self.article_feature_store.check_compatible(weigh_bert)
+
         self.n_batches = 0
         self.n_samples = 0
         self.sample_history: Dict[str, float] = defaultdict(float)
@@ -91,7 +109,9 @@ class TransformerFacesObjectModel(Model):
 
         # During evaluation, we will generate a caption and compute BLEU, etc.
         if not self.training and self.evaluate_mode:
-            _, gen_ids, attns = self._generate(caption_ids, contexts, attn_idx)
+            _, gen_ids, attns = self._generate(
+                caption_ids, contexts, attn_idx,
+                capture_attns=self.capture_attns)
             # We ignore <s> and <pad>
             gen_texts = [self.roberta.decode(x[x > 1]) for x in gen_ids.cpu()]
             captions = [m['caption'] for m in metadata]
@@ -151,163 +171,175 @@ class TransformerFacesObjectModel(Model):
         caption_ids, _, contexts = self._forward(
             context, image, caption, face_embeds, obj_embeds)
 
-        _, gen_ids, attns = self._generate(caption_ids, contexts)
+        # We need the attention over all layers and modalities below
+        _, gen_ids, attns = self._generate(caption_ids, contexts,
+                                           capture_attns=True,
+                                           all_attns=True)
 
         gen_ids = gen_ids.cpu().numpy().tolist()
         attns_list: List[List[Dict[str, Any]]] = []
 
+        attn_tensors = self.get_attn_tensors(attns)
         for i, token_ids in enumerate(gen_ids):
-            # Let's process the article text
-            article_ids = context[self.index][i]
-            article_ids = article_ids[article_ids != self.padding_idx]
-            article_ids = article_ids.cpu().numpy()
-            # article_ids.shape == [seq_len]
-
-            # remove <s>
-            if article_ids[0] == self.roberta.task.source_dictionary.bos():
-                article_ids = article_ids[1:]
-
-             # Ignore final </s> token
-            if article_ids[-1] == self.roberta.task.source_dictionary.eos():
-                article_ids = article_ids[:-1]
-
-            # Sanity check. We plus three because we removed <s>, </s> and
-            # the last two attention scores are for no attention and bias
-            assert article_ids.shape[0] == attns[0][0]['article'][i][0].shape[0] - 4
-
-            byte_ids = [int(self.roberta.task.source_dictionary[k])
-                        for k in article_ids]
-            # e.g. [16012, 17163, 447, 247, 82, 4640, 3437]
-
-            byte_strs = [self.roberta.bpe.bpe.decoder.get(token, token)
-                         for token in byte_ids]
-            # e.g. ['Sun', 'rise', 'âĢ', 'Ļ', 's', 'Ġexecutive', 'Ġdirector']
-
-            merged_article = []
-            article_mask = []
-            cursor = 0
-            a: Dict[str, Any] = {}
-            newline = False
-            for j, b in enumerate(byte_strs):
-                # Start a new word
-                if j == 0 or b[0] == 'Ġ' or b[0] == 'Ċ' or newline:
-                    if a:
-                        byte_text = ''.join(a['tokens'])
-                        a['text'] = bytearray([self.roberta.bpe.bpe.byte_decoder[c] for c in byte_text]).decode(
-                            'utf-8', errors=self.roberta.bpe.bpe.errors)
-                        merged_article.append(a)
-                        cursor += 1
-                    # Note that
-                    #   len(attns) == generation_length
-                    #   len(attns[j]) == n_layers
-                    #   attns[j][l] is a dictionary
-                    #   attns[j][l]['article'].shape == [batch_size, target_len, source_len]
-                    #   target_len == 1 since we generate one word at a time
-                    a = {'tokens': [b]}
-                    article_mask.append(cursor)
-                    newline = b[0] == 'Ċ'
-                else:
-                    a['tokens'].append(b)
-                    article_mask.append(cursor)
-            byte_text = ''.join(a['tokens'])
-            a['text'] = bytearray([self.roberta.bpe.bpe.byte_decoder[c] for c in byte_text]).decode(
-                'utf-8', errors=self.roberta.bpe.bpe.errors)
-            merged_article.append(a)
-
-            # Next let's process the caption text
-            attn_dicts: List[Dict[str, Any]] = []
-            # Ignore seed input <s>
-            if token_ids[0] == self.roberta.task.source_dictionary.bos():
-                token_ids = token_ids[1:]  # remove <s>
-            # Now len(token_ids) should be the same of len(attns)
-
-            assert len(attns) == len(token_ids)
-
-            # Ignore final </s> token
-            if token_ids[-1] == self.roberta.task.source_dictionary.eos():
-                token_ids = token_ids[:-1]
-            # Now len(token_ids) should be len(attns) - 1
-
-            byte_ids = [int(self.roberta.task.source_dictionary[k])
-                        for k in token_ids]
-            # e.g. [16012, 17163, 447, 247, 82, 4640, 3437]
-
-            byte_strs = [self.roberta.bpe.bpe.decoder.get(token, token)
-                         for token in byte_ids]
-            # e.g. ['Sun', 'rise', 'âĢ', 'Ļ', 's', 'Ġexecutive', 'Ġdirector']
-
-            # Merge by space
-            a: Dict[str, Any] = {}
-            for j, b in enumerate(byte_strs):
-                # Clean up article attention
-                article_attns = copy.deepcopy(merged_article)
-                start = 0
-                for word in article_attns:
-                    end = start + len(word['tokens'])
-                    layer_attns = []
-                    for layer in range(len(attns[j])):
-                        layer_attns.append(
-                            attns[j][layer]['article'][i][0][start:end].mean())
-                    word['attns'] = layer_attns
-                    start = end
-                    del word['tokens']
-
-                # Start a new word. Ġ is space
-                if j == 0 or b[0] == 'Ġ':
-                    if a:
-                        for l in range(len(a['attns']['image'])):
-                            for modal in ['image', 'faces', 'obj']:
-                                a['attns'][modal][l] /= len(a['tokens'])
-                                a['attns'][modal][l] = a['attns'][modal][l].tolist()
-                            for word in a['attns']['article']:
-                                word['attns'][l] /= len(a['tokens'])
-                                word['attns'][l] = word['attns'][l].tolist()
-                        byte_text = ''.join(a['tokens'])
-                        a['tokens'] = bytearray([self.roberta.bpe.bpe.byte_decoder[c] for c in byte_text]).decode(
-                            'utf-8', errors=self.roberta.bpe.bpe.errors)
-                        attn_dicts.append(a)
-                    # Note that
-                    #   len(attns) == generation_length
-                    #   len(attns[j]) == n_layers
-                    #   attns[j][l] is a dictionary
-                    #   attns[j][l]['article'].shape == [batch_size, target_len, source_len]
-                    #   target_len == 1 since we generate one word at a time
-                    a = {
-                        'tokens': [b],
-                        'attns': {
-                            'article': article_attns,
-                            'image': [attns[j][l]['image'][i][0] for l in range(len(attns[j]))],
-                            'faces': [attns[j][l]['faces'][i][0] for l in range(len(attns[j]))],
-                            'obj': [attns[j][l]['obj'][i][0] for l in range(len(attns[j]))],
-                        }
-                    }
-                else:
-                    a['tokens'].append(b)
-                    for l in range(len(a['attns']['image'])):
-                        for modal in ['image', 'faces', 'obj']:
-                            a['attns'][modal][l] += attns[j][l][modal][i][0]
-                        for w, word in enumerate(a['attns']['article']):
-                            word['attns'][l] += article_attns[w]['attns'][l]
-
-            for l in range(len(a['attns']['image'])):
-                for modal in ['image', 'faces', 'obj']:
-                    a['attns'][modal][l] /= len(a['tokens'])
-                    a['attns'][modal][l] = a['attns'][modal][l].tolist()
-                for word in a['attns']['article']:
-                    word['attns'][l] /= len(a['tokens'])
-                    word['attns'][l] = word['attns'][l].tolist()
-            byte_text = ''.join(a['tokens'])
-            a['tokens'] = bytearray([self.roberta.bpe.bpe.byte_decoder[c] for c in byte_text]).decode(
-                'utf-8', errors=self.roberta.bpe.bpe.errors)
-            attn_dicts.append(a)
-
-            attns_list.append(attn_dicts)
-
-            # gen_texts = [self.roberta.decode(
-            #     x[x != self.padding_idx]) for x in gen_ids]
+            attns_list.append(self.get_word_attns(
+                context[self.index][i], token_ids,
+                {modal: attn[i] for modal, attn in attn_tensors.items()}))
 
         return attns_list
 
+    def get_attn_tensors(self, attns):
+        """Stack the captured attention of each modality over steps and layers.
+
+        Note that
+          len(attns) == generation_length
+          len(attns[j]) == n_layers
+          attns[j][l] is a dictionary
+          attns[j][l]['article'].shape == [batch_size, target_len, source_len]
+          target_len == 1 since we generate one word at a time
+        """
+        n_layers = len(attns[0])
+        modalities = ['article', 'image', 'faces', 'obj']
+        attn_tensors = {}
+        for modal in modalities:
+            attn_tensors[modal] = torch.from_numpy(np.stack([
+                np.stack([step[l][modal][:, 0] for l in range(n_layers)], axis=1)
+                for step in attns], axis=1))
+            # attn_tensors[modal].shape == [batch_size, gen_len, n_layers, source_len]
+
+        return attn_tensors
+
+    def get_word_attns(self, article_ids, token_ids, attn_tensors):
+        """Average the attention of one caption over whole words.
+
+        Parameters
+        ----------
+        article_ids : ``torch.LongTensor``
+            The article, possibly with trailing padding.
+        token_ids : ``List[int]``
+            The generated caption, starting with the seed <s>.
+        attn_tensors : ``Dict[str, torch.Tensor]``
+            The attention over each modality, with shape
+            [gen_len, n_layers, source_len].
+        """
+        dictionary = self.roberta.task.source_dictionary
+        bpe = self.roberta.bpe.bpe
+
+        def decode_bytes(byte_strs):
+            byte_text = ''.join(byte_strs)
+            return bytearray([bpe.byte_decoder[c] for c in byte_text]).decode(
+                'utf-8', errors=bpe.errors)
+
+        # Let's process the article text
+        article_ids = article_ids[article_ids != self.padding_idx]
+        article_ids = article_ids.cpu().numpy()
+        # article_ids.shape == [seq_len]
+
+        # remove <s>
+        if article_ids[0] == dictionary.bos():
+            article_ids = article_ids[1:]
+
+         # Ignore final </s> token
+        if article_ids[-1] == dictionary.eos():
+            article_ids = article_ids[:-1]
+
+        # Sanity check. We plus three because we removed <s>, </s> and
+        # the last two attention scores are for no attention and bias
+        assert article_ids.shape[0] == attn_tensors['article'].shape[-1] - 4
+
+        byte_ids = [int(dictionary[k]) for k in article_ids]
+        # e.g. [16012, 17163, 447, 247, 82, 4640, 3437]
+
+        byte_strs = [bpe.decoder.get(token, token) for token in byte_ids]
+        # e.g. ['Sun', 'rise', 'âĢ', 'Ļ', 's', 'Ġexecutive', 'Ġdirector']
+
+        # Map each article token to its word
+        article_words: List[List[str]] = []
+        article_mask = []
+        newline = False
+        for j, b in enumerate(byte_strs):
+            # Start a new word
+            if j == 0 or b[0] == 'Ġ' or b[0] == 'Ċ' or newline:
+                article_words.append([])
+                newline = b[0] == 'Ċ'
+            article_words[-1].append(b)
+            article_mask.append(len(article_words) - 1)
+        article_texts = [decode_bytes(w) for w in article_words]
+
+        # Next let's process the caption text
+        # Ignore seed input <s>
+        if token_ids[0] == dictionary.bos():
+            token_ids = token_ids[1:]  # remove <s>
+        # Now len(token_ids) should be the same of len(attns)
+
+        assert attn_tensors['article'].shape[0] == len(token_ids)
+
+        # Captions that finish early are padded
+        while token_ids and token_ids[-1] == self.padding_idx:
+            token_ids = token_ids[:-1]
+
+        # Ignore final </s> token
+        if token_ids and token_ids[-1] == dictionary.eos():
+            token_ids = token_ids[:-1]
+        # Now len(token_ids) should be len(attns) - 1
+
+        byte_ids = [int(dictionary[k]) for k in token_ids]
+        # e.g. [16012, 17163, 447, 247, 82, 4640, 3437]
+
+        byte_strs = [bpe.decoder.get(token, token) for token in byte_ids]
+        # e.g. ['Sun', 'rise', 'âĢ', 'Ļ', 's', 'Ġexecutive', 'Ġdirector']
+
+        # Merge by space. Ġ is space
+        caption_words: List[List[str]] = []
+        caption_mask = []
+        for j, b in enumerate(byte_strs):
+            if j == 0 or b[0] == 'Ġ':
+                caption_words.append([])
+            caption_words[-1].append(b)
+            caption_mask.append(len(caption_words) - 1)
+
+        if not caption_words:
+            return []
+
+        n_tokens = len(caption_mask)
+        caption_mask = torch.LongTensor(caption_mask)
+        article_mask = torch.LongTensor(article_mask)
+
+        # Average the article attention over the tokens of each article
+        # word, and then everything over the tokens of each caption word.
+        article_attns = attn_tensors['article'][:n_tokens]
+        article_attns = article_attns[:, :, :len(article_mask)]
+        article_attns = segment_mean(
+            article_attns, article_mask, len(article_words), dim=2)
+        # article_attns.shape == [n_tokens, n_layers, n_article_words]
+
+        word_attns = {
+            'article': segment_mean(article_attns, caption_mask,
+                                    len(caption_words)).transpose(1, 2),
+        }
+        for modal in ['image', 'faces', 'obj']:
+            word_attns[modal] = segment_mean(
+                attn_tensors[modal][:n_tokens], caption_mask,
+                len(caption_words))
+        word_attns = {k: v.tolist() for k, v in word_attns.items()}
+        # word_attns['article'].shape == [n_words, n_article_words, n_layers]
+        # word_attns['image'].shape == [n_words, n_layers, source_len]
+
+        attn_dicts: List[Dict[str, Any]] = []
+        for w, word in enumerate(caption_words):
+            attn_dicts.append({
+                'tokens': decode_bytes(word),
+                'attns': {
+                    'article': [{'text': text, 'attns': word_attn}
+                                for text, word_attn in zip(
+                                    article_texts, word_attns['article'][w])],
+                    'image': word_attns['image'][w],
+                    'faces': word_attns['faces'][w],
+                    'obj': word_attns['obj'][w],
+                }
+            })
+
+        return attn_dicts
+
     def _forward(self,  # type: ignore
                  context: Dict[str, torch.LongTensor],
                  image: torch.Tensor,
@@ -329,18 +361,11 @@ class TransformerFacesObjectModel(Model):
         caption[self.index] = caption_ids
 
         # Embed the image
-        X_image = self.resnet(image)
-        # X_image.shape == [batch_size, 2048, 7, 7]
-
-        X_image = X_image.permute(0, 2, 3, 1)
-        # X_image.shape == [batch_size, 7, 7, 2048]
-
-        # Flatten out the image
-        B, H, W, C = X_image.shape
-        P = H * W  # number of pixels
-        X_image = X_image.view(B, P, C)
+        X_image = self._embed_image(image)
         # X_image.shape == [batch_size, 49, 2048]
 
+        B, P, _ = X_image.shape
+
         article_ids = context[self.index]
         # article_ids.shape == [batch_size, seq_len]
 
@@ -349,23 +374,8 @@ class TransformerFacesObjectModel(Model):
 
         B, S = article_ids.shape
 
-        X_sections_hiddens = self.roberta.extract_features(
-            article_ids, return_all_hiddens=True)
-
-        if self.weigh_bert:
-            X_article = torch.stack(X_sections_hiddens, dim=2)
-            # X_article.shape == [batch_size, seq_len, 13, embed_size]
-
-            weight = F.softmax(self.bert_weight, dim=0)
-            weight = weight.unsqueeze(0).unsqueeze(1).unsqueeze(3)
-            # weight.shape == [1, 1, 13, 1]
-
-            X_article = (X_article * weight).sum(dim=2)
-            # X_article.shape == [batch_size, seq_len, embed_size]
-
-        else:
-            X_article = X_sections_hiddens[-1]
-            # X_article.shape == [batch_size, seq_len, embed_size]
+        X_article = self._encode_article(article_ids)
+        # X_article.shape == [batch_size, seq_len, embed_size]
 
         # Create padding mask (1 corresponds to the padding index)
         image_padding_mask = X_image.new_zeros(B, P).bool()
@@ -396,7 +406,36 @@ class TransformerFacesObjectModel(Model):
 
         return caption_ids, target_ids, contexts
 
-    def _generate(self, caption_ids, contexts, attn_idx=None):
+    def _set_attn_capture(self, capture, all_attns=False):
+        layers = None if all_attns else self.capture_layers
+        modalities = None if all_attns else self.capture_modalities
+        for i, layer in enumerate(self.decoder.layers):
+            layer.make_generation_fast_(
+                need_attn=capture and (layers is None or i in layers),
+                attn_modalities=modalities)
+
+    def _generate(self, caption_ids, contexts, attn_idx=None,
+                  capture_attns=False, all_attns=False):
+        """Generate captions, optionally capturing the attention maps.
+
+        The attention maps are written to preallocated tensors on the
+        device, which are copied to the host once at the end. Captured maps
+        are returned as attns[step][layer][modality], a numpy array of shape
+        [batch_size, 1, source_len]. Rows of finished captions are zero.
+        Unless `all_attns` is set, only `capture_layers` and
+        `capture_modalities` are kept.
+        """
+        try:
+            if self.beam_size > 1:
+                return self._generate_beam(caption_ids, contexts,
+                                           capture_attns, all_attns)
+            self._set_attn_capture(capture_attns, all_attns)
+            return self._generate_sample(caption_ids, contexts,
+                                         capture_attns)
+        finally:
+            self._set_attn_capture(False)
+
+    def _generate_sample(self, caption_ids, contexts, capture_attns):
         incremental_state: Dict[str, Any] = {}
         seed_input = caption_ids[:, 0:1]
         log_prob_list = []
@@ -406,7 +445,7 @@ class TransformerFacesObjectModel(Model):
         full_active_idx = active_idx
         gen_len = 100
         B = caption_ids.shape[0]
-        attns = []
+        attn_buffers: Dict[Any, torch.Tensor] = {}
 
         for i in range(gen_len):
             if i == 0:
@@ -435,33 +474,11 @@ class TransformerFacesObjectModel(Model):
                 contexts_i,
                 incremental_state=incremental_state)
 
-            attns.append(decoder_out[1]['attn'])
-
-            # We're only interested in the current final word
-            decoder_out = (decoder_out[0][:, -1:], None)
-
-            lprobs = self.decoder.get_normalized_probs(
-                decoder_out, log_probs=True)
-            # lprobs.shape == [batch_size, 1, vocab_size]
-
-            lprobs = lprobs.squeeze(1)
-            # lprobs.shape == [batch_size, vocab_size]
-
-            topk_lprobs, topk_indices = lprobs.topk(self.sampling_topk)
-            topk_lprobs = topk_lprobs.div_(self.sampling_temp)
-            # topk_lprobs.shape == [batch_size, topk]
-
-            # Take a random sample from those top k
-            topk_probs = topk_lprobs.exp()
-            sampled_index = torch.multinomial(topk_probs, num_samples=1)
-            # sampled_index.shape == [batch_size, 1]
+            if capture_attns:
+                self._capture_step_attns(attn_buffers, i, full_active_idx,
+                                         decoder_out, gen_len)
 
-            selected_lprob = topk_lprobs.gather(
-                dim=-1, index=sampled_index)
-            # selected_prob.shape == [batch_size, 1]
-
-            selected_index = topk_indices.gather(
-                dim=-1, index=sampled_index)
+            selected_lprob, selected_index = self._sample_next(decoder_out)
             # selected_index.shape == [batch_size, 1]
 
             log_prob = selected_lprob.new_zeros(B, 1)
@@ -491,6 +508,87 @@ class TransformerFacesObjectModel(Model):
         token_ids = torch.cat(index_path_list, dim=-1)
         # token_ids.shape == [batch_size * beam_size, generate_len]
 
+        attns = []
+        if capture_attns:
+            attns = self._collect_attns(attn_buffers, log_probs.shape[1])
+
+        return log_probs, token_ids, attns
+
+    def _sample_next(self, decoder_out):
+        # We're only interested in the current final word
+        decoder_out = (decoder_out[0][:, -1:], None)
+
+        # With an adaptive softmax, this avoids computing the
+        # probabilities of the whole vocabulary.
+        topk_lprobs, topk_indices = self.decoder.get_topk_log_probs(
+            decoder_out, self.sampling_topk)
+        # topk_lprobs.shape == [batch_size, 1, topk]
+
+        topk_lprobs = topk_lprobs.squeeze(1)
+        topk_indices = topk_indices.squeeze(1)
+        topk_lprobs = topk_lprobs.div_(self.sampling_temp)
+        # topk_lprobs.shape == [batch_size, topk]
+
+        # Take a random sample from those top k
+        topk_probs = topk_lprobs.exp()
+        sampled_index = torch.multinomial(topk_probs, num_samples=1)
+        # sampled_index.shape == [batch_size, 1]
+
+        selected_lprob = topk_lprobs.gather(
+            dim=-1, index=sampled_index)
+        # selected_prob.shape == [batch_size, 1]
+
+        selected_index = topk_indices.gather(
+            dim=-1, index=sampled_index)
+        # selected_index.shape == [batch_size, 1]
+
+        return selected_lprob, selected_index
+
+    def _capture_step_attns(self, attn_buffers, i, rows, decoder_out,
+                            gen_len):
+        """Write the attention of step `i` into the buffers on the device.
+
+        `rows` is the boolean mask of the captions in the decoder batch.
+        """
+        for l, layer_attns in enumerate(decoder_out[1]['attn']):
+            for modality, attn in layer_attns.items():
+                key = (l, modality)
+                if key not in attn_buffers:
+                    attn_buffers[key] = attn.new_zeros(
+                        gen_len, rows.shape[0], attn.shape[-1])
+                attn_buffers[key][i, rows] = attn[:, -1]
+
+    def _collect_attns(self, attn_buffers, n_steps):
+        # attn_buffers[(layer, modality)].shape == [gen_len, batch_size, source_len]
+        host_buffers = {key: buf[:n_steps].cpu().numpy()
+                        for key, buf in attn_buffers.items()}
+        attns = []
+        for i in range(n_steps):
+            step_attns: List[Dict[str, Any]] = [
+                {} for _ in range(len(self.decoder.layers))]
+            for (l, modality), buf in host_buffers.items():
+                step_attns[l][modality] = buf[i][:, None]
+            attns.append(step_attns)
+        return attns
+
+    def _generate_beam(self, caption_ids, contexts, capture_attns, all_attns):
+        log_probs, token_ids = self._search_beam(
+            caption_ids, contexts, ['image', 'article', 'faces', 'obj'])
+
+        attns = []
+        if capture_attns:
+            # The attention of the hypotheses is not kept during the search.
+            # Instead we recover it with a single pass over the final
+            # captions, with the layers only returning weights in this pass.
+            self._set_attn_capture(True, all_attns)
+            decoder_out = self.decoder(
+                {self.index: token_ids[:, :-1]}, contexts)
+            attn_buffers = {}
+            for l, layer_attns in enumerate(decoder_out[1]['attn']):
+                for modality, attn in layer_attns.items():
+                    attn_buffers[(l, modality)] = attn.transpose(0, 1)
+            attns = self._collect_attns(attn_buffers, log_probs.shape[1])
+
         return log_probs, token_ids, attns
 
     @overrides
@@ -6,22 +6,25 @@ from typing import Any, Dict, List
 
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
+from allennlp.common.checks import ConfigurationError
 from allennlp.data.vocabulary import Vocabulary
 from allennlp.models.model import Model
 from allennlp.nn.initializers import InitializerApplicator
 from overrides import overrides
 from pycocoevalcap.bleu.bleu_scorer import BleuScorer
 
+from tell.data.stores import ArticleFeatureStore
 from tell.modules.criteria import Criterion
 
 from .decoder_flattened import Decoder
 from .decoder_flattened_lstm import LSTMDecoder
+from .mixins import ArticleEncoderMixin, BeamSearchMixin, ImageEncoderMixin
 from .resnet import resnet152
 
 
 @Model.register("transformer_flattened")
-class TransformerFlattenedModel(Model):
+class TransformerFlattenedModel(ArticleEncoderMixin, BeamSearchMixin,
+                                ImageEncoderMixin, Model):
     def __init__(self,
                  vocab: Vocabulary,
                  decoder: Decoder,
@@ -38,9 +41,17 @@ class TransformerFlattenedModel(Model):
                  use_context: bool = True,
                  sampling_topk: int = 1,
                  sampling_temp: float = 1.0,
+                 beam_size: int = 1,
                  weigh_bert: bool = False,
+                 article_feature_dir: str = None,
                  initializer: InitializerApplicator = InitializerApplicator()) -> None:
         super().__init__(vocab)
+        if beam_size > 1 and isinstance(decoder, LSTMDecoder):
+            # The LSTM attention can't share the contexts among the
+            # hypotheses of a caption, which beam search relies on.
+            raise ConfigurationError(
+                'Beam search is not supported with lstm_decoder_flattened. '
+                'Set beam_size to 1.')
         self.decoder = decoder
         self.criterion = criterion
 
@@ -54,11 +65,18 @@ class TransformerFlattenedModel(Model):
         self.evaluate_mode = evaluate_mode
         self.sampling_topk = sampling_topk
         self.sampling_temp = sampling_temp
+        self.beam_size = beam_size
         self.weigh_bert = weigh_bert
         if weigh_bert:
             self.bert_weight = nn.Parameter(torch.Tensor(25))
             nn.init.uniform_(self.bert_weight)
 
+        self.article_feature_store = None
+        if article_feature_dir:
+            self.article_feature_store = ArticleFeatureStore(
+                article_feature_dir)
+            self.article_feature_store.check_compatible(weigh_bert)
+
         self.n_batches = 0
         self.n_samples = 0
         self.sample_history: Dict[str, float] = defaultdict(float)
@@ -182,18 +200,11 @@ class TransformerFlattenedModel(Model):
         caption[self.index] = caption_ids
 
         # Embed the image
-        X_image = self.resnet(image)
-        # X_image.shape == [batch_size, 2048, 7, 7]
-
-        X_image = X_image.permute(0, 2, 3, 1)
-        # X_image.shape == [batch_size, 7, 7, 2048]
-
-        # Flatten out the image
-        B, H, W, C = X_image.shape
-        P = H * W  # number of pixels
-        X_image = X_image.view(B, P, C)
+        X_image = self._embed_image(image)
         # X_image.shape == [batch_size, 49, 2048]
 
+        B, P, _ = X_image.shape
+
         article_ids = context[self.index]
         # article_ids.shape == [batch_size, seq_len]
 
@@ -202,23 +213,8 @@ class TransformerFlattenedModel(Model):
 
         B, S = article_ids.shape
 
-        X_sections_hiddens = self.roberta.extract_features(
-            article_ids, return_all_hiddens=True)
-
-        if self.weigh_bert:
-            X_article = torch.stack(X_sections_hiddens, dim=2)
-            # X_article.shape == [batch_size, seq_len, 13, embed_size]
-
-            weight = F.softmax(self.bert_weight, dim=0)
-            weight = weight.unsqueeze(0).unsqueeze(1).unsqueeze(3)
-            # weight.shape == [1, 1, 13, 1]
-
-            X_article = (X_article * weight).sum(dim=2)
-            # X_article.shape == [batch_size, seq_len, embed_size]
-
-        else:
-            X_article = X_sections_hiddens[-1]
-            # X_article.shape == [batch_size, seq_len, embed_size]
+        X_article = self._encode_article(article_ids)
+        # X_article.shape == [batch_size, seq_len, embed_size]
 
         # Create padding mask (1 corresponds to the padding index)
         image_padding_mask = X_image.new_zeros(B, P).bool()
@@ -238,6 +234,10 @@ class TransformerFlattenedModel(Model):
         return caption_ids, target_ids, contexts
 
     def _generate(self, caption_ids, contexts):
+        if self.beam_size > 1:
+            return self._search_beam(caption_ids, contexts,
+                                     ['image', 'article'])
+
         incremental_state: Dict[str, Any] = {}
         seed_input = caption_ids[:, 0:1]
         log_prob_list = []
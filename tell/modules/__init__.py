@@ -3,9 +3,10 @@ import tell.modules.token_embedders
 from .attention import (AttentionLayer, DownsampledMultiHeadAttention,
                         MultiHeadAttention, SelfAttention,
                         multi_head_attention_score_forward)
-from .beam import BeamableMM
+from .beam import BeamableMM, BeamSearch
 from .convolutions import (ConvTBC, DynamicConv1dTBC, LightweightConv1d,
                            LightweightConv1dTBC, LinearizedConvolution)
 from .linear import GehringLinear
 from .mixins import LoadStateDictWithPrefix
+from .quantization import is_quantized, load_model_state, quantize_model
 from .softmax import AdaptiveSoftmax
@@ -247,6 +247,9 @@ class MultiHeadAttention(nn.Module):
         out_dim = out_dim if out_dim else embed_dim
         self.out_proj = nn.Linear(embed_dim, out_dim, bias=bias)
 
+        # Separate input projections, see split_projections_
+        self.q_proj = self.k_proj = self.v_proj = None
+
         if add_bias_kv:
             self.bias_k = Parameter(torch.Tensor(1, 1, embed_dim))
             self.bias_v = Parameter(torch.Tensor(1, 1, embed_dim))
@@ -258,6 +261,7 @@ class MultiHeadAttention(nn.Module):
         self.reset_parameters()
 
         self.onnx_trace = False
+        self.beam_size = None
 
         self.enable_torch_version = False
         if hasattr(F, "multi_head_attention_forward"):
@@ -268,6 +272,47 @@ class MultiHeadAttention(nn.Module):
     def prepare_for_onnx_export_(self):
         self.onnx_trace = True
 
+    def set_beam_size(self, beam_size):
+        self.beam_size = beam_size
+
+    def split_projections_(self):
+        """Move the input projections into separate linear layers.
+
+        The projection weights are normally packed together and applied with
+        F.linear. As linear layers, they can be swapped out, e.g. by dynamic
+        quantization. Afterwards the attention no longer uses the fused
+        PyTorch implementation.
+        """
+        if self.q_proj is not None:
+            return
+
+        if self.qkv_same_dim:
+            weights = self.in_proj_weight.data.chunk(3)
+            self.register_parameter('in_proj_weight', None)
+        else:
+            weights = [self.q_proj_weight.data, self.k_proj_weight.data,
+                       self.v_proj_weight.data]
+            for name in ['q_proj_weight', 'k_proj_weight', 'v_proj_weight']:
+                self.register_parameter(name, None)
+
+        if self.in_proj_bias is not None:
+            biases = self.in_proj_bias.data.chunk(3)
+        else:
+            biases = [None] * 3
+        self.register_parameter('in_proj_bias', None)
+
+        projections = []
+        for weight, bias in zip(weights, biases):
+            proj = nn.Linear(weight.shape[1], weight.shape[0],
+                             bias=bias is not None).to(weight)
+            proj.weight.data.copy_(weight)
+            if bias is not None:
+                proj.bias.data.copy_(bias)
+            projections.append(proj)
+
+        self.q_proj, self.k_proj, self.v_proj = projections
+        self.enable_torch_version = False
+
     def reset_parameters(self):
         if self.qkv_same_dim:
             nn.init.xavier_uniform_(self.in_proj_weight)
@@ -327,6 +372,13 @@ class MultiHeadAttention(nn.Module):
                 # key and value if they are static
                 if static_kv:
                     assert self.encoder_decoder_attention and not self.self_attention
+                    n_new = self._get_n_new(incremental_state)
+                    if n_new > 0:
+                        # Only the sequences added by extend_incremental_state
+                        # are missing from the cache. They are at the end.
+                        self._extend_static_kv(
+                            saved_state, key[:, key.size(1) - n_new:])
+                        self._set_n_new(incremental_state, 0)
                     key = value = None
         else:
             saved_state = None
@@ -352,21 +404,29 @@ class MultiHeadAttention(nn.Module):
                 v = self.in_proj_v(value)
         q *= self.scaling
 
+        # The keys can have a smaller batch than the queries during beam
+        # search, where all hypotheses of a caption share its context.
+        if key is not None:
+            src_bsz = key.size(1)
+        else:
+            src_bsz = saved_state['prev_key'].size(0)
+
         if self.bias_k is not None:
             assert self.bias_v is not None
-            if key.shape[2] > 0:
-                k = torch.cat([k, self.bias_k.repeat(1, bsz, 1)])
-            else:
-                k = self.bias_k.repeat(1, bsz, 1)
-            if key.shape[2] > 0:
-                v = torch.cat([v, self.bias_v.repeat(1, bsz, 1)])
+            if key is None:
+                # The cached static keys and values already end with the bias
+                pass
+            elif key.shape[2] > 0:
+                k = torch.cat([k, self.bias_k.repeat(1, src_bsz, 1)])
+                v = torch.cat([v, self.bias_v.repeat(1, src_bsz, 1)])
             else:
-                v = self.bias_v.repeat(1, bsz, 1)
+                k = self.bias_k.repeat(1, src_bsz, 1)
+                v = self.bias_v.repeat(1, src_bsz, 1)
             if attn_mask is not None:
                 attn_mask = torch.cat(
                     [attn_mask, attn_mask.new_zeros(attn_mask.size(0), 1)], dim=1)
             if key_padding_mask is not None:
-                if key.shape[2] > 0:
+                if key is None or key.shape[2] > 0:
                     key_padding_mask = torch.cat(
                         [key_padding_mask, key_padding_mask.new_zeros(key_padding_mask.size(0), 1)], dim=1)
                 else:
@@ -375,42 +435,54 @@ class MultiHeadAttention(nn.Module):
 
         q = q.contiguous().view(tgt_len, bsz * self.num_heads, self.head_dim).transpose(0, 1)
         if k is not None:
-            k = k.contiguous().view(-1, bsz * self.num_heads, self.head_dim).transpose(0, 1)
+            k = k.contiguous().view(-1, src_bsz * self.num_heads, self.head_dim).transpose(0, 1)
         if v is not None:
-            v = v.contiguous().view(-1, bsz * self.num_heads, self.head_dim).transpose(0, 1)
+            v = v.contiguous().view(-1, src_bsz * self.num_heads, self.head_dim).transpose(0, 1)
 
         if saved_state is not None:
             # saved states are stored with shape (bsz, num_heads, seq_len, head_dim)
             if 'prev_key' in saved_state:
                 prev_key = saved_state['prev_key'].view(
-                    bsz * self.num_heads, -1, self.head_dim)
+                    src_bsz * self.num_heads, -1, self.head_dim)
                 if static_kv:
                     k = prev_key
                 else:
                     k = torch.cat((prev_key, k), dim=1)
             if 'prev_value' in saved_state:
                 prev_value = saved_state['prev_value'].view(
-                    bsz * self.num_heads, -1, self.head_dim)
+                    src_bsz * self.num_heads, -1, self.head_dim)
                 if static_kv:
                     v = prev_value
                 else:
                     v = torch.cat((prev_value, v), dim=1)
             saved_state['prev_key'] = k.view(
-                bsz, self.num_heads, -1, self.head_dim)
+                src_bsz, self.num_heads, -1, self.head_dim)
             saved_state['prev_value'] = v.view(
-                bsz, self.num_heads, -1, self.head_dim)
+                src_bsz, self.num_heads, -1, self.head_dim)
 
             self._set_input_buffer(incremental_state, saved_state)
 
         src_len = k.size(1)
 
+        # Like BeamableMM, instead of replicating the keys for each
+        # hypothesis, we fold the hypotheses of a caption into the query
+        # length. From here on, the batch has src_bsz elements, each with
+        # q_len queries.
+        beam_size = bsz // src_bsz
+        q_len = beam_size * tgt_len
+        if beam_size > 1:
+            assert attn_mask is None
+            q = q.view(src_bsz, beam_size, self.num_heads, tgt_len, self.head_dim)
+            q = q.transpose(1, 2).reshape(
+                src_bsz * self.num_heads, q_len, self.head_dim)
+
         # This is part of a workaround to get around fork/join parallelism
         # not supporting Optional types.
         if key_padding_mask is not None and key_padding_mask.shape == torch.Size([]):
             key_padding_mask = None
 
         if key_padding_mask is not None:
-            assert key_padding_mask.size(0) == bsz
+            assert key_padding_mask.size(0) == src_bsz
             assert key_padding_mask.size(1) == src_len
 
         if self.add_zero_attn:
@@ -428,10 +500,10 @@ class MultiHeadAttention(nn.Module):
 
         attn_weights = torch.bmm(q, k.transpose(1, 2))
         attn_weights = self.apply_sparse_mask(
-            attn_weights, tgt_len, src_len, bsz)
+            attn_weights, q_len, src_len, src_bsz)
 
         assert list(attn_weights.size()) == [
-            bsz * self.num_heads, tgt_len, src_len]
+            src_bsz * self.num_heads, q_len, src_len]
 
         if attn_mask is not None:
             attn_mask = attn_mask.unsqueeze(0)
@@ -442,7 +514,7 @@ class MultiHeadAttention(nn.Module):
         if key_padding_mask is not None:
             # don't attend to padding symbols
             attn_weights = attn_weights.view(
-                bsz, self.num_heads, tgt_len, src_len)
+                src_bsz, self.num_heads, q_len, src_len)
             if self.onnx_trace:
                 attn_weights = torch.where(
                     key_padding_mask.unsqueeze(1).unsqueeze(2),
@@ -455,7 +527,7 @@ class MultiHeadAttention(nn.Module):
                     float('-inf'),
                 )
             attn_weights = attn_weights.view(
-                bsz * self.num_heads, tgt_len, src_len)
+                src_bsz * self.num_heads, q_len, src_len)
 
         attn_weights = softmax(
             attn_weights, dim=-1, onnx_trace=self.onnx_trace,
@@ -465,7 +537,11 @@ class MultiHeadAttention(nn.Module):
 
         attn = torch.bmm(attn_weights, v)
         assert list(attn.size()) == [
-            bsz * self.num_heads, tgt_len, self.head_dim]
+            src_bsz * self.num_heads, q_len, self.head_dim]
+        if beam_size > 1:
+            attn = attn.view(src_bsz, self.num_heads, beam_size, tgt_len, self.head_dim)
+            attn = attn.transpose(1, 2).reshape(
+                bsz * self.num_heads, tgt_len, self.head_dim)
         if (self.onnx_trace and attn.size(1) == 1):
             # when ONNX tracing a single decoder step (sequence length == 1)
             # the transpose is a no-op copy before view, thus unnecessary
@@ -478,18 +554,23 @@ class MultiHeadAttention(nn.Module):
         if need_weights:
             # average attention weights over heads
             attn_weights = attn_weights.view(
-                bsz, self.num_heads, tgt_len, src_len)
+                src_bsz, self.num_heads, q_len, src_len)
             attn_weights = attn_weights.sum(dim=1) / self.num_heads
+            attn_weights = attn_weights.view(bsz, tgt_len, src_len)
         else:
             attn_weights = None
 
         return attn, attn_weights
 
     def in_proj_qkv(self, query):
+        if self.q_proj is not None:
+            return self.q_proj(query), self.k_proj(query), self.v_proj(query)
         return self._in_proj(query).chunk(3, dim=-1)
 
     def in_proj_q(self, query):
-        if self.qkv_same_dim:
+        if self.q_proj is not None:
+            return self.q_proj(query)
+        elif self.qkv_same_dim:
             return self._in_proj(query, end=self.embed_dim)
         else:
             bias = self.in_proj_bias
@@ -498,7 +579,9 @@ class MultiHeadAttention(nn.Module):
             return F.linear(query, self.q_proj_weight, bias)
 
     def in_proj_k(self, key):
-        if self.qkv_same_dim:
+        if self.k_proj is not None:
+            return self.k_proj(key)
+        elif self.qkv_same_dim:
             return self._in_proj(key, start=self.embed_dim, end=2 * self.embed_dim)
         else:
             weight = self.k_proj_weight
@@ -508,7 +591,9 @@ class MultiHeadAttention(nn.Module):
             return F.linear(key, weight, bias)
 
     def in_proj_v(self, value):
-        if self.qkv_same_dim:
+        if self.v_proj is not None:
+            return self.v_proj(value)
+        elif self.qkv_same_dim:
             return self._in_proj(value, start=2 * self.embed_dim)
         else:
             weight = self.v_proj_weight
@@ -529,10 +614,73 @@ class MultiHeadAttention(nn.Module):
         """Reorder buffered internal state (for incremental generation)."""
         input_buffer = self._get_input_buffer(incremental_state)
         if input_buffer is not None:
+            # The sequences that were just added have no cache yet
+            assert self._get_n_new(incremental_state) == 0
+            if self.encoder_decoder_attention and self.beam_size:
+                # The static keys and values are stored once per caption and
+                # shared by its hypotheses, which stay next to each other.
+                # Reordering the hypotheses only matters when some captions
+                # are dropped.
+                new_order = new_order.view(-1, self.beam_size)[:, 0]
+                new_order = new_order // self.beam_size
             for k in input_buffer.keys():
+                if self.encoder_decoder_attention and self.beam_size and \
+                        input_buffer[k].size(0) == new_order.size(0):
+                    continue
                 input_buffer[k] = input_buffer[k].index_select(0, new_order)
             self._set_input_buffer(incremental_state, input_buffer)
 
+    def extend_incremental_state(self, incremental_state, n_new):
+        input_buffer = self._get_input_buffer(incremental_state)
+        if not input_buffer:
+            return
+        if not self.encoder_decoder_attention:
+            raise NotImplementedError(
+                'Cannot add new sequences to a running self-attention.')
+        # The new sequences come with their own contexts, which are not
+        # projected yet. In the next step, we project only their contexts
+        # and append them to the cached keys and values.
+        n_new += self._get_n_new(incremental_state)
+        self._set_n_new(incremental_state, n_new)
+
+    def _extend_static_kv(self, saved_state, key):
+        """Append the keys and values of the contexts in `key` to the cache.
+
+        The contexts of the whole batch are padded to the same length. We
+        insert the padding before the bias, which the cache keeps at the end.
+        """
+        src_len, n_new, _ = key.size()
+        k = self.in_proj_k(key)
+        v = self.in_proj_v(key)
+        n_extra = 0
+        if self.bias_k is not None:
+            n_extra = 1
+            if key.shape[2] > 0:
+                k = torch.cat([k, self.bias_k.repeat(1, n_new, 1)])
+                v = torch.cat([v, self.bias_v.repeat(1, n_new, 1)])
+            else:
+                src_len = 0
+                k = self.bias_k.repeat(1, n_new, 1)
+                v = self.bias_v.repeat(1, n_new, 1)
+
+        for name, X in [('prev_key', k), ('prev_value', v)]:
+            # X.shape == [src_len + n_extra, n_new, embed_dim]
+            X = X.view(-1, n_new, self.num_heads, self.head_dim)
+            X = X.permute(1, 2, 0, 3)
+            # X.shape == [n_new, num_heads, src_len + n_extra, head_dim]
+            prev_X = saved_state[name]
+            size = max(prev_X.size(2), X.size(2)) - n_extra
+            saved_state[name] = torch.cat([
+                _pad_static_kv(prev_X, size, n_extra),
+                _pad_static_kv(X, size, n_extra),
+            ])
+
+    def _get_n_new(self, incremental_state):
+        return get_incremental_state(self, incremental_state, 'n_new') or 0
+
+    def _set_n_new(self, incremental_state, n_new):
+        set_incremental_state(self, incremental_state, 'n_new', n_new)
+
     def _get_input_buffer(self, incremental_state):
         return get_incremental_state(
             self,
@@ -550,3 +698,14 @@ class MultiHeadAttention(nn.Module):
 
     def apply_sparse_mask(self, attn_weights, tgt_len, src_len, bsz):
         return attn_weights
+
+
+def _pad_static_kv(X, size, n_extra):
+    # X.shape == [batch_size, num_heads, src_len + n_extra, head_dim], where
+    # the last n_extra positions are the bias.
+    n_pad = size + n_extra - X.size(2)
+    if n_pad == 0:
+        return X
+    src_len = X.size(2) - n_extra
+    pad = X.new_zeros(X.size(0), X.size(1), n_pad, X.size(3))
+    return torch.cat([X[:, :, :src_len], pad, X[:, :, src_len:]], dim=2)
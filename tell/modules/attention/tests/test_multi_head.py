@@ -0,0 +1,92 @@
+import unittest
+from unittest import mock
+
+import torch
+
+from tell.modules.attention.multi_head import MultiHeadAttention
+
+
+def make_context(batch_size, src_len, n_padded):
+    X = torch.randn(src_len, batch_size, 6)
+    mask = torch.zeros(batch_size, src_len, dtype=torch.bool)
+    for i, n in enumerate(n_padded):
+        mask[i, src_len - n:] = True
+    return X, mask
+
+
+def pad_context(X, mask, src_len):
+    n_pad = src_len - X.shape[0]
+    X = torch.cat([X, X.new_zeros(n_pad, *X.shape[1:])])
+    mask = torch.cat([mask, mask.new_ones(mask.shape[0], n_pad)], dim=1)
+    return X, mask
+
+
+class TestMultiHeadAttention(unittest.TestCase):
+    def test_static_kv_cache_matches_teacher_forcing(self):
+        torch.manual_seed(0)
+        attn = MultiHeadAttention(8, 2, kdim=6, vdim=6,
+                                  encoder_decoder_attention=True).eval()
+
+        X, mask = make_context(3, 5, [0, 2, 4])
+        query = torch.randn(4, 3, 8)
+        # query.shape == [tgt_len, batch_size, embed_dim]
+
+        # Without an incremental state, we use the PyTorch implementation
+        expected, expected_weights = attn(query, X, X, mask)
+
+        state = {}
+        for i in range(query.shape[0]):
+            output, weights = attn(query[i:i + 1], X, X, mask, state,
+                                   static_kv=True)
+            self.assertLess(
+                (output - expected[i:i + 1]).abs().max().item(), 1e-6)
+            self.assertLess(
+                (weights - expected_weights[:, i:i + 1]).abs().max().item(),
+                1e-6)
+
+        # The cached keys and values are not projected again
+        with mock.patch.object(attn, 'in_proj_k') as projected:
+            attn(query[:1], X, X, mask, state, static_kv=True)
+        projected.assert_not_called()
+
+    def test_extend_incremental_state_projects_new_contexts_only(self):
+        torch.manual_seed(0)
+        attn = MultiHeadAttention(8, 2, kdim=6, vdim=6,
+                                  encoder_decoder_attention=True).eval()
+
+        X_old, mask_old = make_context(2, 3, [0, 1])
+        X_new, mask_new = make_context(3, 5, [2, 0, 4])
+        query = torch.randn(1, 2, 8)
+
+        state = {}
+        attn(query, X_old, X_old, mask_old, state, static_kv=True)
+        attn.extend_incremental_state(state, 3)
+
+        # The contexts of the batch are padded to the longest one
+        X_old, mask_old = pad_context(X_old, mask_old, 5)
+        X = torch.cat([X_old, X_new], dim=1)
+        mask = torch.cat([mask_old, mask_new])
+        query = torch.randn(1, 5, 8)
+
+        in_proj_k = attn.in_proj_k
+        with mock.patch.object(attn, 'in_proj_k',
+                               side_effect=in_proj_k) as projected:
+            output, weights = attn(query, X, X, mask, state, static_kv=True)
+        self.assertEqual(projected.call_count, 1)
+        self.assertEqual(projected.call_args[0][0].shape[1], 3)
+
+        expected, expected_weights = attn(query, X, X, mask, {},
+                                          static_kv=True)
+        self.assertLess((output - expected).abs().max().item(), 1e-6)
+        self.assertLess(
+            (weights - expected_weights).abs().max().item(), 1e-6)
+
+        # The cache keeps working for the next step
+        query = torch.randn(1, 5, 8)
+        output, _ = attn(query, X, X, mask, state, static_kv=True)
+        expected, _ = attn(query, X, X, mask, {}, static_kv=True)
+        self.assertLess((output - expected).abs().max().item(), 1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -42,3 +42,150 @@ class BeamableMM(nn.Module):
 
     def set_beam_size(self, beam_size):
         self.beam_size = beam_size
+
+
+class BeamSearch:
+    """Batched beam search over an incremental decoder.
+
+    All captions in the batch are searched together. The hypotheses of each
+    caption are kept next to each other, so that a batch of N captions has
+    N * beam_size hypotheses. A hypothesis is finished once it emits EOS,
+    after which it can only be extended with padding at no cost. A caption is
+    done when all of its hypotheses are finished, at which point we keep its
+    best hypothesis and drop the caption from the batch.
+
+    Parameters
+    ----------
+    beam_size : ``int``
+        Number of hypotheses to keep for each caption.
+    max_len : ``int``
+        Maximum number of tokens to generate.
+    eos : ``int``
+        Index of the end-of-sequence token.
+    padding_idx : ``int``
+        Index of the padding token.
+    len_penalty : ``float``
+        The final score of a hypothesis is its log probability divided by
+        its length to the power of ``len_penalty``. Use values < 1 to favour
+        shorter captions.
+    """
+
+    def __init__(self, beam_size, max_len=100, eos=2, padding_idx=1,
+                 len_penalty=1.0):
+        self.beam_size = beam_size
+        self.max_len = max_len
+        self.eos = eos
+        self.padding_idx = padding_idx
+        self.len_penalty = len_penalty
+
+    def search(self, seed_input, step, reorder):
+        """Generate the best continuation of each seed.
+
+        Parameters
+        ----------
+        seed_input : ``torch.LongTensor``
+            The prefix of each caption, of shape [batch_size, seed_len].
+        step : ``Callable[[torch.LongTensor], torch.Tensor]``
+            Given the new tokens of each hypothesis, of shape
+            [n_hypos, seq_len], return the log probabilities of the next
+            token, of shape [n_hypos, vocab_size].
+        reorder : ``Callable[[torch.LongTensor, Optional[torch.LongTensor]], None]``
+            Called with the indices of the hypotheses that survive each step,
+            and with the indices of the captions that are still active, or
+            None if no caption was dropped. This should reorder the incremental
+            state and the contexts accordingly.
+
+        Returns
+        -------
+        log_probs : ``torch.Tensor``
+            The log probability of each generated token, of shape
+            [batch_size, gen_len].
+        token_ids : ``torch.LongTensor``
+            The seed followed by the generated tokens, of shape
+            [batch_size, seed_len + gen_len]. Each caption is padded after
+            its EOS.
+        """
+        B, seed_len = seed_input.shape
+        K = self.beam_size
+
+        hypo_ids = seed_input.repeat_interleave(K, dim=0)
+        # hypo_ids.shape == [batch_size * beam_size, seq_len]
+
+        # Only the first hypothesis of each caption is live at the start, so
+        # that we don't end up with beam_size copies of the same caption.
+        scores = seed_input.new_zeros(B, K, dtype=torch.float)
+        scores[:, 1:] = float('-inf')
+        scores = scores.view(-1)
+        # scores.shape == [batch_size * beam_size]
+
+        hypo_lprobs = scores.new_zeros(B * K, 0)
+        finished = seed_input.new_zeros(B * K, dtype=torch.bool)
+
+        # The original position of each active caption
+        captions = torch.arange(B, device=seed_input.device)
+
+        out_ids = seed_input.new_full((B, seed_len + self.max_len),
+                                      self.padding_idx)
+        out_ids[:, :seed_len] = seed_input
+        out_lprobs = scores.new_zeros(B, self.max_len)
+
+        for i in range(self.max_len):
+            prev_ids = hypo_ids if i == 0 else hypo_ids[:, -1:]
+            lprobs = step(prev_ids)
+            N, V = lprobs.shape
+            n_captions = N // K
+            # lprobs.shape == [n_captions * beam_size, vocab_size]
+
+            lprobs[:, self.padding_idx] = float('-inf')
+            lprobs[finished] = float('-inf')
+            lprobs[finished, self.padding_idx] = 0
+
+            cand_scores = scores.unsqueeze(1) + lprobs
+            cand_scores = cand_scores.view(n_captions, K * V)
+            top_scores, top_indices = cand_scores.topk(K, dim=1)
+            # top_scores.shape == [n_captions, beam_size]
+
+            offsets = torch.arange(n_captions, device=lprobs.device) * K
+            hypo_order = (top_indices // V + offsets.unsqueeze(1)).view(-1)
+            tokens = (top_indices % V).view(-1)
+            # hypo_order.shape == tokens.shape == [n_captions * beam_size]
+
+            token_lprobs = lprobs.view(-1)[hypo_order * V + tokens]
+            hypo_ids = torch.cat([hypo_ids[hypo_order],
+                                  tokens.unsqueeze(1)], dim=1)
+            hypo_lprobs = torch.cat([hypo_lprobs[hypo_order],
+                                     token_lprobs.unsqueeze(1)], dim=1)
+            scores = top_scores.view(-1)
+            finished = finished[hypo_order] | (tokens == self.eos)
+
+            done = finished.view(n_captions, K).all(dim=1)
+            if i == self.max_len - 1:
+                done[:] = True
+            if not done.any():
+                reorder(hypo_order, None)
+                continue
+
+            # Keep the best hypothesis of each caption that is done
+            lengths = (hypo_ids[:, seed_len:] != self.padding_idx).sum(dim=1)
+            norm_scores = scores / lengths.float() ** self.len_penalty
+            best = norm_scores.view(n_captions, K).argmax(dim=1)
+            done_idx = done.nonzero().squeeze(1)
+            best_hypos = done_idx * K + best[done_idx]
+            out_ids[captions[done_idx], :hypo_ids.shape[1]] = \
+                hypo_ids[best_hypos]
+            out_lprobs[captions[done_idx], :i + 1] = hypo_lprobs[best_hypos]
+
+            keep = ~done
+            if not keep.any():
+                break
+
+            keep_hypos = keep.repeat_interleave(K)
+            captions = captions[keep]
+            hypo_ids = hypo_ids[keep_hypos]
+            hypo_lprobs = hypo_lprobs[keep_hypos]
+            scores = scores[keep_hypos]
+            finished = finished[keep_hypos]
+            reorder(hypo_order[keep_hypos], keep.nonzero().squeeze(1))
+
+        gen_len = i + 1
+        return out_lprobs[:, :gen_len], out_ids[:, :seed_len + gen_len]
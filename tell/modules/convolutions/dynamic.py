@@ -11,7 +11,7 @@ import torch.nn.functional as F
 
 from tell.utils import get_incremental_state, set_incremental_state
 
-from .unfold import unfold1d
+from .unfold import ring_buffer_step, unfold1d
 
 
 def Linear(in_features, out_features, bias=True):
@@ -92,7 +92,16 @@ class DynamicConv1dTBC(nn.Module):
         '''
         # X.shape == [seq_len, batch_size, input_dim]
 
+        # With in_proj, the input buffer has to keep the unprojected inputs,
+        # so we stay on the slow path.
+        if incremental_state is not None and X.size(0) == 1 and not self.in_proj:
+            output = self._forward_one_step(X, incremental_state, query)
+            if self.conv_bias is not None:
+                output = output + self.conv_bias.view(1, 1, -1)
+            return output
+
         if incremental_state is not None:
+            self._flush_ring_buffer(incremental_state)
             prev_X = self._get_input_buffer(incremental_state)
             if prev_X is not None:
                 X = torch.cat([prev_X, X], dim=0)
@@ -119,6 +128,48 @@ class DynamicConv1dTBC(nn.Module):
             output = output + self.conv_bias.view(1, 1, -1)
         return output
 
+    def _forward_one_step(self, X, incremental_state, query):
+        '''Generate a single step with a ring buffer of the last K inputs.
+
+        We only compute the kernel of the new query, and take one weighted
+        sum over the buffer, instead of convolving the whole window again.'''
+        # X.shape == [1, batch_size, input_dim]
+
+        _, B, C = X.size()
+        K, H = self.kernel_size, self.num_heads
+        R = C // H
+        assert R * H == C == self.input_size
+
+        query = X if query is None else query
+        weight = self.weight_linear(query).view(B*H, K)
+        # weight.shape == [batch_size * n_heads, kernel_size]
+
+        buffer, step = self._get_ring_buffer(incremental_state, X)
+        tap_order = ring_buffer_step(buffer, step, X)
+        # buffer.shape == [kernel_size, batch_size, input_dim]
+
+        if self.weight_softmax:
+            if self.renorm_padding and step < K - 1:
+                # Only normalize over the taps that see a real input
+                weight = weight.clone()
+                weight[:, :K-1-step] = float('-inf')
+            weight = F.softmax(weight, dim=1)
+
+        weight = F.dropout(weight, self.weight_dropout,
+                           training=self.training, inplace=False)
+
+        weight = weight.index_select(1, tap_order).unsqueeze(2)
+        # weight.shape == [batch_size * n_heads, kernel_size, 1]
+
+        X_window = buffer.view(K, B*H, R).permute(1, 2, 0)
+        # X_window.shape == [batch_size * n_heads, head_size, kernel_size]
+
+        output = torch.bmm(X_window, weight)
+        # output.shape == [batch_size * n_heads, head_size, 1]
+
+        self._set_ring_buffer(incremental_state, buffer, step + 1)
+        return output.view(1, B, C)
+
     def _forward_unfolded(self, X, incremental_state, query):
         '''The conventional implementation of convolutions.
         Unfolding the input by having a window shifting to the right.'''
@@ -340,6 +391,24 @@ class DynamicConv1dTBC(nn.Module):
         if input_buffer is not None:
             input_buffer = input_buffer.index_select(1, new_order)
             self._set_input_buffer(incremental_state, input_buffer)
+        ring_buffer = get_incremental_state(
+            self, incremental_state, 'ring_buffer')
+        if ring_buffer is not None:
+            ring_buffer = ring_buffer.index_select(1, new_order)
+            set_incremental_state(
+                self, incremental_state, 'ring_buffer', ring_buffer)
+
+    def extend_incremental_state(self, incremental_state, n_new):
+        # The ring position is shared by the batch, so with renormalization
+        # the new sequences would see the wrong number of real inputs.
+        assert not self.renorm_padding
+        # Empty slots are zero, like the left padding of a new sequence
+        for key in ['input_buffer', 'ring_buffer']:
+            buffer = get_incremental_state(self, incremental_state, key)
+            if buffer is not None:
+                K, _, C = buffer.shape
+                buffer = torch.cat([buffer, buffer.new_zeros(K, n_new, C)], dim=1)
+                set_incremental_state(self, incremental_state, key, buffer)
 
     def _get_input_buffer(self, incremental_state):
         return get_incremental_state(self, incremental_state, 'input_buffer')
@@ -347,6 +416,39 @@ class DynamicConv1dTBC(nn.Module):
     def _set_input_buffer(self, incremental_state, new_buffer):
         return set_incremental_state(self, incremental_state, 'input_buffer', new_buffer)
 
+    def _get_ring_buffer(self, incremental_state, X):
+        buffer = get_incremental_state(self, incremental_state, 'ring_buffer')
+        if buffer is not None:
+            step = get_incremental_state(self, incremental_state, 'ring_step')
+            return buffer, step
+
+        # Start from the history of earlier multi-step calls, if any
+        _, B, C = X.size()
+        buffer = X.new_zeros(self.kernel_size, B, C)
+        step = 0
+        prev_X = self._get_input_buffer(incremental_state)
+        if prev_X is not None:
+            step = min(prev_X.size(0), self.kernel_size - 1)
+            buffer[:step] = prev_X[prev_X.size(0)-step:]
+            self._set_input_buffer(incremental_state, None)
+        return buffer, step
+
+    def _set_ring_buffer(self, incremental_state, buffer, step):
+        set_incremental_state(self, incremental_state, 'ring_buffer', buffer)
+        set_incremental_state(self, incremental_state, 'ring_step', step)
+
+    def _flush_ring_buffer(self, incremental_state):
+        # Multi-step calls keep their history in the input buffer
+        buffer = get_incremental_state(self, incremental_state, 'ring_buffer')
+        if buffer is None:
+            return
+        step = get_incremental_state(self, incremental_state, 'ring_step')
+        n_prev = min(step, self.kernel_size - 1)
+        times = torch.arange(step - n_prev, step, device=buffer.device)
+        self._set_input_buffer(
+            incremental_state, buffer.index_select(0, times % self.kernel_size))
+        set_incremental_state(self, incremental_state, 'ring_buffer', None)
+
     def extra_repr(self):
         s = '{}, kernel_size={}, padding_l={}, num_heads={}, weight_softmax={}, conv_bias={}, renorm_padding={}, in_proj={}'.format(
             self.input_size, self.kernel_size, self.padding_l,
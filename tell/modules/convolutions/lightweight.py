@@ -12,7 +12,7 @@ import torch.nn.functional as F
 
 from tell.utils import get_incremental_state, set_incremental_state
 
-from .unfold import unfold1d
+from .unfold import ring_buffer_step, unfold1d
 
 
 class LightweightConv1d(nn.Module):
@@ -157,14 +157,19 @@ class LightweightConv1dTBC(nn.Module):
 
         weight = self.weight.view(H, K)
         if incremental_state is not None:
+            # The input buffer is a ring buffer of the last K inputs, so we
+            # generate one step at a time.
+            assert T == 1
             input_buffer = self._get_input_buffer(incremental_state)
             if input_buffer is None:
-                input_buffer = x.new()
-            x_unfold = torch.cat([input_buffer, x.unsqueeze(3)], dim=3)
-            if self.kernel_size > 1:
-                self._set_input_buffer(
-                    incremental_state, x_unfold[:, :, :, -self.kernel_size+1:])
-            x_unfold = x_unfold.view(T*B*H, R, -1)
+                input_buffer = x.new_zeros(K, B, C)
+                step = 0
+            else:
+                step = get_incremental_state(self, incremental_state, 'step')
+            tap_order = ring_buffer_step(input_buffer, step, x)
+            self._set_input_buffer(incremental_state, input_buffer)
+            set_incremental_state(self, incremental_state, 'step', step + 1)
+            x_unfold = input_buffer.view(K, B*H, R).permute(1, 2, 0)
         else:
             # unfold the input: T x B x C --> T' x B x C x K
             x_unfold = unfold1d(x, self.kernel_size, self.padding_l, 0)
@@ -174,8 +179,7 @@ class LightweightConv1dTBC(nn.Module):
             weight = F.softmax(weight.float(), dim=1).type_as(weight)
 
         if incremental_state is not None:
-            weight = weight[:, -x_unfold.size(2):]
-            K = weight.size(1)
+            weight = weight.index_select(1, tap_order)
 
         weight = weight.view(1, H, K).expand(
             T*B, H, K).contiguous().view(T*B*H, K, 1)
@@ -224,6 +228,15 @@ class LightweightConv1dTBC(nn.Module):
             input_buffer = input_buffer.index_select(1, new_order)
             self._set_input_buffer(incremental_state, input_buffer)
 
+    def extend_incremental_state(self, incremental_state, n_new):
+        # Empty slots are zero, like the left padding of a new sequence
+        input_buffer = self._get_input_buffer(incremental_state)
+        if input_buffer is not None:
+            K, _, C = input_buffer.shape
+            input_buffer = torch.cat(
+                [input_buffer, input_buffer.new_zeros(K, n_new, C)], dim=1)
+            self._set_input_buffer(incremental_state, input_buffer)
+
     def _get_input_buffer(self, incremental_state):
         return get_incremental_state(self, incremental_state, 'input_buffer')
 
@@ -0,0 +1,56 @@
+import unittest
+
+import torch
+
+from tell.modules.convolutions.dynamic import DynamicConv1dTBC
+from tell.modules.convolutions.lightweight import LightweightConv1dTBC
+
+
+class TestIncrementalConvolutions(unittest.TestCase):
+    def test_dynamic_conv_one_step_at_a_time(self):
+        torch.manual_seed(0)
+        X = torch.randn(9, 2, 8)
+        for kernel_size in [1, 3, 7, 15]:
+            for renorm_padding in [False, True]:
+                conv = DynamicConv1dTBC(8, kernel_size, padding_l=kernel_size-1,
+                                        num_heads=2, weight_softmax=True,
+                                        renorm_padding=renorm_padding)
+                conv.eval()
+                output = conv(X)
+
+                incremental_state = {}
+                output_incr = [conv(X[i:i+1], incremental_state)
+                               for i in range(X.shape[0])]
+                output_incr = torch.cat(output_incr, dim=0)
+                self.assertTrue(torch.allclose(output, output_incr, atol=1e-6))
+
+    def test_dynamic_conv_mixed_steps(self):
+        torch.manual_seed(0)
+        X = torch.randn(9, 2, 8)
+        conv = DynamicConv1dTBC(8, 3, padding_l=2, num_heads=2,
+                                weight_softmax=True)
+        conv.eval()
+        output = conv(X)
+
+        incremental_state = {}
+        output_incr = [conv(X[:4], incremental_state),
+                       conv(X[4:5], incremental_state),
+                       conv(X[5:6], incremental_state),
+                       conv(X[6:], incremental_state)]
+        output_incr = torch.cat(output_incr, dim=0)
+        self.assertTrue(torch.allclose(output, output_incr, atol=1e-6))
+
+    def test_lightweight_conv_one_step_at_a_time(self):
+        torch.manual_seed(0)
+        X = torch.randn(9, 2, 8)
+        for kernel_size in [1, 3, 7, 15]:
+            conv = LightweightConv1dTBC(8, kernel_size, padding_l=kernel_size-1,
+                                        num_heads=2, weight_softmax=True)
+            conv.eval()
+            output = conv(X)
+
+            incremental_state = {}
+            output_incr = [conv(X[i:i+1], incremental_state)
+                           for i in range(X.shape[0])]
+            output_incr = torch.cat(output_incr, dim=0)
+            self.assertTrue(torch.allclose(output, output_incr, atol=1e-6))
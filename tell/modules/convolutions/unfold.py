@@ -5,6 +5,7 @@
 # the root directory of this source tree. An additional grant of patent rights
 # can be found in the PATENTS file in the same directory.
 
+import torch
 import torch.nn.functional as F
 
 
@@ -19,3 +20,16 @@ def unfold1d(x, kernel_size, padding_l, pad_value=0):
     else:
         x = x.unsqueeze(3)
     return x
+
+
+def ring_buffer_step(buffer, step, x):
+    '''Write the input at time `step` into a ring buffer of the last K inputs.
+
+    The buffer is K x B x C and x is 1 x B x C. Slots that have never been
+    written are zero, just like the left padding of a causal convolution.
+    Returns the index of the kernel tap that applies to each slot, so that
+    we can reorder the small weight instead of shifting the inputs.
+    '''
+    K = buffer.size(0)
+    buffer[step % K] = x[0]
+    return (torch.arange(K, device=buffer.device) - step - 1) % K
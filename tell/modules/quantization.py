@@ -0,0 +1,82 @@
+import torch
+import torch.nn as nn
+
+from .attention import MultiHeadAttention
+from .linear import GehringLinear, TiedLinear
+
+
+def quantize_model(model: nn.Module) -> nn.Module:
+    """Quantize the linear layers of a model to int8 for CPU inference.
+
+    This is dynamic quantization: the weights are stored in int8 and the
+    activations are quantized on the fly, so we don't need calibration data.
+    PyTorch only quantizes plain linear layers, so we first convert:
+
+    - GehringLinear, by folding the weight normalization into the weight.
+    - TiedLinear, by giving the adaptive softmax its own copy of the
+      embedding weights that it shares.
+    - The input projections of MultiHeadAttention, which become separate
+      linear layers.
+
+    The model is modified in place. Quantized models only run on the CPU and
+    only support inference.
+    """
+    model.eval()
+    for module in model.modules():
+        if isinstance(module, MultiHeadAttention):
+            module.split_projections_()
+        elif hasattr(module, 'enable_torch_version'):
+            # The attention of fairseq (in RoBERTa) already has separate
+            # projections, but passes their weights to the fused PyTorch
+            # implementation, which needs float weights.
+            module.enable_torch_version = False
+
+    _replace_linears(model)
+
+    return torch.quantization.quantize_dynamic(
+        model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def is_quantized(state_dict) -> bool:
+    """Check if the weights were saved from a quantized model."""
+    return any('_packed_params' in key for key in state_dict)
+
+
+def load_model_state(model: nn.Module, state_dict, quantize: bool = False) -> nn.Module:
+    """Load float or quantized weights into a freshly built model.
+
+    Quantized weights can only be loaded into a model that was quantized
+    first. With float weights, we quantize after loading if `quantize` is
+    set.
+    """
+    if is_quantized(state_dict):
+        quantize_model(model)
+        model.load_state_dict(state_dict)
+    else:
+        model.load_state_dict(state_dict)
+        if quantize:
+            quantize_model(model)
+    return model
+
+
+def _replace_linears(module):
+    for name, child in module.named_children():
+        if isinstance(child, GehringLinear):
+            if hasattr(child, 'weight_g'):
+                nn.utils.remove_weight_norm(child)
+            setattr(module, name, _to_linear(child.weight, child.bias))
+        elif isinstance(child, TiedLinear):
+            weight = child.weight.t() if child.transpose else child.weight
+            setattr(module, name, _to_linear(weight, None))
+        else:
+            _replace_linears(child)
+
+
+def _to_linear(weight, bias):
+    out_features, in_features = weight.shape
+    linear = nn.Linear(in_features, out_features,
+                       bias=bias is not None).to(weight)
+    linear.weight.data.copy_(weight.data)
+    if bias is not None:
+        linear.bias.data.copy_(bias.data)
+    return linear
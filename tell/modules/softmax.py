@@ -220,3 +220,44 @@ class AdaptiveSoftmax(nn.Module):
         log_probs = torch.cat(log_probs_list, dim=1)
         log_probs = log_probs.view(batch_size, seq_len, self.vocab_size)
         return log_probs
+
+    def topk_log_prob(self, X, k):
+        """Get the k most likely words without computing the full distribution.
+
+        We score the head first. The log probability of a tail word is at
+        most the log prior of its cluster, so a tail cluster can only change
+        the result for inputs whose prior beats their current k-th best
+        score. We evaluate each tail only on those inputs.
+
+        Returns the log probabilities and the word indices, both of shape
+        [batch_size, seq_len, k], sorted in descending order.
+        """
+        batch_size, seq_len, dim = X.size()
+        X = X.contiguous().view(-1, dim)
+
+        head_size = self.cutoff[0] + len(self.tail)
+        head_log_probs = self.lsm(self.head(X))
+        topk_lprobs, topk_indices = head_log_probs[:, :self.cutoff[0]].topk(k)
+        tail_priors = head_log_probs[:, self.cutoff[0]:head_size]
+
+        for i in range(len(self.tail)):
+            needed = tail_priors[:, i] > topk_lprobs[:, -1]
+            if not needed.any():
+                continue
+            idx = needed.nonzero().squeeze(1)
+
+            tail_i = self.lsm(self.tail[i](X.index_select(0, idx)))
+            tail_i = tail_i + tail_priors[idx, i, None]
+            tail_lprobs, tail_indices = tail_i.topk(min(k, tail_i.shape[1]))
+            tail_indices = tail_indices + self.cutoff[i]
+
+            # Merge the candidates of the tail with the current best
+            lprobs = torch.cat([topk_lprobs[idx], tail_lprobs], dim=1)
+            indices = torch.cat([topk_indices[idx], tail_indices], dim=1)
+            lprobs, order = lprobs.topk(k)
+            topk_lprobs[idx] = lprobs
+            topk_indices[idx] = indices.gather(1, order)
+
+        topk_lprobs = topk_lprobs.view(batch_size, seq_len, k)
+        topk_indices = topk_indices.view(batch_size, seq_len, k)
+        return topk_lprobs, topk_indices
@@ -0,0 +1,130 @@
+import math
+import unittest
+
+import torch
+
+from tell.modules import BeamSearch, MultiHeadAttention
+
+BOS, PAD, EOS = 0, 1, 2
+
+# The probability of the next token given the previous one, for each caption
+TRANSITIONS = [
+    # Caption 0 finishes after one step, and its captions are all done
+    # after two steps.
+    {BOS: {EOS: 0.7, 3: 0.2, 4: 0.1},
+     3: {EOS: 0.9, 4: 0.1},
+     4: {EOS: 0.9, 3: 0.1}},
+    # Greedy search picks 3 and stops, but 4 5 </s> is more likely per
+    # token. The finished 3 </s> is carried along with padding.
+    {BOS: {3: 0.55, 4: 0.45},
+     3: {EOS: 0.8, 3: 0.1, 4: 0.1},
+     4: {5: 0.95, EOS: 0.05},
+     5: {EOS: 0.99, 3: 0.01}},
+]
+
+
+class ToyDecoder:
+    """Score the next token from the previous one, like a bigram model.
+
+    The hypotheses are reordered with the beam, so we keep track of which
+    caption each hypothesis belongs to.
+    """
+
+    def __init__(self, captions, beam_size, vocab_size=6):
+        self.captions = torch.LongTensor(captions).repeat_interleave(beam_size)
+        self.vocab_size = vocab_size
+        self.caption_orders = []
+
+    def step(self, prev_ids):
+        lprobs = torch.full((len(prev_ids), self.vocab_size), float('-inf'))
+        for i, (caption, prev_id) in enumerate(
+                zip(self.captions.tolist(), prev_ids[:, -1].tolist())):
+            for token, prob in TRANSITIONS[caption].get(prev_id, {}).items():
+                lprobs[i, token] = math.log(prob)
+        return lprobs
+
+    def reorder(self, hypo_order, caption_order):
+        self.captions = self.captions[hypo_order]
+        self.caption_orders.append(caption_order)
+
+
+class TestBeamSearch(unittest.TestCase):
+    def test_search_finds_best_caption(self):
+        decoder = ToyDecoder([0, 1], 2)
+        search = BeamSearch(2, max_len=10, eos=EOS, padding_idx=PAD)
+        seed_input = torch.full((2, 1), BOS, dtype=torch.long)
+        log_probs, token_ids = search.search(seed_input, decoder.step,
+                                             decoder.reorder)
+
+        # Caption 1 ends after three steps. Caption 0 is padded.
+        self.assertEqual(token_ids.tolist(), [[BOS, EOS, PAD, PAD],
+                                              [BOS, 4, 5, EOS]])
+        expected = torch.log(torch.tensor([[0.7, 0, 0], [0.45, 0.95, 0.99]]))
+        expected[0, 1:] = 0
+        self.assertTrue(torch.allclose(log_probs, expected))
+
+        # Caption 0 is dropped after the second step, and caption 1 takes
+        # its place at the front of the batch.
+        self.assertIsNone(decoder.caption_orders[0])
+        self.assertEqual(decoder.caption_orders[1].tolist(), [1])
+        self.assertEqual(len(decoder.caption_orders), 2)
+
+    def test_length_penalty(self):
+        # Without normalization, 3 </s> has the higher total log probability
+        decoder = ToyDecoder([1], 2)
+        search = BeamSearch(2, max_len=10, eos=EOS, padding_idx=PAD,
+                            len_penalty=0)
+        seed_input = torch.full((1, 1), BOS, dtype=torch.long)
+        _, token_ids = search.search(seed_input, decoder.step,
+                                     decoder.reorder)
+        self.assertEqual(token_ids.tolist(), [[BOS, 3, EOS, PAD]])
+
+    def test_max_len(self):
+        decoder = ToyDecoder([0, 1], 2)
+        search = BeamSearch(2, max_len=2, eos=EOS, padding_idx=PAD)
+        seed_input = torch.full((2, 1), BOS, dtype=torch.long)
+        log_probs, token_ids = search.search(seed_input, decoder.step,
+                                             decoder.reorder)
+        self.assertEqual(token_ids.shape, (2, 3))
+        self.assertEqual(log_probs.shape, (2, 2))
+        self.assertEqual(token_ids[0].tolist(), [BOS, EOS, PAD])
+        self.assertEqual(token_ids[1, 0].item(), BOS)
+        self.assertNotIn(PAD, token_ids[1].tolist())
+
+
+class TestBeamContextAttention(unittest.TestCase):
+    def test_reorder_keeps_one_context_per_caption(self):
+        torch.manual_seed(0)
+        K = 2
+        attn = MultiHeadAttention(8, 2, kdim=6, vdim=6,
+                                  encoder_decoder_attention=True).eval()
+        attn.set_beam_size(K)
+
+        X = torch.randn(4, 3, 6)
+        mask = torch.zeros(3, 4, dtype=torch.bool)
+        mask[1, 2:] = True
+
+        state = {}
+        query = torch.randn(1, 3 * K, 8)
+        attn(query, X, X, mask, state, static_kv=True)
+
+        # The hypotheses of a caption swap places. The cache is shared by
+        # them, so it doesn't change.
+        attn.reorder_incremental_state(
+            state, torch.LongTensor([1, 0, 2, 3, 5, 4]))
+        query = torch.randn(1, 3 * K, 8)
+        output, _ = attn(query, X, X, mask, state, static_kv=True)
+        expected, _ = attn(query, X, X, mask, {}, static_kv=True)
+        self.assertLess((output - expected).abs().max().item(), 1e-6)
+
+        # Caption 1 is dropped, and the hypotheses of caption 2 are reordered
+        attn.reorder_incremental_state(
+            state, torch.LongTensor([0, 1, 5, 4]))
+        keep = torch.LongTensor([0, 2])
+        query = torch.randn(1, 2 * K, 8)
+        output, _ = attn(query, X[:, keep], X[:, keep], mask[keep], state,
+                         static_kv=True)
+        expected, _ = attn(query, X[:, keep], X[:, keep], mask[keep], {},
+                           static_kv=True)
+        self.assertLess((output - expected).abs().max().item(), 1e-6)
+        attn.set_beam_size(None)
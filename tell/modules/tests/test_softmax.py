@@ -0,0 +1,27 @@
+import unittest
+
+import torch
+
+from tell.modules.softmax import AdaptiveSoftmax
+
+
+class TestAdaptiveSoftmax(unittest.TestCase):
+    def test_topk_log_prob_matches_full_distribution(self):
+        torch.manual_seed(0)
+        softmax = AdaptiveSoftmax(vocab_size=100, input_dim=16,
+                                  cutoff=[20, 50], dropout=0.1)
+        softmax.eval()
+
+        X = torch.randn(4, 3, 16)
+        # Push some inputs towards the tail clusters
+        X[0] *= 10
+
+        for k in [1, 5]:
+            lprobs, indices = softmax.topk_log_prob(X, k)
+            self.assertEqual(list(lprobs.shape), [4, 3, k])
+
+            expected_lprobs, expected_indices = \
+                softmax.get_log_prob(X).topk(k)
+            self.assertTrue(torch.allclose(lprobs, expected_lprobs,
+                                           atol=1e-6))
+            self.assertTrue(torch.equal(indices, expected_indices))
@@ -59,6 +59,9 @@ class AdaptiveEmbedding(TokenEmbedder):
         return self.embeddings[band][0].weight, self.embeddings[band][1].weight
 
     def forward(self, X: torch.Tensor, incremental_state=None):
+        if torch.jit.is_tracing():
+            return self._forward_traceable(X)
+
         result_shape = X.shape + (self.embed_size,)
         result = self.embeddings[0][0].weight.new_zeros(result_shape)
 
@@ -75,6 +78,22 @@ class AdaptiveEmbedding(TokenEmbedder):
         result = self.embed_scale * result
         return result
 
+    def _forward_traceable(self, X):
+        # The number of words in each band depends on the input, so a traced
+        # graph can't select them. Instead we embed every word in every band
+        # and keep the right one. This is only worth it for a few words, e.g.
+        # when generating one step at a time.
+        result = None
+        for i in range(len(self.cutoff)):
+            prev = self.cutoff[i - 1] if i > 0 else 0
+            mask = (X >= prev) & (X < self.cutoff[i])
+            chunk_input = (X - prev).clamp(0, self.cutoff[i] - prev - 1)
+            embeds = self.embeddings[i](chunk_input)
+            embeds = embeds * mask.unsqueeze(-1).type_as(embeds)
+            result = embeds if result is None else result + embeds
+
+        return self.embed_scale * result
+
     @overrides
     def get_output_dim(self) -> int:
         return self.embed_size
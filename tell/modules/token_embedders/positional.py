@@ -48,16 +48,16 @@ class LearnedPositionalEmbedding(TokenEmbedder, nn.Embedding):
         """
         seq_len = X.shape[1]
         if incremental_state is not None:
-            start_pos = self._get_last_position(incremental_state)
-            max_pos = start_pos + seq_len
-            self._save_last_position(incremental_state, max_pos)
+            # Each sequence in the batch can be at a different position
+            start_pos = self._get_last_position(incremental_state, X)
+            self._save_last_position(incremental_state, start_pos + seq_len)
+            start_pos = start_pos.unsqueeze(1)
         else:
             start_pos = 0
-            max_pos = seq_len
 
         positions = make_positions(X.data, self.padding_idx, self.left_pad)
         pos_mask = positions != self.padding_idx
-        positions[pos_mask] = positions[pos_mask] + start_pos
+        positions = torch.where(pos_mask, positions + start_pos, positions)
 
         # if incremental_state is not None:
         #     # positions is the same for every token when decoding a single step
@@ -71,15 +71,27 @@ class LearnedPositionalEmbedding(TokenEmbedder, nn.Embedding):
     def get_output_dim(self) -> int:
         return self.embedding_dim
 
-    def _get_last_position(self, incremental_state):
+    def _get_last_position(self, incremental_state, X):
         last_pos = get_incremental_state(self, incremental_state, 'position')
         if last_pos is None:
-            last_pos = 0
+            last_pos = X.new_zeros(X.shape[0])
         return last_pos
 
     def _save_last_position(self, incremental_state, position):
         set_incremental_state(self, incremental_state, 'position', position)
 
+    def reorder_incremental_state(self, incremental_state, new_order):
+        last_pos = get_incremental_state(self, incremental_state, 'position')
+        if last_pos is not None:
+            self._save_last_position(
+                incremental_state, last_pos.index_select(0, new_order))
+
+    def extend_incremental_state(self, incremental_state, n_new):
+        last_pos = get_incremental_state(self, incremental_state, 'position')
+        if last_pos is not None:
+            self._save_last_position(incremental_state, torch.cat(
+                [last_pos, last_pos.new_zeros(n_new)]))
+
 
 @TokenEmbedder.register('sinusoidal_positional')
 class SinusoidalPositionalEmbedding(TokenEmbedder):
@@ -168,9 +180,14 @@ class SinusoidalPositionalEmbedding(TokenEmbedder):
         """Input is expected to be of size [bsz x seqlen]."""
         batch_size, seq_len = X.shape
         if incremental_state is not None:
-            start_pos = self._get_last_position(incremental_state)
-            max_pos = start_pos + seq_len
-            self._save_last_position(incremental_state, max_pos)
+            # Each sequence in the batch can be at a different position.
+            # We also keep an upper bound on the positions so that we don't
+            # need to look at the device to know the table is big enough.
+            start_pos = self._get_last_position(incremental_state, X)
+            max_pos = self._get_max_position(incremental_state) + seq_len
+            self._save_last_position(incremental_state, start_pos + seq_len)
+            self._save_max_position(incremental_state, max_pos)
+            start_pos = start_pos.unsqueeze(1)
         else:
             start_pos = 0
             max_pos = seq_len
@@ -196,7 +213,7 @@ class SinusoidalPositionalEmbedding(TokenEmbedder):
         positions = make_positions(
             X, self.padding_idx, self.left_pad, self.onnx_trace)
         pos_mask = positions != self.padding_idx
-        positions[pos_mask] = positions[pos_mask] + start_pos
+        positions = torch.where(pos_mask, positions + start_pos, positions)
         # if self.onnx_trace:
         #     flat_embeddings = self.weights.detach().index_select(0, positions.view(-1))
         #     embedding_shape = torch.cat(
@@ -218,15 +235,44 @@ class SinusoidalPositionalEmbedding(TokenEmbedder):
     def get_output_dim(self) -> int:
         return self.embedding_dim
 
-    def _get_last_position(self, incremental_state):
+    def _get_last_position(self, incremental_state, X):
         last_pos = get_incremental_state(self, incremental_state, 'position')
         if last_pos is None:
-            last_pos = 0
+            last_pos = X.new_zeros(X.shape[0])
         return last_pos
 
     def _save_last_position(self, incremental_state, position):
         set_incremental_state(self, incremental_state, 'position', position)
 
+    def _get_max_position(self, incremental_state):
+        max_pos = get_incremental_state(self, incremental_state, 'max_position')
+        if max_pos is None:
+            max_pos = 0
+        return max_pos
+
+    def _save_max_position(self, incremental_state, position):
+        set_incremental_state(self, incremental_state, 'max_position', position)
+
+    def _reset_positions(self, incremental_state, last_pos):
+        # The bound only grows while decoding, so we tighten it whenever the
+        # batch changes. Otherwise a batch that never fully drains would keep
+        # growing the position table.
+        self._save_last_position(incremental_state, last_pos)
+        max_pos = last_pos.max().item() if last_pos.numel() > 0 else 0
+        self._save_max_position(incremental_state, max_pos)
+
+    def reorder_incremental_state(self, incremental_state, new_order):
+        last_pos = get_incremental_state(self, incremental_state, 'position')
+        if last_pos is not None:
+            self._reset_positions(
+                incremental_state, last_pos.index_select(0, new_order))
+
+    def extend_incremental_state(self, incremental_state, n_new):
+        last_pos = get_incremental_state(self, incremental_state, 'position')
+        if last_pos is not None:
+            self._reset_positions(incremental_state, torch.cat(
+                [last_pos, last_pos.new_zeros(n_new)]))
+
 
 def make_positions(X, padding_idx, left_pad, onnx_trace=False):
     """Replace non-padding symbols with their position numbers.
@@ -2,7 +2,8 @@ import unittest
 
 import torch
 
-from tell.modules.token_embedders.positional import make_positions
+from tell.modules.token_embedders.positional import (
+    SinusoidalPositionalEmbedding, make_positions)
 
 
 class TestEmbeddings(unittest.TestCase):
@@ -42,3 +43,45 @@ class TestEmbeddings(unittest.TestCase):
     def assertAlmostEqual(self, t1, t2):
         self.assertEqual(t1.size(), t2.size(), "size mismatch")
         self.assertLess((t1 - t2).abs().max().item(), 1e-4)
+
+
+class TestSinusoidalPositionalEmbedding(unittest.TestCase):
+    def test_reorder_and_extend_incremental_state(self):
+        pad = 1
+        embedder = SinusoidalPositionalEmbedding(
+            None, 8, pad, left_pad=False, init_size=16)
+        full = embedder(torch.full((3, 4), 9, dtype=torch.long))
+
+        state = {}
+        for _ in range(3):
+            embedder(torch.full((3, 1), 9, dtype=torch.long), state)
+
+        # Keep the first and last sequences, then add a new one
+        embedder.reorder_incremental_state(state, torch.LongTensor([0, 2]))
+        self.assertEqual(embedder._get_max_position(state), 3)
+        embedder.extend_incremental_state(state, 1)
+        self.assertEqual(embedder._get_max_position(state), 3)
+
+        embeds = embedder(torch.full((3, 1), 9, dtype=torch.long), state)
+        self.assertAlmostEqual(embeds[:2, 0], full[:2, 3])
+        self.assertAlmostEqual(embeds[2, 0], full[2, 0])
+
+    def test_position_table_does_not_grow(self):
+        # Replace the oldest sequence after every step, so that the batch
+        # never drains but no sequence is longer than the batch size
+        embedder = SinusoidalPositionalEmbedding(
+            None, 8, 1, left_pad=False, init_size=16)
+        state = {}
+        X = torch.full((4, 1), 9, dtype=torch.long)
+        for _ in range(100):
+            embedder(X, state)
+            embedder.reorder_incremental_state(
+                state, torch.LongTensor([1, 2, 3]))
+            embedder.extend_incremental_state(state, 1)
+
+        self.assertEqual(embedder.weights.shape[0], 17)
+        self.assertLessEqual(embedder._get_max_position(state), 4)
+
+    def assertAlmostEqual(self, t1, t2):
+        self.assertEqual(t1.size(), t2.size(), "size mismatch")
+        self.assertLess((t1 - t2).abs().max().item(), 1e-4)
@@ -0,0 +1,113 @@
+"""Generate captions with a decoder exported by ``tell export-decoder``.
+
+This module only needs PyTorch, so it can run on machines without AllenNLP
+or fairseq. The contexts are given batch first, together with their padding
+masks (True for padding), in the same format as the model uses:
+
+    image.shape == [batch_size, 49, 2048]
+    article.shape == [batch_size, article_len, 1024]
+    faces.shape == [batch_size, n_faces, 512]
+    obj.shape == [batch_size, n_objects, 2048]
+"""
+import json
+import os
+from typing import List, Tuple
+
+import torch
+
+
+class CaptionDecoder:
+    """Load the exported decoder and generate captions one token at a time.
+
+    Parameters
+    ----------
+    export_dir : ``str``
+        The output directory of ``tell export-decoder``.
+    device : ``str``
+        Where to run the decoder.
+    """
+
+    def __init__(self, export_dir: str, device: str = 'cpu') -> None:
+        with open(os.path.join(export_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.device = torch.device(device)
+        self.encoder = torch.jit.load(os.path.join(export_dir, 'encoder.pt'),
+                                      map_location=self.device)
+        self.step = torch.jit.load(os.path.join(export_dir, 'step.pt'),
+                                   map_location=self.device)
+
+    @torch.no_grad()
+    def generate(self, image, image_mask, article, article_mask,
+                 faces, faces_mask, obj, obj_mask,
+                 max_len: int = 100,
+                 temperature: float = 1.0) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Generate a caption for each item in the batch.
+
+        With a top k of 1 (the default in the config), this is greedy
+        decoding. Otherwise we sample from the top k words.
+
+        Returns
+        -------
+        log_probs : ``torch.Tensor``
+            The log probability of each generated token, with shape
+            [batch_size, gen_len]. Finished captions have zero log probs.
+        token_ids : ``torch.LongTensor``
+            The generated captions, starting with <s>, with shape
+            [batch_size, gen_len + 1]. Finished captions are padded.
+        """
+        meta = self.meta
+        masks = [image_mask, article_mask, faces_mask, obj_mask]
+        contexts = [image, article, faces, obj]
+        inputs: List[torch.Tensor] = []
+        for X, mask in zip(contexts, masks):
+            inputs += [X.to(self.device), mask.to(self.device).bool()]
+        masks = inputs[1::2]
+        keys_values = list(self.encoder(*inputs))
+
+        B = image.shape[0]
+        prev_ids = torch.full((B, 1), meta['bos'], dtype=torch.long,
+                              device=self.device)
+        positions = prev_ids.new_zeros(B)
+        conv_state = inputs[0].new_zeros(meta['n_layers'], meta['n_history'],
+                                         B, meta['conv_dim'])
+
+        token_ids = prev_ids.new_full((B, max_len + 1), meta['padding_idx'])
+        token_ids[:, 0] = meta['bos']
+        log_probs = inputs[0].new_zeros(B, max_len)
+        active = torch.arange(B, device=self.device)
+        gen_len = 0
+
+        for i in range(max_len):
+            topk_lprobs, topk_indices, positions, conv_state = self.step(
+                prev_ids, positions, conv_state, *masks, *keys_values)
+            # topk_lprobs.shape == [batch_size, topk]
+
+            topk_lprobs = topk_lprobs / temperature
+            if meta['topk'] > 1:
+                # Take a random sample from those top k
+                sampled = torch.multinomial(topk_lprobs.exp(), num_samples=1)
+                topk_lprobs = topk_lprobs.gather(1, sampled)
+                topk_indices = topk_indices.gather(1, sampled)
+            # topk_indices.shape == [batch_size, 1]
+
+            token_ids[active, i + 1] = topk_indices[:, 0]
+            log_probs[active, i] = topk_lprobs[:, 0]
+            gen_len = i + 1
+
+            is_eos = topk_indices[:, 0] == meta['eos']
+            if is_eos.all():
+                break
+
+            # Drop the finished captions from the state
+            if is_eos.any():
+                keep = (~is_eos).nonzero().squeeze(1)
+                active = active[keep]
+                topk_indices = topk_indices[keep]
+                positions = positions[keep]
+                conv_state = conv_state[:, :, keep]
+                masks = [mask[keep] for mask in masks]
+                keys_values = [X[:, keep] for X in keys_values]
+
+            prev_ids = topk_indices
+
+        return log_probs[:, :gen_len], token_ids[:, :gen_len + 1]
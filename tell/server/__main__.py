@@ -14,6 +14,13 @@ Options:
     -n --n-workers INT  Number of workers [default: 1].
     --port INT          Port in [default: 5558].
     --port-out INT      Port out [default: 5559].
+    -z --int8           Run the model with int8 dynamic quantization on the
+                        CPU.
+    -c --cache-size INT Number of results and image features cached in
+                        memory. Cache lookups decode every request in the
+                        ventilator, so the cache is off by default
+                        [default: 0].
+    --cache-dir DIR     Also cache results and image features on disk.
     TASK                One of: coref, grid.
 """
 import ptvsd
@@ -33,6 +40,7 @@ def validate(args):
         'n_workers': Use(int),
         'port': Use(int),
         'port_out': Use(int),
+        'cache_size': And(Use(int), lambda n: n >= 0),
         object: object,
     })
     args = schema.validate(args)
@@ -53,7 +61,10 @@ def main():
     with NLPServer(task=args['task'],
                    n_workers=args['n_workers'],
                    port=args['port'],
-                   port_out=args['port_out']) as server:
+                   port_out=args['port_out'],
+                   quantize=args['int8'],
+                   cache_size=args['cache_size'],
+                   cache_dir=args['cache_dir']) as server:
         server.join()
 
 
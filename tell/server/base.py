@@ -1,12 +1,13 @@
-import random
+import hashlib
+import itertools
+import os
 import sys
 import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime
-from typing import Dict
+from typing import Deque, Dict, List, Tuple
 
-import numpy as np
 import zmq
 import zmq.decorators as zmqd
 from termcolor import colored
@@ -15,7 +16,10 @@ from zmq.utils import jsonapi
 
 from tell.tasks import WorkerRegistry
 
-from .utils import ServerCmd, auto_bind, set_logger
+from .cache import LRUCache
+from .protocol import (JSON, MSGPACK, PROTOCOLS, dump_items, frames_to_bytes,
+                       load_items, merge_items, split_items)
+from .utils import Priority, ServerCmd, auto_bind, set_logger
 from .zmq_decor import multi_socket
 
 __version__ = '0.0.1'
@@ -31,7 +35,8 @@ class NLPServer(threading.Thread):
     """For connecting two processes in the same server it is considered that IPC is the fastest option"""
 
     def __init__(self, port=5558, port_out=5559, n_workers=1, verbose=False,
-                 max_batch_size=32, task='coref'):
+                 max_batch_size=32, task='coref', quantize=False,
+                 cache_size=0, cache_dir=None):
         super().__init__()
         self.logger = set_logger(colored('VENTILATOR', 'magenta'), verbose)
         self.port = port
@@ -39,14 +44,24 @@ class NLPServer(threading.Thread):
         self.processes = []
         self.is_ready = threading.Event()
         self.n_workers = n_workers
-        self.n_concurrent_sockets = max(8, n_workers * 2)
+        # Each worker has one socket per priority lane
+        self.n_backend_sockets = n_workers * len(Priority.lanes)
         self.max_batch_size = max_batch_size
+        self.quantize = quantize
+        # The results are cached in memory if cache_size > 0 and on disk if
+        # cache_dir is given. Workers also cache intermediate features there.
+        # This is opt-in because the ventilator then has to decode each
+        # request to look up its items, rather than route the raw frames.
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.cache = None
         self.status_static = {
             'python_version': sys.version,
             'server_version': __version__,
             'pyzmq_version': zmq.pyzmq_version(),
             'zmq_version': zmq.zmq_version(),
             'server_start_time': str(datetime.now()),
+            'protocols': [p.decode('ascii') for p in PROTOCOLS],
         }
         self.Worker = WorkerRegistry[task]
 
@@ -91,35 +106,60 @@ class NLPServer(threading.Thread):
     @zmqd.context()
     @zmqd.socket(zmq.PULL)
     @zmqd.socket(zmq.PAIR)
-    @multi_socket(zmq.PUSH, num_socket='n_concurrent_sockets')
-    def _run(self, _, frontend, sink, *backend_socks):
+    @zmqd.socket(zmq.PULL)
+    @zmqd.socket(zmq.PUSH)
+    @multi_socket(zmq.PUSH, num_socket='n_backend_sockets')
+    def _run(self, _, frontend, sink, credit_sock, cache_sock, *backend_socks):
 
-        def push_new_job(_job_id, _json_msg, _msg_len):
-            _sock = rand_backend_socket
-            _sock.send_multipart([_job_id, _json_msg])
+        def get_cache_key(_item, _protocol):
+            try:
+                item_key = self.Worker.get_cache_key(_item)
+            except (KeyError, IndexError, TypeError, ValueError):
+                # Let the worker deal with malformed items
+                return None
+            if item_key is None:
+                return None
+            # The output also depends on the model and on the protocol
+            key = f'{cache_namespace}:{_protocol.decode()}:{item_key}'
+            return hashlib.sha1(key.encode('utf-8')).hexdigest()
 
         self.logger.info(f'Bind all sockets. Use ports '
                          f'{self.port}/{self.port_out}')
         frontend.bind(f'tcp://*:{self.port}')
         addr_front2sink = auto_bind(sink)
+        addr_credit = auto_bind(credit_sock)
         addr_backend_list = [auto_bind(b) for b in backend_socks]
         self.logger.info(f'open {len(addr_backend_list)} ventilator-worker '
                          'sockets')
 
+        cache_namespace = self.Worker.get_cache_namespace(self.quantize)
+        if cache_namespace and (self.cache_size > 0 or self.cache_dir):
+            result_dir = self.cache_dir and os.path.join(
+                self.cache_dir, 'results')
+            self.cache = LRUCache(self.cache_size, result_dir)
+
         self.logger.info('Start the sink')
-        proc_sink = Sink(self.port_out, addr_front2sink)
+        proc_sink = Sink(self.port_out, addr_front2sink,
+                         return_results=self.cache is not None)
         self.processes.append(proc_sink)
         proc_sink.start()
         addr_sink = sink.recv().decode('ascii')
+        cache_sock.connect(addr_sink)
 
         # start the backend processes
         device_map = [-1] * self.n_workers
         for idx, device_id in enumerate(device_map):
-            process = self.Worker(idx, addr_backend_list, addr_sink)
+            worker_addrs = addr_backend_list[idx::self.n_workers]
+            process = self.Worker(idx, worker_addrs, addr_sink,
+                                  credit_address=addr_credit,
+                                  quantize=self.quantize,
+                                  cache_size=self.cache_size,
+                                  cache_dir=self.cache_dir)
             self.processes.append(process)
             process.start()
 
-        rand_backend_socket = None
+        jobs = JobQueue(backend_socks, self.n_workers, self.max_batch_size,
+                        self.cache, cache_sock, get_cache_key)
         server_status = ServerStatistic()
 
         for p in self.processes:
@@ -128,17 +168,44 @@ class NLPServer(threading.Thread):
         self.is_ready.set()
         self.logger.info('all set, ready to serve request!')
 
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(credit_sock, zmq.POLLIN)
+        poller.register(sink, zmq.POLLIN)
+
         while True:
+            socks = dict(poller.poll())
+            if socks.get(credit_sock) == zmq.POLLIN:
+                worker_id, *credit = credit_sock.recv_multipart()
+                jobs.worker_loads[int(worker_id)].update(*map(int, credit))
+
+            if socks.get(sink) == zmq.POLLIN:
+                # The sink returns the results of the workers for the cache
+                _, part_id, protocol, *frames = sink.recv_multipart(
+                    copy=False)
+                keys = jobs.cache_keys.pop(part_id.bytes, [])
+                parts = split_items(frames, 1, protocol.bytes) if keys else []
+                for key, (_, item_frames) in zip(keys, parts):
+                    if key:
+                        self.cache.put(key, frames_to_bytes(item_frames))
+
+            if socks.get(frontend) != zmq.POLLIN:
+                jobs.dispatch()
+                continue
+
             try:
-                request = frontend.recv_multipart()
-                client, msg, req_id, msg_len = request
+                # Newer clients add the priority and whether to stream the
+                # results. Binary requests have the payload after these,
+                # which we forward to the workers without copying.
+                request = frontend.recv_multipart(copy=False)
+                client, msg, req_id, msg_len = [f.bytes for f in request[:4]]
             except ValueError:
                 self.logger.error(
                     'received a wrongly-formatted request (expected 4 frames, got %d)' % len(request))
                 self.logger.error('\n'.join('field %d: %s' % (idx, k)
                                             for idx, k in enumerate(request)), exc_info=True)
             else:
-                server_status.update(request)
+                server_status.update((client, msg, req_id, msg_len))
                 if msg == ServerCmd.terminate:
                     break
                 elif msg == ServerCmd.show_config:
@@ -149,42 +216,49 @@ class NLPServer(threading.Thread):
                                       'ventilator -> worker': addr_backend_list,
                                       'worker -> sink': addr_sink,
                                       'ventilator <-> sink': addr_front2sink,
+                                      'worker -> ventilator': addr_credit,
                                       'server_current_time': str(datetime.now()),
                                       'statistic': server_status.value,
                                       'device_map': device_map,
-                                      'n_concurrent_sockets': self.n_concurrent_sockets}
+                                      'num_pending_job': {p.decode(): len(q) for p, q in jobs.pending_jobs.items()},
+                                      'worker_load': [w.value for w in jobs.worker_loads],
+                                      'cache': self.cache.value if self.cache else None}
 
                     sink.send_multipart([client, msg, jsonapi.dumps({**status_runtime,
                                                                      **self.status_static}), req_id])
                 else:
                     self.logger.info('new encode request\treq id: %d\tsize: %d\tclient: %s' %
                                      (int(req_id), int(msg_len), client))
+                    priority = request[4].bytes if len(request) > 4 \
+                        else Priority.normal
+                    stream = request[5].bytes if len(request) > 5 else b'0'
+
                     # register a new job at sink
                     sink.send_multipart(
-                        [client, ServerCmd.new_job, msg_len, req_id])
+                        [client, ServerCmd.new_job, msg_len, req_id, stream])
 
-                    # renew the backend socket to prevent large job queueing up
-                    # [0] is reserved for high priority job
-                    # last used backennd shouldn't be selected either as it may be queued up already
-                    rand_backend_socket = random.choice(
-                        [b for b in backend_socks[1:] if b != rand_backend_socket])
+                    if priority not in Priority.lanes:
+                        self.logger.warning(f'unknown priority {priority}, '
+                                            f'use {Priority.normal}')
+                        priority = Priority.normal
+
+                    if msg == MSGPACK:
+                        protocol, payload = MSGPACK, request[6:]
+                    else:
+                        protocol, payload = JSON, request[1:2]
 
-                    # push a new job, note super large job will be pushed to one socket only,
-                    # leaving other sockets free
                     job_id = client + b'#' + req_id
-                    if int(msg_len) > self.max_batch_size:
-                        seqs = jsonapi.loads(msg)
-                        job_gen = []
-                        for i in range(0, int(msg_len), self.max_batch_size):
-                            pid = job_id + b'@%d' % i
-                            pjob = seqs[i:(i + self.max_batch_size)]
-                            job_gen.append((pid, pjob))
-
-                        for partial_job_id, job in job_gen:
-                            push_new_job(partial_job_id,
-                                         jsonapi.dumps(job), len(job))
+                    if self.cache is not None:
+                        n_cached = jobs.queue_with_cache(
+                            job_id, protocol, payload, priority)
+                        if n_cached:
+                            self.logger.info(f'cache hit\tsize: {n_cached}\t'
+                                             f'job id: {job_id}')
                     else:
-                        push_new_job(job_id, msg, int(msg_len))
+                        jobs.queue(job_id, protocol, payload, int(msg_len),
+                                   priority)
+
+            jobs.dispatch()
 
         for p in self.processes:
             p.close()
@@ -192,8 +266,11 @@ class NLPServer(threading.Thread):
 
 
 class Sink(Process):
-    def __init__(self, port_out, front_sink_addr, verbose=False):
+    def __init__(self, port_out, front_sink_addr, verbose=False,
+                 return_results=False):
         super().__init__()
+        # Send the results of the workers back to the ventilator, to cache
+        self.return_results = return_results
         self.port = port_out
         self.exit_flag = Event()
         self.logger = set_logger(colored('SINK', 'green'), verbose)
@@ -216,6 +293,35 @@ class Sink(Process):
     @zmqd.socket(zmq.PAIR)
     @zmqd.socket(zmq.PUB)
     def _run(self, receiver, frontend, sender):
+
+        def send_results(_job_info):
+            # Only the job that just changed can be done, so we don't need to
+            # scan all pending jobs.
+            _job = pending_jobs[_job_info]
+            client_addr, req_id = _job_info.split(b'#')
+            if _job.stream:
+                # Send each part as soon as it arrives, with the position of
+                # its first item
+                for pid, frames in _job.pop_outputs():
+                    sender.send_multipart(
+                        [client_addr, ServerCmd.data_partial, _job.protocol,
+                         b'%d' % pid] + frames + [req_id], copy=False)
+            elif _job.is_done:
+                if _job.protocol == MSGPACK:
+                    sender.send_multipart(
+                        [client_addr, MSGPACK] + _job.result + [req_id],
+                        copy=False)
+                else:
+                    sender.send_multipart(
+                        [client_addr] + _job.result + [req_id])
+
+            if _job.is_done:
+                logger.info('send back\tsize: %d\tjob id: %s' %
+                            (_job.checksum, _job_info))
+                # release the job
+                _job.clear()
+                pending_jobs.pop(_job_info)
+
         receiver_addr = auto_bind(receiver)
         frontend.connect(self.front_sink_addr)
         sender.bind('tcp://*:%d' % self.port)
@@ -238,48 +344,51 @@ class Sink(Process):
         while not self.exit_flag.is_set():
             socks = dict(poller.poll())
             if socks.get(receiver) == zmq.POLLIN:
-                msg = receiver.recv_multipart()
-                job_id = msg[0]
+                msg = receiver.recv_multipart(copy=False)
+                job_id = msg[0].bytes
                 # parsing job_id and partial_id
                 job_info = job_id.split(b'@')
                 job_id = job_info[0]
                 partial_id = int(job_info[1]) if len(job_info) == 2 else 0
 
-                if msg[2] == ServerCmd.data_embed:
-                    x = jsonapi.loads(msg[1])
-                    pending_jobs[job_id].add_output(x, partial_id)
+                # The worker sends [job_id, data_embed, protocol, n_items,
+                # *payload]. We keep the payload frames as they are.
+                # Cached results from the ventilator look the same.
+                if len(msg) > 4 and msg[1].bytes in [ServerCmd.data_embed,
+                                                     ServerCmd.data_cached]:
+                    protocol, n_items = msg[2].bytes, int(msg[3].bytes)
+                    pending_jobs[job_id].add_output(
+                        msg[4:], n_items, partial_id, protocol)
+                    if self.return_results and \
+                            msg[1].bytes == ServerCmd.data_embed:
+                        frontend.send_multipart(
+                            [ServerCmd.data_embed, msg[0], msg[2]] + msg[4:],
+                            copy=False)
                 else:
                     logger.error(
                         'received a wrongly-formatted request (expected 4 frames, got %d)' % len(msg))
                     logger.error('\n'.join('field %d: %s' % (idx, k)
                                            for idx, k in enumerate(msg)), exc_info=True)
 
-                logger.info('collect %s %s (E:%d/A:%d)' % (msg[2], job_id,
+                logger.info('collect %s %s (E:%d/A:%d)' % (msg[1].bytes, job_id,
                                                            pending_jobs[job_id].progress_outputs,
                                                            pending_jobs[job_id].checksum))
 
-                # check if there are finished jobs, then send it back to workers
-
-                finished = [(k, v)
-                            for k, v in pending_jobs.items() if v.is_done]
-                for job_info, tmp in finished:
-                    client_addr, req_id = job_info.split(b'#')
-                    x = tmp.result
-                    sender.send_multipart([client_addr, x, req_id])
-                    logger.info('send back\tsize: %d\tjob id: %s' %
-                                (tmp.checksum, job_info))
-                    # release the job
-                    tmp.clear()
-                    pending_jobs.pop(job_info)
+                # the results may arrive before the job is registered
+                if pending_jobs[job_id].is_registered:
+                    send_results(job_id)
 
             if socks.get(frontend) == zmq.POLLIN:
-                client_addr, msg_type, msg_info, req_id = frontend.recv_multipart()
+                client_addr, msg_type, msg_info, req_id, *flags = \
+                    frontend.recv_multipart()
                 if msg_type == ServerCmd.new_job:
                     job_info = client_addr + b'#' + req_id
                     # register a new job
                     pending_jobs[job_info].checksum = int(msg_info)
+                    pending_jobs[job_info].stream = flags == [b'1']
                     logger.info('job register\tsize: %d\tjob id: %s' %
                                 (int(msg_info), job_info))
+                    send_results(job_info)
                 elif msg_type == ServerCmd.show_config:
                     # dirty fix of slow-joiner: sleep so that client receiver can connect.
                     time.sleep(0.1)
@@ -289,19 +398,29 @@ class Sink(Process):
 
 class SinkJob:
     def __init__(self):
-        self.outputs = []
-        self.output_ids = []
+        # The frames of each part, by the position of its first item
+        self.outputs: Dict[int, list] = {}
         self.checksum = 0  # message length
         self.progress_outputs = 0
+        self.protocol = JSON
+        self.stream = False
 
     def clear(self):
         self.outputs.clear()
 
-    def add_output(self, data, pid):
-        progress = len(data)
-        self.outputs.append(data)
-        self.output_ids.append(pid)
-        self.progress_outputs += progress
+    def add_output(self, frames, n_items, pid, protocol):
+        self.outputs[pid] = frames
+        self.progress_outputs += n_items
+        self.protocol = protocol
+
+    def pop_outputs(self):
+        outputs = list(self.outputs.items())
+        self.outputs.clear()
+        return outputs
+
+    @property
+    def is_registered(self):
+        return self.checksum > 0
 
     @property
     def is_done(self):
@@ -309,11 +428,144 @@ class SinkJob:
 
     @property
     def result(self):
-        # Sort the results
-        sort_idx = np.argsort(self.output_ids)
-        outputs = np.array(self.outputs)[sort_idx].tolist()
-        outputs = [elem for output in outputs for elem in output]
-        return jsonapi.dumps(outputs)
+        # Merge the parts in order
+        return merge_items([self.outputs[pid] for pid in sorted(self.outputs)],
+                           self.protocol)
+
+
+class JobQueue:
+    """Hold the jobs of the ventilator until a worker can take them.
+
+    There is one queue per priority lane. `backend_socks` has one socket per
+    worker in each lane, in the order of ``Priority.lanes``. With a `cache`,
+    the cached results of a job are sent to the sink on `cache_sock`, and
+    `get_cache_key(item, protocol)` gives the key of each item.
+    """
+
+    def __init__(self, backend_socks, n_workers, max_batch_size, cache=None,
+                 cache_sock=None, get_cache_key=None):
+        self.backend_socks = backend_socks
+        self.n_workers = n_workers
+        self.max_batch_size = max_batch_size
+        self.cache = cache
+        self.cache_sock = cache_sock
+        self.get_cache_key = get_cache_key
+        self.pending_jobs: Dict[bytes, Deque[Tuple]] = {
+            priority: deque() for priority in Priority.lanes}
+        self.worker_loads = [WorkerLoad() for _ in range(n_workers)]
+        # The cache keys of the results that we are waiting for, by part
+        self.cache_keys: Dict[bytes, List[str]] = {}
+
+    def push(self, job_id, protocol, frames, n_items, priority):
+        self.pending_jobs[priority].append(
+            (job_id, protocol, frames, n_items))
+
+    def queue(self, job_id, protocol, payload, n_items, priority,
+              start=None, keys=None):
+        # A super large job is split, so that several workers can share
+        # it. Parts are named after the position of their first item.
+        if start is None and n_items <= self.max_batch_size:
+            self.push(job_id, protocol, payload, n_items, priority)
+            return
+
+        start = start or 0
+        if n_items > self.max_batch_size:
+            parts = split_items(payload, self.max_batch_size, protocol)
+        else:
+            parts = [(n_items, payload)]
+        for n, frames in parts:
+            part_id = job_id + b'@%d' % start
+            if keys is not None:
+                self.cache_keys[part_id] = keys[:n]
+                keys = keys[n:]
+            self.push(part_id, protocol, frames, n, priority)
+            start += n
+
+    def queue_with_cache(self, job_id, protocol, payload, priority):
+        """Queue the items of a job whose results are not in the cache.
+
+        Cached results go straight to the sink, as parts of the job. The
+        other items are queued in runs of consecutive items. Returns the
+        number of cached items.
+        """
+        items = load_items(payload, protocol)
+        keys = [self.get_cache_key(item, protocol) for item in items]
+        cached = [self.cache.get(key) if key else None for key in keys]
+        if protocol == MSGPACK:
+            item_frames = [f for _, f in split_items(payload, 1)]
+
+        n_cached = 0
+        for is_cached, run in itertools.groupby(
+                range(len(items)), key=lambda i: cached[i] is not None):
+            run = list(run)
+            a, b = run[0], run[-1] + 1
+            if is_cached:
+                self.cache_sock.send_multipart(
+                    [job_id + b'@%d' % a, ServerCmd.data_cached, protocol,
+                     b'%d' % (b - a)] + merge_items(cached[a:b], protocol),
+                    copy=False)
+                n_cached += b - a
+            else:
+                if protocol == MSGPACK:
+                    frames = merge_items(item_frames[a:b])
+                else:
+                    frames = dump_items(items[a:b], JSON)
+                self.queue(job_id, protocol, frames, b - a, priority, a,
+                           keys[a:b])
+        return n_cached
+
+    def dispatch(self):
+        # Each worker has its own sockets, so we can give the next job to
+        # the worker with the most free capacity. Normal jobs wait here
+        # for credits rather than behind a slow job in a worker queue.
+        # High priority jobs are sent at once, on the socket that the
+        # worker drains first.
+        for lane, priority in enumerate(Priority.lanes):
+            queue = self.pending_jobs[priority]
+            while queue:
+                idx = max(range(self.n_workers),
+                          key=lambda i: self.worker_loads[i].credits)
+                if priority != Priority.high and \
+                        self.worker_loads[idx].credits <= 0:
+                    return
+                job_id, protocol, frames, n_items = queue.popleft()
+                self.backend_socks[lane * self.n_workers + idx].send_multipart(
+                    [job_id, protocol] + frames, copy=False)
+                self.worker_loads[idx].add_job(n_items)
+
+
+class WorkerLoad:
+    """Track how much work a worker has and how much more it can take.
+
+    Workers advertise their capacity, in items, when they are ready and
+    return the credits of every job they finish.
+    """
+
+    def __init__(self):
+        self.capacity = 0
+        self.n_jobs = 0
+        self.n_items = 0
+
+    @property
+    def credits(self):
+        return self.capacity - self.n_items
+
+    def add_job(self, n_items):
+        self.n_jobs += 1
+        self.n_items += n_items
+
+    def update(self, capacity, n_jobs_done, n_items_done):
+        self.capacity = capacity
+        self.n_jobs -= n_jobs_done
+        self.n_items -= n_items_done
+
+    @property
+    def value(self):
+        return {
+            'capacity': self.capacity,
+            'num_queued_job': self.n_jobs,
+            'num_queued_item': self.n_items,
+        }
 
 
 class ServerStatistic:
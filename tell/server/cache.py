@@ -0,0 +1,76 @@
+import os
+import pickle
+from collections import OrderedDict
+from typing import Any
+
+
+class LRUCache:
+    """Keep recently used values in memory and, optionally, all on disk.
+
+    The memory tier holds the `max_size` most recently used entries. If
+    `cache_dir` is given, every entry is also pickled to a file named after
+    its key, so entries survive restarts and can be shared between
+    processes. The disk tier is not bounded. Keys must be valid file names,
+    e.g. hex digests.
+    """
+
+    def __init__(self, max_size: int = 1000, cache_dir: str = None) -> None:
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.entries: OrderedDict = OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.n_hits += 1
+            return self.entries[key]
+
+        path = self._get_path(key)
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            self._add(key, value)
+            self.n_hits += 1
+            return value
+
+        self.n_misses += 1
+        return default
+
+    def put(self, key: str, value: Any) -> None:
+        self._add(key, value)
+        path = self._get_path(key)
+        if path:
+            # Write to a temporary file first, so that other processes never
+            # read a partial entry.
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(tmp_path, path)
+
+    def _add(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _get_path(self, key):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def value(self):
+        return {
+            'max_size': self.max_size,
+            'size': len(self.entries),
+            'cache_dir': self.cache_dir,
+            'num_hit': self.n_hits,
+            'num_miss': self.n_misses,
+        }
@@ -0,0 +1,156 @@
+"""Encode the payloads exchanged by the client, ventilator, workers and sink.
+
+A payload is a list of items, e.g. the articles of a request or the
+captions of a response. With the JSON protocol, the payload is a single JSON
+frame. With the msgpack protocol, each item has a msgpack header followed by
+the raw frames of its large binary values (images and numpy arrays), which
+the header refers to:
+
+    [index, header_0, *buffers_0, header_1, *buffers_1, ...]
+
+The index frame lists the number of buffers of each item. The ventilator
+splits jobs and the sink merges results by reading only the index, and zmq
+can send the raw frames without copying them (``copy=False``).
+"""
+from functools import partial
+from typing import Any, List, Tuple
+
+import numpy as np
+import zmq
+from zmq.utils import jsonapi
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = b'json'
+MSGPACK = b'msgpack'
+
+# The protocols available on this machine. Clients and servers use msgpack
+# only if both sides have it.
+PROTOCOLS = [JSON] + ([MSGPACK] if msgpack is not None else [])
+
+# Smaller binary values stay in the header
+MIN_FRAME_SIZE = 1024
+
+_BYTES = 1
+_ARRAY = 2
+
+
+def dump_items(items: List[Any], protocol: bytes = MSGPACK) -> List[Any]:
+    """Encode a list of items into frames."""
+    if protocol == JSON:
+        return [jsonapi.dumps(items)]
+
+    index = []
+    frames: List[Any] = []
+    for item in items:
+        buffers: List[Any] = []
+        header = msgpack.packb(_extract_buffers(item, buffers),
+                               use_bin_type=True)
+        index.append(len(buffers))
+        frames.append(header)
+        frames.extend(buffers)
+
+    return [msgpack.packb(index)] + frames
+
+
+def load_items(frames: List[Any], protocol: bytes = MSGPACK) -> List[Any]:
+    """Decode the frames of ``dump_items``.
+
+    Numpy arrays are read-only views of the received frames.
+    """
+    if protocol == JSON:
+        return jsonapi.loads(_get_bytes(frames[0]))
+
+    frames = [_get_buffer(f) for f in frames]
+    items = []
+    pos = 1
+    for n_buffers in msgpack.unpackb(frames[0]):
+        header = frames[pos]
+        buffers = frames[pos + 1:pos + 1 + n_buffers]
+        items.append(msgpack.unpackb(header, raw=False,
+                                     ext_hook=partial(_ext_hook, buffers)))
+        pos += 1 + n_buffers
+
+    return items
+
+
+def split_items(frames: List[Any], size: int,
+                protocol: bytes = MSGPACK) -> List[Tuple[int, List[Any]]]:
+    """Split the encoded items into chunks of at most `size` items.
+
+    Returns the number of items and the frames of each chunk. With msgpack,
+    only the index is decoded, and the other frames are passed on as is.
+    """
+    if protocol == JSON:
+        items = load_items(frames, JSON)
+        return [(len(items[i:i + size]), dump_items(items[i:i + size], JSON))
+                for i in range(0, len(items), size)]
+
+    index = msgpack.unpackb(_get_buffer(frames[0]))
+    chunks = []
+    pos = 1
+    for start in range(0, len(index), size):
+        counts = index[start:start + size]
+        n_frames = len(counts) + sum(counts)
+        chunk = [msgpack.packb(counts)] + frames[pos:pos + n_frames]
+        chunks.append((len(counts), chunk))
+        pos += n_frames
+
+    return chunks
+
+
+def merge_items(parts: List[List[Any]], protocol: bytes = MSGPACK) -> List[Any]:
+    """Concatenate encoded lists of items, the reverse of ``split_items``."""
+    if protocol == JSON:
+        items = [item for frames in parts for item in load_items(frames, JSON)]
+        return dump_items(items, JSON)
+
+    index = []
+    frames: List[Any] = []
+    for part in parts:
+        index += msgpack.unpackb(_get_buffer(part[0]))
+        frames += part[1:]
+
+    return [msgpack.packb(index)] + frames
+
+
+def frames_to_bytes(frames: List[Any]) -> List[bytes]:
+    """Copy received frames, e.g. to keep them after the message is gone."""
+    return [_get_bytes(f) for f in frames]
+
+
+def _extract_buffers(obj, buffers):
+    if isinstance(obj, dict):
+        return {k: _extract_buffers(v, buffers) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_extract_buffers(v, buffers) for v in obj]
+    elif isinstance(obj, np.ndarray):
+        obj = np.ascontiguousarray(obj)
+        buffers.append(obj)
+        ref = [len(buffers) - 1, obj.dtype.str, list(obj.shape)]
+        return msgpack.ExtType(_ARRAY, msgpack.packb(ref))
+    elif isinstance(obj, (bytes, bytearray, memoryview)) and \
+            len(obj) >= MIN_FRAME_SIZE:
+        buffers.append(obj)
+        return msgpack.ExtType(_BYTES, msgpack.packb(len(buffers) - 1))
+    return obj
+
+
+def _ext_hook(buffers, code, data):
+    if code == _BYTES:
+        return bytes(buffers[msgpack.unpackb(data)])
+    elif code == _ARRAY:
+        idx, dtype, shape = msgpack.unpackb(data)
+        return np.frombuffer(buffers[idx], dtype=dtype).reshape(shape)
+    return msgpack.ExtType(code, data)
+
+
+def _get_buffer(frame):
+    return frame.buffer if isinstance(frame, zmq.Frame) else frame
+
+
+def _get_bytes(frame):
+    return frame.bytes if isinstance(frame, zmq.Frame) else bytes(frame)
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tell.server.base import JobQueue
+from tell.server.cache import LRUCache
+from tell.server.protocol import (JSON, MSGPACK, dump_items, load_items,
+                                  split_items)
+from tell.server.utils import Priority, ServerCmd
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, frames, copy=True):
+        self.sent.append(frames)
+
+
+def get_cache_key(item, protocol):
+    return item.get('key')
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.n_hits, cache.n_misses), (3, 1))
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache_dir = os.path.join(root, 'results')
+            cache = LRUCache(max_size=1, cache_dir=cache_dir)
+            cache.put('a', [b'frame a'])
+            cache.put('b', [b'frame b'])
+            self.assertEqual(sorted(os.listdir(cache_dir)),
+                             ['a.pkl', 'b.pkl'])
+
+            # An entry that left the memory tier is read back from disk
+            self.assertNotIn('a', cache.entries)
+            self.assertEqual(cache.get('a'), [b'frame a'])
+            self.assertEqual(list(cache.entries), ['a'])
+
+            # So are entries written by another process or before a restart
+            cache = LRUCache(max_size=1, cache_dir=cache_dir)
+            self.assertEqual(cache.get('b'), [b'frame b'])
+            self.assertEqual(cache.get('c', 'missing'), 'missing')
+            self.assertEqual((cache.n_hits, cache.n_misses), (1, 1))
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = LRUCache(cache_dir=cache_dir)
+            path = os.path.join(cache_dir, 'a.pkl')
+            with mock.patch('tell.server.cache.os.replace',
+                            wraps=os.replace) as replace:
+                cache.put('a', 1)
+            tmp_path = replace.call_args[0][0]
+            replace.assert_called_once_with(tmp_path, path)
+            self.assertTrue(tmp_path.startswith(cache_dir))
+            self.assertEqual(os.listdir(cache_dir), ['a.pkl'])
+
+            # If we fail before the entry is complete, readers don't see it
+            with mock.patch('tell.server.cache.os.replace',
+                            side_effect=OSError):
+                with self.assertRaises(OSError):
+                    cache.put('b', 2)
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, 'b.pkl')))
+            self.assertIsNone(LRUCache(cache_dir=cache_dir).get('b'))
+            self.assertEqual(LRUCache(cache_dir=cache_dir).get('a'), 1)
+
+
+class TestQueueWithCache(unittest.TestCase):
+    def test_cache_hit_in_split_job(self):
+        for protocol in [JSON, MSGPACK]:
+            items = [{'key': f'k{i}', 'text': f'text {i}'} for i in range(7)]
+            items[6]['key'] = None
+            cache = LRUCache()
+            # Item 2 was in an earlier request
+            cache.put('k2', dump_items([{'caption': 'cached 2'}], protocol))
+            cache_sock = FakeSocket()
+            jobs = JobQueue([FakeSocket() for _ in Priority.lanes], 1, 2,
+                            cache, cache_sock, get_cache_key)
+            if protocol == MSGPACK:
+                payload = dump_items(items)
+            else:
+                payload = [dump_items(items, JSON)[0]]
+
+            n_cached = jobs.queue_with_cache(b'a#1', protocol, payload,
+                                             Priority.normal)
+            self.assertEqual(n_cached, 1)
+
+            # The cached result goes to the sink as the part at position 2
+            [message] = cache_sock.sent
+            self.assertEqual(message[:4], [b'a#1@2', ServerCmd.data_cached,
+                                           protocol, b'1'])
+            self.assertEqual(load_items(message[4:], protocol),
+                             [{'caption': 'cached 2'}])
+
+            # The other items are split into parts of at most 2 items
+            queued = jobs.pending_jobs[Priority.normal]
+            self.assertEqual([(job_id, n) for job_id, _, _, n in queued],
+                             [(b'a#1@0', 2), (b'a#1@3', 2), (b'a#1@5', 2)])
+            for job_id, job_protocol, frames, _ in queued:
+                self.assertEqual(job_protocol, protocol)
+                start = int(job_id.split(b'@')[1])
+                self.assertEqual(load_items(frames, protocol),
+                                 items[start:start + 2])
+            self.assertEqual(jobs.cache_keys, {
+                b'a#1@0': ['k0', 'k1'],
+                b'a#1@3': ['k3', 'k4'],
+                b'a#1@5': ['k5', None],
+            })
+
+    def test_full_cache_hit(self):
+        items = [{'key': 'k0'}, {'key': 'k1'}]
+        cache = LRUCache()
+        for i, (_, frames) in enumerate(split_items(dump_items(items), 1)):
+            cache.put(f'k{i}', frames)
+        cache_sock = FakeSocket()
+        jobs = JobQueue([FakeSocket() for _ in Priority.lanes], 1, 32,
+                        cache, cache_sock, get_cache_key)
+        n_cached = jobs.queue_with_cache(b'a#1', MSGPACK, dump_items(items),
+                                         Priority.high)
+        self.assertEqual(n_cached, 2)
+        [message] = cache_sock.sent
+        self.assertEqual(message[:4], [b'a#1@0', ServerCmd.data_cached,
+                                       MSGPACK, b'2'])
+        self.assertEqual(load_items(message[4:]), items)
+        self.assertFalse(any(jobs.pending_jobs.values()))
+        self.assertEqual(jobs.cache_keys, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
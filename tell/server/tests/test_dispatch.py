@@ -0,0 +1,109 @@
+import unittest
+
+from tell.server.base import JobQueue
+from tell.server.protocol import JSON
+from tell.server.utils import Priority
+
+
+class FakeSocket:
+    """Keep the messages that the ventilator sends to a worker."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, frames, copy=True):
+        self.sent.append(frames)
+
+
+def make_queue(n_workers, capacities, max_batch_size=32):
+    socks = [FakeSocket() for _ in range(n_workers * len(Priority.lanes))]
+    jobs = JobQueue(socks, n_workers, max_batch_size)
+    # Workers advertise their capacity when they are ready
+    for load, capacity in zip(jobs.worker_loads, capacities):
+        load.update(capacity, 0, 0)
+    return jobs, socks
+
+
+def get_sent(socks, n_workers, priority, worker_id):
+    lane = Priority.lanes.index(priority)
+    return [frames[0] for frames in socks[lane * n_workers + worker_id].sent]
+
+
+class TestDispatch(unittest.TestCase):
+    def test_worker_with_most_credits_gets_next_job(self):
+        jobs, socks = make_queue(3, [2, 5, 3])
+        jobs.queue(b'a#1', JSON, [b'[]'], 3, Priority.normal)
+        jobs.queue(b'a#2', JSON, [b'[]'], 2, Priority.normal)
+        jobs.queue(b'a#3', JSON, [b'[]'], 1, Priority.normal)
+        jobs.dispatch()
+
+        # Credits go from [2, 5, 3] to [2, 2, 3], [2, 2, 1] and [1, 2, 1]
+        self.assertEqual(get_sent(socks, 3, Priority.normal, 1), [b'a#1'])
+        self.assertEqual(get_sent(socks, 3, Priority.normal, 2), [b'a#2'])
+        self.assertEqual(get_sent(socks, 3, Priority.normal, 0), [b'a#3'])
+        self.assertEqual([w.credits for w in jobs.worker_loads], [1, 2, 1])
+        self.assertEqual([w.n_jobs for w in jobs.worker_loads], [1, 1, 1])
+
+    def test_normal_jobs_wait_for_credits(self):
+        jobs, socks = make_queue(2, [1, 1])
+        for i in range(3):
+            jobs.queue(b'a#%d' % i, JSON, [b'[]'], 1, Priority.normal)
+        jobs.dispatch()
+        self.assertEqual(len(jobs.pending_jobs[Priority.normal]), 1)
+        self.assertEqual([w.credits for w in jobs.worker_loads], [0, 0])
+
+        # Nothing changes until a worker returns its credits
+        jobs.dispatch()
+        self.assertEqual(len(jobs.pending_jobs[Priority.normal]), 1)
+
+        jobs.worker_loads[1].update(1, 1, 1)
+        jobs.dispatch()
+        self.assertFalse(jobs.pending_jobs[Priority.normal])
+        self.assertEqual(get_sent(socks, 2, Priority.normal, 1),
+                         [b'a#1', b'a#2'])
+        self.assertEqual(jobs.worker_loads[1].value, {
+            'capacity': 1, 'num_queued_job': 1, 'num_queued_item': 1})
+
+    def test_high_priority_jobs_are_sent_without_credits(self):
+        jobs, socks = make_queue(2, [1, 0])
+        jobs.queue(b'a#1', JSON, [b'[]'], 4, Priority.high)
+        jobs.queue(b'a#2', JSON, [b'[]'], 2, Priority.high)
+        jobs.dispatch()
+
+        # They go to the high priority socket of the least busy worker and
+        # may put it into debt
+        self.assertFalse(jobs.pending_jobs[Priority.high])
+        self.assertEqual(get_sent(socks, 2, Priority.high, 0), [b'a#1'])
+        self.assertEqual(get_sent(socks, 2, Priority.high, 1), [b'a#2'])
+        self.assertEqual(get_sent(socks, 2, Priority.normal, 0), [])
+        self.assertEqual([w.credits for w in jobs.worker_loads], [-3, -2])
+
+    def test_high_priority_jobs_overtake_waiting_jobs(self):
+        jobs, socks = make_queue(1, [0])
+        jobs.queue(b'a#1', JSON, [b'[]'], 1, Priority.normal)
+        jobs.queue(b'b#1', JSON, [b'[]'], 1, Priority.high)
+        jobs.dispatch()
+        self.assertEqual(get_sent(socks, 1, Priority.high, 0), [b'b#1'])
+        self.assertEqual(get_sent(socks, 1, Priority.normal, 0), [])
+        self.assertEqual(len(jobs.pending_jobs[Priority.normal]), 1)
+
+        # The normal job goes once the worker is done with the high one
+        jobs.worker_loads[0].update(1, 1, 1)
+        jobs.dispatch()
+        self.assertEqual(get_sent(socks, 1, Priority.normal, 0), [b'a#1'])
+
+    def test_large_jobs_are_split_between_workers(self):
+        jobs, socks = make_queue(2, [4, 4], max_batch_size=2)
+        payload = [b'[1, 2, 3, 4, 5]']
+        jobs.queue(b'a#1', JSON, payload, 5, Priority.normal)
+        jobs.dispatch()
+
+        # Parts are named after the position of their first item
+        self.assertEqual(get_sent(socks, 2, Priority.normal, 0),
+                         [b'a#1@0', b'a#1@4'])
+        self.assertEqual(get_sent(socks, 2, Priority.normal, 1), [b'a#1@2'])
+        self.assertEqual([w.n_items for w in jobs.worker_loads], [3, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+import zmq
+
+from tell.server.protocol import (JSON, MIN_FRAME_SIZE, MSGPACK, dump_items,
+                                  load_items, merge_items, split_items)
+
+
+def make_items(n):
+    rs = np.random.RandomState(0)
+    items = []
+    for i in range(n):
+        items.append({
+            'id': i,
+            'title': f'Article {i}',
+            'image': rs.bytes(MIN_FRAME_SIZE + i),
+            'thumbnail': rs.bytes(MIN_FRAME_SIZE - 1),
+            'empty': b'',
+            'faces': rs.randn(i, 512).astype(np.float32),
+            'boxes': [rs.randint(0, 100, size=(2, 4)), {'score': 0.5}],
+        })
+    return items
+
+
+def assert_items_equal(test, items, expected):
+    test.assertEqual(len(items), len(expected))
+    for item, expected_item in zip(items, expected):
+        test.assertEqual(item.keys(), expected_item.keys())
+        test.assertEqual(item['id'], expected_item['id'])
+        test.assertEqual(item['title'], expected_item['title'])
+        for key in ['image', 'thumbnail', 'empty']:
+            test.assertIsInstance(item[key], bytes)
+            test.assertEqual(item[key], expected_item[key])
+        np.testing.assert_array_equal(item['faces'], expected_item['faces'])
+        test.assertEqual(item['faces'].dtype, np.float32)
+        np.testing.assert_array_equal(item['boxes'][0],
+                                      expected_item['boxes'][0])
+        test.assertEqual(item['boxes'][1], expected_item['boxes'][1])
+
+
+class TestProtocol(unittest.TestCase):
+    def test_msgpack_round_trip(self):
+        items = make_items(5)
+        frames = dump_items(items, MSGPACK)
+        # The index, one header per item, and the large images and arrays
+        self.assertEqual(len(frames), 1 + 5 + 5 + 5 + 5)
+        assert_items_equal(self, load_items(frames, MSGPACK), items)
+
+        # Received frames are zmq.Frame objects
+        frames = [zmq.Frame(f) for f in frames]
+        assert_items_equal(self, load_items(frames, MSGPACK), items)
+
+    def test_msgpack_split_and_merge(self):
+        items = make_items(7)
+        frames = dump_items(items, MSGPACK)
+        for size in [1, 2, 3, 7, 10]:
+            chunks = split_items(frames, size, MSGPACK)
+            self.assertEqual([n for n, _ in chunks],
+                             [len(items[i:i + size])
+                              for i in range(0, len(items), size)])
+
+            start = 0
+            for n, chunk in chunks:
+                assert_items_equal(self, load_items(chunk, MSGPACK),
+                                   items[start:start + n])
+                start += n
+
+            merged = merge_items([chunk for _, chunk in chunks], MSGPACK)
+            assert_items_equal(self, load_items(merged, MSGPACK), items)
+
+    def test_json_round_trip(self):
+        items = [{'id': i, 'title': f'Article {i}', 'scores': [0.5] * i}
+                 for i in range(7)]
+        frames = dump_items(items, JSON)
+        self.assertEqual(load_items(frames, JSON), items)
+        self.assertEqual(load_items([zmq.Frame(frames[0])], JSON), items)
+
+        for size in [1, 2, 3, 7, 10]:
+            chunks = split_items(frames, size, JSON)
+            self.assertEqual([n for n, _ in chunks],
+                             [len(items[i:i + size])
+                              for i in range(0, len(items), size)])
+            merged = merge_items([chunk for _, chunk in chunks], JSON)
+            self.assertEqual(load_items(merged, JSON), items)
+
+    def test_empty_payload(self):
+        for protocol in [JSON, MSGPACK]:
+            frames = dump_items([], protocol)
+            self.assertEqual(load_items(frames, protocol), [])
+            self.assertEqual(split_items(frames, 3, protocol), [])
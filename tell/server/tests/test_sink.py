@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+import zmq
+
+from tell.server.base import SinkJob
+from tell.server.protocol import JSON, MSGPACK, dump_items, load_items
+
+
+def make_part(items, protocol):
+    # The frames of a part, as the sink receives them from a worker
+    return [zmq.Frame(f) for f in dump_items(items, protocol)]
+
+
+class TestSinkJob(unittest.TestCase):
+    def test_stream_parts_as_they_arrive(self):
+        job = SinkJob()
+        # A part may arrive before the ventilator registers the job
+        job.add_output(make_part(['a', 'b'], JSON), 2, 0, JSON)
+        self.assertFalse(job.is_registered)
+        self.assertFalse(job.is_done)
+
+        job.checksum = 5
+        job.stream = True
+        parts = job.pop_outputs()
+        self.assertEqual([(pid, load_items(frames, JSON))
+                          for pid, frames in parts], [(0, ['a', 'b'])])
+        self.assertFalse(job.is_done)
+        # Parts are sent only once
+        self.assertEqual(job.pop_outputs(), [])
+
+        job.add_output(make_part(['e'], JSON), 1, 4, JSON)
+        job.add_output(make_part(['c', 'd'], JSON), 2, 2, JSON)
+        parts = job.pop_outputs()
+        self.assertEqual([(pid, load_items(frames, JSON))
+                          for pid, frames in parts],
+                         [(4, ['e']), (2, ['c', 'd'])])
+        self.assertTrue(job.is_done)
+        self.assertEqual(job.outputs, {})
+
+    def test_merge_out_of_order_parts(self):
+        rs = np.random.RandomState(0)
+        for protocol in [JSON, MSGPACK]:
+            items = [{'id': i} for i in range(5)]
+            if protocol == MSGPACK:
+                # The arrays are sent in frames of their own
+                for item in items:
+                    item['attns'] = rs.randn(item['id'], 3).astype(np.float32)
+            job = SinkJob()
+            job.checksum = 5
+            for pid, n in [(4, 1), (0, 2), (2, 2)]:
+                self.assertFalse(job.is_done)
+                job.add_output(make_part(items[pid:pid + n], protocol), n,
+                               pid, protocol)
+            self.assertTrue(job.is_done)
+            self.assertEqual(job.progress_outputs, 5)
+
+            result = load_items(job.result, protocol)
+            self.assertEqual([x['id'] for x in result], list(range(5)))
+            if protocol == MSGPACK:
+                for x, expected in zip(result, items):
+                    np.testing.assert_array_equal(x['attns'],
+                                                  expected['attns'])
+
+            job.clear()
+            self.assertEqual(job.outputs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
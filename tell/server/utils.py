@@ -11,12 +11,21 @@ class ServerCmd:
     new_job = b'REGISTER'
     data_token = b'TOKENS'
     data_embed = b'EMBEDDINGS'
+    data_partial = b'PARTIAL'
+    data_cached = b'CACHED'
 
     @staticmethod
     def is_valid(cmd):
         return any(not k.startswith('__') and v == cmd for k, v in vars(ServerCmd).items())
 
 
+class Priority:
+    high = b'HIGH'
+    normal = b'NORMAL'
+    # The ventilator and the workers serve the lanes in this order
+    lanes = [high, normal]
+
+
 def set_logger(context, verbose=False):
     if os.name == 'nt':  # for Windows
         return NTLogger(context, verbose)
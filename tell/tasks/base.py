@@ -4,24 +4,30 @@ from multiprocessing import Process
 import zmq
 import zmq.decorators as zmqd
 from termcolor import colored
-from zmq.utils import jsonapi
 
-from tell.server.utils import ServerCmd, set_logger
+from tell.server.protocol import JSON, dump_items, load_items
+from tell.server.utils import Priority, ServerCmd, set_logger
 from tell.server.zmq_decor import multi_socket
 
 
 class Worker(Process):
     def __init__(self, worker_id, worker_address_list, sink_address,
-                 verbose=False, **kwargs):
+                 verbose=False, credit_address=None, **kwargs):
         super().__init__()
         self.worker_id = worker_id
         self.logger = set_logger(colored(f'WORKER-{self.worker_id}', 'yellow'),
                                  verbose)
         self.daemon = True
         self.exit_flag = multiprocessing.Event()
+        # One address per priority lane, in the order of Priority.lanes
         self.worker_address = worker_address_list
         self.n_concurrent_sockets = len(self.worker_address)
         self.sink_address = sink_address
+        self.credit_address = credit_address
+        self.credit_socket = None
+        # The number of items that we can work on at once. By default, we
+        # take the next job only after finishing the current one.
+        self.capacity = 1
         self.verbose = verbose
         self.is_ready = multiprocessing.Event()
 
@@ -36,10 +42,11 @@ class Worker(Process):
     def run(self):
         self._run()
 
+    @zmqd.socket(zmq.PUSH)
     @zmqd.socket(zmq.PUSH)
     @zmqd.socket(zmq.PUSH)
     @multi_socket(zmq.PULL, num_socket='n_concurrent_sockets')
-    def _run(self, sink_embed, sink_token, *receivers):
+    def _run(self, sink_embed, sink_token, credit, *receivers):
         for sock, addr in zip(receivers, self.worker_address):
             sock.connect(addr)
 
@@ -48,38 +55,102 @@ class Worker(Process):
 
         self.initialize()
 
-        for job in self.job_buffer(receivers, sink_token):
-            result = self._process(job)
-            message = [result['client_id'],
-                       jsonapi.dumps(result['output']), ServerCmd.data_embed]
+        # Tell the ventilator how much work we can take
+        if self.credit_address:
+            credit.connect(self.credit_address)
+            self.credit_socket = credit
+            self._send_credits(0, 0)
+
+        self._serve(receivers, sink_embed, sink_token)
+
+    @classmethod
+    def get_cache_namespace(cls, quantize=False):
+        """Identify the model whose results can be cached.
 
-            sink_embed.send_multipart(message)
-            self.logger.info(f"job done\tclient: {result['client_id']}")
+        The server only caches results if this is not None. Results cached
+        under another namespace, e.g. of an older checkpoint, are ignored.
+        """
+        return None
+
+    @staticmethod
+    def get_cache_key(item):
+        """Hash everything in a request item that the output depends on."""
+        return None
 
     def initialize(self):
         pass
 
+    def _serve(self, receivers, sink_embed, sink_token):
+        for job in self.job_buffer(receivers, sink_token):
+            result = self._process(job)
+            self._send_result(sink_embed, result)
+
     def _process(self, msg):
         raise NotImplementedError
 
+    def _send_result(self, sink, result):
+        # Reply in the protocol of the request
+        protocol = result.get('protocol', JSON)
+        message = [result['client_id'], ServerCmd.data_embed, protocol,
+                   b'%d' % len(result['output'])]
+        message += dump_items(result['output'], protocol)
+
+        sink.send_multipart(message, copy=False)
+        self._send_credits(1, len(result['output']))
+        self.logger.info(f"job done\tclient: {result['client_id']}")
+
+    def _send_credits(self, n_jobs_done, n_items_done):
+        if self.credit_socket is None:
+            return
+        self.credit_socket.send_multipart([b'%d' % self.worker_id,
+                                           b'%d' % self.capacity,
+                                           b'%d' % n_jobs_done,
+                                           b'%d' % n_items_done])
+
     def job_buffer(self, socks, sink):
-        poller = zmq.Poller()
-        for sock in socks:
-            poller.register(sock, zmq.POLLIN)
+        poller = self.get_poller(socks)
 
         self.is_ready.set()
         while not self.exit_flag.is_set():
-            events = dict(poller.poll())
-            for sock_idx, sock in enumerate(socks):
-                if sock in events:
-                    client_id, raw_msg = sock.recv_multipart()
-                    msg = jsonapi.loads(raw_msg)  # probably a list
-                    self.logger.info(f'new job\t'
-                                     f'socket: {sock_idx}\t'
-                                     f'size: {len(msg)}\t'
-                                     f'client: {client_id}')
-
-                    yield {
-                        'client_id': client_id,
-                        'message': msg,
-                    }
+            yield from self.poll_jobs(poller, socks)
+
+    def get_poller(self, socks):
+        poller = zmq.Poller()
+        for sock in socks:
+            poller.register(sock, zmq.POLLIN)
+        return poller
+
+    def poll_jobs(self, poller, socks, timeout=None):
+        """Receive the jobs that arrive within `timeout` milliseconds.
+
+        We wait until there is at least one job if `timeout` is None. The
+        sockets are drained in the order of the priority lanes, so high
+        priority jobs come first.
+        """
+        events = dict(poller.poll(timeout))
+        jobs = []
+        for sock_idx, sock in enumerate(socks):
+            if sock not in events:
+                continue
+            priority = Priority.lanes[sock_idx] \
+                if sock_idx < len(Priority.lanes) else Priority.normal
+            while True:
+                try:
+                    client_id, protocol, *frames = sock.recv_multipart(
+                        zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                client_id, protocol = client_id.bytes, protocol.bytes
+                msg = load_items(frames, protocol)  # probably a list
+                self.logger.info(f'new job\t'
+                                 f'socket: {sock_idx}\t'
+                                 f'size: {len(msg)}\t'
+                                 f'client: {client_id}')
+
+                jobs.append({
+                    'client_id': client_id,
+                    'message': msg,
+                    'protocol': protocol,
+                    'priority': priority,
+                })
+        return jobs
@@ -1,11 +1,15 @@
 import base64
+import hashlib
 import io
+import itertools
+import json
 import logging
 import os
 import random
 import re
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from io import BytesIO
+from typing import Any, Deque, Dict
 
 import cv2
 import numpy as np
@@ -14,12 +18,10 @@ import torch
 from allennlp.common.util import prepare_environment
 from allennlp.data.fields import ArrayField, MetadataField, TextField
 from allennlp.data.instance import Instance
-from allennlp.data.iterators import BasicIterator
 from allennlp.data.token_indexers import TokenIndexer
 from allennlp.data.tokenizers import Tokenizer
 from allennlp.data.vocabulary import Vocabulary
 from allennlp.models import Model
-from allennlp.nn.util import move_to_device
 from overrides import overrides
 from PIL import Image
 from torchvision.transforms import (CenterCrop, Compose, Normalize, Resize,
@@ -29,17 +31,26 @@ from tell.commands.train import yaml_to_params
 from tell.data.fields import ImageField
 from tell.facenet import MTCNN, InceptionResnetV1
 from tell.models.resnet import resnet152
+from tell.modules import load_model_state
+from tell.server.cache import LRUCache
+from tell.server.protocol import MSGPACK
+from tell.server.utils import Priority
+from tell.utils.roberta import get_roberta_bpe
 from tell.yolov3.models import Darknet, attempt_download
 from tell.yolov3.utils.datasets import letterbox
 from tell.yolov3.utils.utils import (load_classes, non_max_suppression,
                                      plot_one_box, scale_coords)
 
 from .base import Worker
+from .scheduler import DecodeScheduler
 
 logger = logging.getLogger(__name__)
 SPACE_NORMALIZER = re.compile(r"\s+")
 ENV = os.environ.copy()
 
+CONFIG_PATH = 'expt/nytimes/9_transformer_objects/config.yaml'
+MODEL_PATH = 'expt/nytimes/9_transformer_objects/serialization/best.th'
+
 
 def tokenize_line(line):
     line = SPACE_NORMALIZER.sub(" ", line)
@@ -48,13 +59,20 @@ def tokenize_line(line):
 
 
 class CaptioningWorker(Worker):
-    def __init__(self, worker_id, worker_address_list, sink_address, verbose=False):
-        super().__init__(worker_id, worker_address_list, sink_address, verbose)
+    def __init__(self, worker_id, worker_address_list, sink_address, verbose=False,
+                 credit_address=None, quantize=False, cache_size=0,
+                 cache_dir=None):
+        super().__init__(worker_id, worker_address_list, sink_address, verbose,
+                         credit_address)
+        self.quantize = quantize
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.feature_cache = None
         self.model = None
         self.bpe = None
         self.indices = None
         self.preprocess = None
-        self.data_iterator = None
+        self.scheduler = None
         self.tokenizer = None
         self.token_indexers = None
         self.mtcnn = None
@@ -64,7 +82,7 @@ class CaptioningWorker(Worker):
         self.names = None
         self.colors = None
         self.nlp = None
-        if torch.cuda.is_available():
+        if torch.cuda.is_available() and not quantize:
             n_devices = torch.cuda.device_count()
             d = worker_id % n_devices
             if 'CUDA_VISIBLE_DEVICES' in os.environ:
@@ -79,7 +97,7 @@ class CaptioningWorker(Worker):
     def initialize(self):
         # We need to initialize the model inside self.run and not self.__init__
         # to ensure that the model loads in the correct thread.
-        config_path = 'expt/nytimes/9_transformer_objects/config.yaml'
+        config_path = CONFIG_PATH
         logger.info(f'Loading config from {config_path}')
         config = yaml_to_params(config_path, overrides='')
         prepare_environment(config)
@@ -87,18 +105,16 @@ class CaptioningWorker(Worker):
         model = Model.from_params(vocab=vocab, params=config.pop('model'))
         model = model.eval()
 
-        model_path = 'expt/nytimes/9_transformer_objects/serialization/best.th'
+        model_path = get_model_path(self.quantize)
         logger.info(f'Loading best model from {model_path}')
         best_model_state = torch.load(
             model_path, map_location=torch.device('cpu'))
-        model.load_state_dict(best_model_state)
+        load_model_state(model, best_model_state, self.quantize)
 
         self.model = model.to(self.device)
 
-        logger.info('Loading roberta model.')
-        roberta = torch.hub.load('pytorch/fairseq:2f7e3f3323', 'roberta.base')
-        self.bpe = roberta.bpe
-        self.indices = roberta.task.source_dictionary.indices
+        self.bpe, dictionary = get_roberta_bpe()
+        self.indices = dictionary.indices
 
         logger.info('Loading face detection model.')
         self.mtcnn = MTCNN(keep_all=True, device=self.device)
@@ -128,9 +144,19 @@ class CaptioningWorker(Worker):
             Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
         ])
 
-        data_iterator = BasicIterator(batch_size=4)
-        data_iterator.index_with(model.vocab)
-        self.data_iterator = data_iterator
+        # Captions of all jobs are generated together, so short captions
+        # don't wait behind long ones.
+        self.scheduler = DecodeScheduler(self.model, self.device,
+                                         max_batch_size=16)
+        # Take new articles as long as the decode batch has room
+        self.capacity = self.scheduler.max_batch_size
+
+        # The faces and objects of a photo don't depend on the article, so
+        # articles that share a photo can reuse them.
+        if self.cache_size > 0 or self.cache_dir:
+            feature_dir = self.cache_dir and os.path.join(
+                self.cache_dir, 'features')
+            self.feature_cache = LRUCache(self.cache_size, feature_dir)
 
         self.tokenizer = Tokenizer.from_params(
             config.get('dataset_reader').get('tokenizer'))
@@ -143,33 +169,60 @@ class CaptioningWorker(Worker):
         # logger.info('Loading spacy')
         # self.nlp = spacy.load("en_core_web_lg")
 
-    def generate_captions(self, articles):
+    @classmethod
+    def get_cache_namespace(cls, quantize=False):
+        model_path = get_model_path(quantize)
+        if not os.path.exists(model_path) or not os.path.exists(CONFIG_PATH):
+            return None
+        # A new checkpoint at the same path gets a new namespace. So does a
+        # change to the config, e.g. to the beam size or sampling.
+        stat = os.stat(model_path)
+        with open(CONFIG_PATH, 'rb') as f:
+            config_hash = hashlib.sha1(f.read()).hexdigest()
+        return f'{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime}:{config_hash}:{quantize}'
+
+    @staticmethod
+    def get_cache_key(article):
+        # The caption depends on the title, the paragraphs around the image
+        # and the image itself.
+        pos = article['image_position']
+        sections = [(s['type'], s.get('text')) for s in article['sections']]
+        text = json.dumps([article['title'], pos, sections])
+
+        h = hashlib.sha1(text.encode('utf-8'))
+        h.update(get_image_bytes(article['sections'][pos]['image_data']))
+        return h.hexdigest()
+
+    def generate_captions(self, articles, binary=False):
         instances = [self.prepare_instance(a) for a in articles]
-        iterator = self.data_iterator(instances, num_epochs=1, shuffle=False)
-        generated_captions = []
-        for batch in iterator:
-            if self.device.type == 'cuda':
-                batch = move_to_device(batch, self.device.index)
-            attns_list = self.model.generate(**batch)
-            # generated_captions += output_dict['generations']
-            # attns = output_dict['attns']
-            # len(attns) == gen_len (ignoring seed)
-            # len(attns[0]) == n_layers
-            # attns[0][0]['image'].shape == [47]
-            # attns[0][0]['article'].shape == [article_len]
+        for i, instance in enumerate(instances):
+            self.scheduler.add(i, instance)
+
+        attns_list = [None] * len(instances)
+        while self.scheduler.has_work():
+            for i, attns in self.scheduler.step():
+                attns_list[i] = attns
+
+        return self.format_output(instances, attns_list, binary)
 
+    def format_output(self, instances, attns_list, binary=False):
         output = []
-        for i, instance in enumerate(instances):
+        for instance, attns in zip(instances, attns_list):
             buffered = BytesIO()
             instance['metadata']['image'].save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            if binary:
+                # The binary protocol sends the JPEG in its own frame
+                img_str = buffered.getvalue()
+            else:
+                img_str = base64.b64encode(buffered.getvalue()).decode()
             output.append({
                 'title': instance['metadata']['title'],
                 'start': instance['metadata']['start'],
                 'before': instance['metadata']['before'],
                 'after': instance['metadata']['after'],
-                # 'caption': generated_captions[i],
-                'attns': attns_list[i],
+                # len(attns) == n_words in the caption
+                # attns[0]['attns']['article'][0]['attns'] has n_layers scores
+                'attns': attns,
                 'image': img_str,
             })
 
@@ -268,12 +321,10 @@ class CaptioningWorker(Worker):
             if n_words >= 510 or (i <= k and j >= len(sections)):
                 break
 
-        image_data = base64.b64decode(
-            sections[pos]['image_data'].encode('utf-8'))
+        image_data = get_image_bytes(sections[pos]['image_data'])
         image = Image.open(io.BytesIO(image_data))
         image = image.convert('RGB')
-        face_embeds = self.get_faces(image)
-        obj_embeds = self.get_objects(image)
+        face_embeds, obj_embeds = self.get_image_features(image, image_data)
 
         output = {
             'paragraphs': paragraphs + before + after,
@@ -288,6 +339,17 @@ class CaptioningWorker(Worker):
 
         return output
 
+    def get_image_features(self, image, image_data):
+        if self.feature_cache is None:
+            return self.get_faces(image), self.get_objects(image)
+
+        key = hashlib.sha1(image_data).hexdigest()
+        features = self.feature_cache.get(key)
+        if features is None:
+            features = self.get_faces(image), self.get_objects(image)
+            self.feature_cache.put(key, features)
+        return features
+
     def get_faces(self, image):
         with torch.no_grad():
             try:
@@ -371,18 +433,117 @@ class CaptioningWorker(Worker):
             token_ids.append(idx)
         return token_ids
 
+    @overrides
+    def _serve(self, receivers, sink_embed, sink_token):
+        """Keep decoding while new jobs arrive.
+
+        The articles of every job are prepared a few at a time between
+        decode steps (see ``_prepare_articles``) and then go into the decode
+        scheduler. A job is sent to the sink once all of its captions are
+        done.
+        """
+        poller = self.get_poller(receivers)
+        self.is_ready.set()
+
+        jobs: Dict[int, Dict[str, Any]] = {}
+        job_ids = itertools.count()
+        # The articles that have yet to be prepared, in each priority lane
+        unprepared: Dict[bytes, Deque] = {lane: deque()
+                                          for lane in Priority.lanes}
+        while not self.exit_flag.is_set():
+            # Only block on the sockets when there is nothing to do
+            has_work = self.scheduler.has_work() or any(unprepared.values())
+            timeout = 0 if has_work else None
+            with torch.no_grad():
+                for job in self.poll_jobs(poller, receivers, timeout):
+                    articles = job['message']
+                    job_id = next(job_ids)
+                    jobs[job_id] = {
+                        'client_id': job['client_id'],
+                        'protocol': job['protocol'],
+                        'instances': [None] * len(articles),
+                        'attns': [None] * len(articles),
+                        'n_left': len(articles),
+                    }
+                    lane = Priority.high if job['priority'] == Priority.high \
+                        else Priority.normal
+                    for i, article in enumerate(articles):
+                        unprepared[lane].append(((job_id, i), article))
+                    if not articles:
+                        self._finish_job(jobs.pop(job_id), sink_embed)
+
+                self._prepare_articles(unprepared, jobs)
+                finished = self.scheduler.step()
+
+            for (job_id, i), attns in finished:
+                job = jobs[job_id]
+                job['attns'][i] = attns
+                job['n_left'] -= 1
+                if job['n_left'] == 0:
+                    self._finish_job(jobs.pop(job_id), sink_embed)
+
+    def _prepare_articles(self, unprepared, jobs):
+        """Prepare the next articles and add them to the decode scheduler.
+
+        Preparing an article runs the face, object and image models, during
+        which the captions in flight can't make progress. So while there are
+        captions to decode, we prepare at most one article per decode step,
+        and a normal one only if it would get a slot right away. Otherwise we
+        prepare enough articles to fill the batch.
+        """
+        scheduler = self.scheduler
+        n_prepare = 1 if scheduler.n_running() else scheduler.max_batch_size
+        for lane in Priority.lanes:
+            queue = unprepared[lane]
+            high_priority = lane == Priority.high
+            while queue and n_prepare > 0:
+                if not high_priority and scheduler.n_free() <= 0:
+                    return
+                (job_id, i), article = queue.popleft()
+                instance = self.prepare_instance(article)
+                jobs[job_id]['instances'][i] = instance
+                scheduler.add((job_id, i), instance,
+                              high_priority=high_priority)
+                n_prepare -= 1
+
+    def _finish_job(self, job, sink):
+        self._send_result(sink, {
+            'client_id': job['client_id'],
+            'protocol': job['protocol'],
+            'output': self.format_output(job['instances'], job['attns'],
+                                         binary=job['protocol'] == MSGPACK),
+        })
+
     @overrides
     def _process(self, job):
         articles = job['message']
         with torch.no_grad():
-            output = self.generate_captions(articles)
+            output = self.generate_captions(
+                articles, binary=job['protocol'] == MSGPACK)
 
         return {
             'client_id': job['client_id'],
+            'protocol': job['protocol'],
             'output': output,
         }
 
 
+def get_model_path(quantize=False):
+    if quantize:
+        # Saved by tell quantize. Otherwise we quantize the float model.
+        int8_path = MODEL_PATH.replace('best.th', 'best-int8.th')
+        if os.path.exists(int8_path):
+            return int8_path
+    return MODEL_PATH
+
+
+def get_image_bytes(image_data):
+    # Clients using the binary protocol send the raw image
+    if isinstance(image_data, str):
+        return base64.b64decode(image_data.encode('utf-8'))
+    return image_data
+
+
 def get_obj_embeddings(xyxy, pil_image, obj_path, resnet):
     pil_image = pil_image.convert('RGB')
     obj_image = extract_object(pil_image, xyxy, save_path=obj_path)
@@ -0,0 +1,274 @@
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+import torch
+from allennlp.data.dataset import Batch
+from allennlp.data.instance import Instance
+from allennlp.nn.util import move_to_device
+
+logger = logging.getLogger(__name__)
+
+MODALITIES = ['image', 'article', 'faces', 'obj']
+
+
+class DecodeScheduler:
+    """Generate captions with a running batch of active sequences.
+
+    Instead of decoding a fixed batch until its longest caption is done, we
+    keep up to `max_batch_size` captions in flight. Finished captions leave
+    the batch after every step, and waiting articles are admitted as soon as
+    there are free slots. All captions share the incremental state of the
+    decoder, which we compact when captions finish and extend when new ones
+    arrive. The contexts are padded to the longest one in the batch.
+
+    This expects a ``TransformerFacesObjectsModel`` with a convolutional
+    decoder, since the self-attention cache can't hold captions of
+    different lengths.
+
+    Parameters
+    ----------
+    model : ``TransformerFacesObjectsModel``
+        The captioning model, already on `device` and in eval mode.
+    device : ``torch.device``
+        Where the model lives.
+    max_batch_size : ``int``
+        Maximum number of captions that are generated together.
+    max_len : ``int``
+        Maximum number of tokens in a caption, excluding the seed <s>.
+    eos : ``int``
+        The index of </s>.
+    """
+
+    def __init__(self, model, device, max_batch_size=16, max_len=100, eos=2):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_len = max_len
+        self.eos = eos
+        self.pending: Deque[Tuple[Any, Instance]] = deque()
+        self.pending_high: Deque[Tuple[Any, Instance]] = deque()
+        self._reset()
+
+    def _reset(self):
+        # One entry per active caption, in batch order
+        self.keys: List[Any] = []
+        self.incremental_state: Dict[str, Any] = {}
+        self.contexts: Dict[str, torch.Tensor] = None
+        self.article_ids: torch.Tensor = None
+        # token_ids.shape == [batch_size, max_len + 1], starting with <s>
+        self.token_ids: torch.Tensor = None
+        # n_steps.shape == [batch_size]
+        self.n_steps: torch.Tensor = None
+        # The attention over the context positions and over the extra
+        # positions that the attention adds at the end (bias, no attention)
+        # attns[modal].shape == [batch_size, max_len, n_layers, source_len]
+        self.attns: Dict[str, torch.Tensor] = {}
+        self.extra_attns: Dict[str, torch.Tensor] = {}
+
+    def add(self, key, instance: Instance, high_priority: bool = False):
+        """Queue an article. `key` identifies its caption in the output.
+
+        High priority articles are admitted before all other waiting ones.
+        """
+        if high_priority:
+            self.pending_high.append((key, instance))
+        else:
+            self.pending.append((key, instance))
+
+    def has_work(self):
+        return bool(self.pending_high) or bool(self.pending) or bool(self.keys)
+
+    def n_running(self):
+        """Number of captions that are being generated."""
+        return len(self.keys)
+
+    def n_free(self):
+        """Number of slots that no running or waiting caption will take."""
+        return self.max_batch_size - len(self.keys) - len(self.pending_high) \
+            - len(self.pending)
+
+    def step(self) -> List[Tuple[Any, List[Dict[str, Any]]]]:
+        """Admit waiting articles and generate the next token of each caption.
+
+        Returns the key and the word-level attention of each caption that
+        finished in this step (see
+        ``TransformerFacesObjectsModel.get_word_attns``).
+        """
+        self._admit()
+        if not self.keys:
+            return []
+
+        model = self.model
+        rows = torch.arange(len(self.keys), device=self.device)
+        prev_ids = self.token_ids[rows, self.n_steps].unsqueeze(1)
+        # prev_ids.shape == [batch_size, 1]
+
+        model._set_attn_capture(True, all_attns=True)
+        try:
+            decoder_out = model.decoder(
+                {model.index: prev_ids},
+                self.contexts,
+                incremental_state=self.incremental_state)
+        finally:
+            model._set_attn_capture(False)
+
+        for modal in MODALITIES:
+            attn = torch.stack([layer_attns[modal][:, -1]
+                                for layer_attns in decoder_out[1]['attn']], dim=1)
+            # attn.shape == [batch_size, n_layers, source_len]
+            self._write_attn(modal, rows, attn)
+
+        _, selected_index = model._sample_next(decoder_out)
+        # selected_index.shape == [batch_size, 1]
+
+        self.n_steps += 1
+        self.token_ids[rows, self.n_steps] = selected_index.squeeze(1)
+
+        done = (selected_index.squeeze(1) == self.eos) | (
+            self.n_steps >= self.max_len)
+        done_list = done.tolist()
+        if not any(done_list):
+            return []
+
+        finished = [(self.keys[i], self._get_word_attns(i))
+                    for i, is_done in enumerate(done_list) if is_done]
+
+        if all(done_list):
+            self._reset()
+        else:
+            self._compact(~done)
+
+        return finished
+
+    def _admit(self):
+        n_free = self.max_batch_size - len(self.keys)
+        n_new = min(n_free, len(self.pending_high) + len(self.pending))
+        if n_new <= 0:
+            return
+
+        admitted = [(self.pending_high or self.pending).popleft()
+                    for _ in range(n_new)]
+        batch = Batch([instance for _, instance in admitted])
+        batch.index_instances(self.model.vocab)
+        tensors = batch.as_tensor_dict()
+        if self.device.type == 'cuda':
+            tensors = move_to_device(tensors, self.device.index)
+
+        model = self.model
+        context = tensors['context']
+        caption = {model.index: context[model.index].new_zeros(n_new, 2)}
+        caption_ids, _, contexts = model._forward(
+            context, tensors['image'], caption, tensors['face_embeds'],
+            tensors['obj_embeds'])
+
+        token_ids = caption_ids.new_full(
+            (n_new, self.max_len + 1), model.padding_idx)
+        token_ids[:, 0] = caption_ids[:, 0]
+        n_steps = caption_ids.new_zeros(n_new)
+
+        if not self.keys:
+            self.contexts = contexts
+            self.article_ids = context[model.index]
+            self.token_ids = token_ids
+            self.n_steps = n_steps
+        else:
+            # The new captions go to the end of the batch
+            model.decoder.extend_incremental_state(
+                self.incremental_state, n_new)
+            self.contexts = merge_contexts(self.contexts, contexts)
+            self.article_ids = pad_cat(
+                [self.article_ids, context[model.index]], 1, 0,
+                model.padding_idx)
+            self.token_ids = torch.cat([self.token_ids, token_ids])
+            self.n_steps = torch.cat([self.n_steps, n_steps])
+            for modal in MODALITIES:
+                self._extend_attn(modal, n_new)
+
+        self.keys += [key for key, _ in admitted]
+        logger.info(f'Admitted {n_new} captions. '
+                    f'Batch size: {len(self.keys)}. '
+                    f'Waiting: {len(self.pending_high)} high, '
+                    f'{len(self.pending)} normal.')
+
+    def _compact(self, keep):
+        self.model.decoder.filter_incremental_state(
+            self.incremental_state, keep)
+        self.keys = [key for key, k in zip(self.keys, keep.tolist()) if k]
+        keep_idx = keep.nonzero().squeeze(1)
+        for modal in MODALITIES:
+            self.contexts[modal] = self.contexts[modal][:, keep_idx]
+            mask_key = f'{modal}_mask'
+            self.contexts[mask_key] = self.contexts[mask_key][keep_idx]
+            self.attns[modal] = self.attns[modal][keep_idx]
+            self.extra_attns[modal] = self.extra_attns[modal][keep_idx]
+        self.article_ids = self.article_ids[keep_idx]
+        self.token_ids = self.token_ids[keep_idx]
+        self.n_steps = self.n_steps[keep_idx]
+
+    def _write_attn(self, modal, rows, attn):
+        B, L, S = attn.shape
+        T = self.contexts[modal].shape[0]
+        if modal not in self.attns:
+            self.attns[modal] = attn.new_zeros(B, self.max_len, L, T)
+            self.extra_attns[modal] = attn.new_zeros(
+                B, self.max_len, L, S - T)
+        self.attns[modal][rows, self.n_steps] = attn[:, :, :T]
+        self.extra_attns[modal][rows, self.n_steps] = attn[:, :, T:]
+
+    def _extend_attn(self, modal, n_new):
+        if modal not in self.attns:
+            return
+        T = self.contexts[modal].shape[0]
+        self.attns[modal] = pad_cat(
+            [self.attns[modal], self.attns[modal].new_zeros(
+                n_new, self.max_len, self.attns[modal].shape[2], T)], 3, 0, 0)
+        extra_attns = self.extra_attns[modal]
+        self.extra_attns[modal] = torch.cat([extra_attns, extra_attns.new_zeros(
+            n_new, *extra_attns.shape[1:])])
+
+    def _get_word_attns(self, i):
+        n_steps = self.n_steps[i].item()
+        token_ids = self.token_ids[i, :n_steps + 1].tolist()
+
+        # Drop the padding that the other captions in the batch needed
+        attn_tensors = {}
+        for modal in MODALITIES:
+            n_positions = (~self.contexts[f'{modal}_mask'][i]).sum().item()
+            attn_tensors[modal] = torch.cat([
+                self.attns[modal][i, :n_steps, :, :n_positions],
+                self.extra_attns[modal][i, :n_steps],
+            ], dim=2).float().cpu()
+            # attn_tensors[modal].shape == [n_steps, n_layers, source_len]
+
+        return self.model.get_word_attns(
+            self.article_ids[i], token_ids, attn_tensors)
+
+
+def pad_cat(tensors, pad_dim, cat_dim, value):
+    """Pad the tensors to the same size along `pad_dim` and concatenate them."""
+    size = max(X.shape[pad_dim] for X in tensors)
+    padded = []
+    for X in tensors:
+        if X.shape[pad_dim] < size:
+            pad_shape = list(X.shape)
+            pad_shape[pad_dim] = size - X.shape[pad_dim]
+            X = torch.cat([X, X.new_full(pad_shape, value)], dim=pad_dim)
+        padded.append(X)
+    return torch.cat(padded, dim=cat_dim)
+
+
+def merge_contexts(contexts, new_contexts):
+    # The context embeddings have shape [seq_len, batch_size, embed_size],
+    # but the masks have shape [batch_size, seq_len].
+    merged = {
+        'sections': None,
+        'sections_mask': None,
+    }
+    for modal in MODALITIES:
+        mask_key = f'{modal}_mask'
+        merged[modal] = pad_cat(
+            [contexts[modal], new_contexts[modal]], 0, 1, 0)
+        merged[mask_key] = pad_cat(
+            [contexts[mask_key], new_contexts[mask_key]], 1, 0, True)
+    return merged
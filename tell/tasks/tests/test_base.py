@@ -0,0 +1,61 @@
+import unittest
+
+import zmq
+
+from tell.server.base import JobQueue
+from tell.server.protocol import JSON
+from tell.server.utils import Priority
+from tell.tasks.base import Worker
+
+
+class FakeSocket:
+    """A PUSH/PULL pair between the ventilator and a worker."""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_multipart(self, frames, copy=True):
+        self.messages.append(frames)
+
+    def recv_multipart(self, flags=0, copy=True):
+        if not self.messages:
+            raise zmq.Again()
+        return [zmq.Frame(f) for f in self.messages.pop(0)]
+
+
+class FakePoller:
+    def __init__(self, socks):
+        self.socks = socks
+
+    def poll(self, timeout=None):
+        return {sock: zmq.POLLIN for sock in self.socks if sock.messages}
+
+
+class TestPollJobs(unittest.TestCase):
+    def test_high_priority_job_is_served_first(self):
+        # One socket per lane, in the order of Priority.lanes
+        socks = [FakeSocket() for _ in Priority.lanes]
+        jobs = JobQueue(socks, 1, 32)
+        jobs.worker_loads[0].update(1, 0, 0)
+
+        # The first normal job takes the only credit. The next one waits in
+        # the ventilator, but the high priority job is sent at once.
+        jobs.queue(b'a#1', JSON, [b'["a1"]'], 1, Priority.normal)
+        jobs.dispatch()
+        jobs.queue(b'a#2', JSON, [b'["a2"]'], 1, Priority.normal)
+        jobs.queue(b'b#1', JSON, [b'["b1"]'], 1, Priority.high)
+        jobs.dispatch()
+        self.assertEqual(len(jobs.pending_jobs[Priority.normal]), 1)
+
+        worker = Worker(0, ['inproc://high', 'inproc://normal'], None)
+        received = worker.poll_jobs(FakePoller(socks), socks)
+        self.assertEqual(
+            [(job['client_id'], job['message'], job['priority'])
+             for job in received],
+            [(b'b#1', ['b1'], Priority.high),
+             (b'a#1', ['a1'], Priority.normal)])
+        self.assertEqual(worker.poll_jobs(FakePoller(socks), socks, 0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tell.tasks.captioner import CaptioningWorker
+
+
+class TestCacheNamespace(unittest.TestCase):
+    def test_namespace_follows_config_and_checkpoint(self):
+        with tempfile.TemporaryDirectory() as root:
+            config_path = os.path.join(root, 'config.yaml')
+            model_path = os.path.join(root, 'serialization', 'best.th')
+            module = 'tell.tasks.captioner'
+            with mock.patch(f'{module}.CONFIG_PATH', config_path), \
+                    mock.patch(f'{module}.MODEL_PATH', model_path):
+                get_namespace = CaptioningWorker.get_cache_namespace
+
+                # Without a model, there is nothing to cache
+                self.assertIsNone(get_namespace())
+                with open(config_path, 'w') as f:
+                    f.write('beam_size: 1\n')
+                self.assertIsNone(get_namespace())
+
+                os.makedirs(os.path.dirname(model_path))
+                with open(model_path, 'wb') as f:
+                    f.write(b'weights')
+                os.utime(model_path, (1000, 1000))
+                namespace = get_namespace()
+                self.assertIsNotNone(namespace)
+                self.assertEqual(get_namespace(), namespace)
+                self.assertNotEqual(get_namespace(quantize=True), namespace)
+
+                # A new checkpoint at the same path
+                with open(model_path, 'wb') as f:
+                    f.write(b'weights')
+                os.utime(model_path, (2000, 2000))
+                new_namespace = get_namespace()
+                self.assertNotEqual(new_namespace, namespace)
+
+                # A change to the config
+                with open(config_path, 'w') as f:
+                    f.write('beam_size: 4\n')
+                self.assertNotIn(get_namespace(), [namespace, new_namespace])
+
+                # The quantized checkpoint has a namespace of its own
+                int8_path = model_path.replace('best.th', 'best-int8.th')
+                with open(int8_path, 'wb') as f:
+                    f.write(b'int8 weights')
+                self.assertIn(int8_path, get_namespace(quantize=True))
+                self.assertIn(model_path, get_namespace())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+
+import numpy as np
+import torch
+from allennlp.data.dataset import Batch
+from allennlp.data.fields import ArrayField, TextField
+from allennlp.data.instance import Instance
+from allennlp.data.token_indexers import SingleIdTokenIndexer
+from allennlp.data.tokenizers import Token
+from allennlp.data.vocabulary import Vocabulary
+
+from tell.models.tests.utils import build_model
+from tell.tasks.scheduler import MODALITIES, DecodeScheduler
+
+WORDS = [f'w{i}' for i in range(20)]
+
+
+def make_instance(rs, dims):
+    tokens = [Token(w) for w in rs.choice(WORDS, rs.randint(3, 12))]
+
+    def embeds(modal, n):
+        return rs.randn(n, dims[modal]).astype(np.float32)
+
+    # Articles have different numbers of tokens, faces and objects, so the
+    # running batch needs padding.
+    return Instance({
+        'context': TextField(tokens, {'roberta': SingleIdTokenIndexer()}),
+        'image': ArrayField(embeds('image', 4)),
+        'face_embeds': ArrayField(embeds('faces', rs.randint(1, 4)),
+                                  padding_value=np.nan),
+        'obj_embeds': ArrayField(embeds('obj', rs.randint(1, 6)),
+                                 padding_value=np.nan),
+    })
+
+
+def generate_alone(model, instance):
+    batch = Batch([instance])
+    batch.index_instances(model.vocab)
+    tensors = batch.as_tensor_dict()
+    context = tensors['context']
+    caption = {model.index: context[model.index].new_zeros(1, 2)}
+    caption_ids, _, contexts = model._forward(
+        context, tensors['image'], caption, tensors['face_embeds'],
+        tensors['obj_embeds'])
+    _, token_ids, attns = model._generate(caption_ids, contexts,
+                                          capture_attns=True, all_attns=True)
+
+    # attns[step][layer][modal].shape == [1, 1, source_len]
+    attn_tensors = {
+        modal: torch.tensor(np.stack([
+            np.concatenate([layer_attns[modal][0] for layer_attns in step])
+            for step in attns]))
+        for modal in MODALITIES}
+    # attn_tensors[modal].shape == [gen_len, n_layers, source_len]
+
+    return token_ids[0].tolist(), attn_tensors
+
+
+class TestDecodeScheduler(unittest.TestCase):
+    def test_running_batch_matches_decoding_alone(self):
+        vocab = Vocabulary()
+        vocab.add_tokens_to_namespace(WORDS, 'tokens')
+
+        for conv_type in ['dynamic', 'lightweight']:
+            torch.manual_seed(0)
+            rs = np.random.RandomState(0)
+            # The article padding of SingleIdTokenIndexer is 0
+            model = build_model(vocab, conv_type, padding_value=0)
+            dims = {modal: model.decoder.layers[0].context_attns[modal].kdim
+                    for modal in MODALITIES}
+            instances = [make_instance(rs, dims) for _ in range(7)]
+
+            # Return what the scheduler passes on for each caption
+            model.get_word_attns = lambda article_ids, token_ids, attns: \
+                (token_ids, attns)
+
+            max_len = 8
+            scheduler = DecodeScheduler(model, torch.device('cpu'),
+                                        max_batch_size=3, max_len=max_len)
+            outputs = {}
+            with torch.no_grad():
+                expected = [generate_alone(model, instance)
+                            for instance in instances]
+
+                # Articles arrive while others are being decoded, so
+                # captions finish at different steps and the batch is
+                # compacted and extended.
+                for i in range(2):
+                    scheduler.add(i, instances[i])
+                for _ in range(3):
+                    outputs.update(scheduler.step())
+                for i in range(2, 6):
+                    scheduler.add(i, instances[i])
+                outputs.update(scheduler.step())
+                scheduler.add(6, instances[6], high_priority=True)
+                while scheduler.has_work():
+                    outputs.update(scheduler.step())
+
+            self.assertEqual(sorted(outputs), list(range(7)))
+            for i, (ids, attns) in outputs.items():
+                expected_ids, expected_attns = expected[i]
+                self.assertEqual(ids, expected_ids[:len(ids)], (conv_type, i))
+                self.assertTrue(len(ids) == max_len + 1 or ids[-1] == 2)
+
+                # The padding of the running batch is dropped again
+                n_steps = len(ids) - 1
+                for modal in MODALITIES:
+                    expected_attn = expected_attns[modal][:n_steps]
+                    self.assertEqual(attns[modal].shape, expected_attn.shape,
+                                     (conv_type, i, modal))
+                    self.assertTrue(torch.allclose(
+                        attns[modal], expected_attn, atol=1e-5),
+                        (conv_type, i, modal))
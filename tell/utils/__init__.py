@@ -2,4 +2,5 @@ from .functional import softmax
 from .logger import setup_logger
 from .options import eval_str_list
 from .state import get_incremental_state, set_incremental_state
-from .tensor import fill_with_neg_inf, strip_pad
+from .tensor import (fill_with_neg_inf, normalize_image, segment_mean,
+                     strip_pad)
@@ -0,0 +1,74 @@
+import functools
+import importlib
+import logging
+import os
+from argparse import Namespace
+
+import torch
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+FAIRSEQ_REPO = 'pytorch/fairseq:2f7e3f3323'
+
+# RoBERTa uses the GPT-2 BPE, and its dictionary is the GPT-2 dictionary plus
+# a <mask> token.
+BPE_URLS = {
+    'encoder.json': 'https://dl.fbaipublicfiles.com/fairseq/gpt2_bpe/encoder.json',
+    'vocab.bpe': 'https://dl.fbaipublicfiles.com/fairseq/gpt2_bpe/vocab.bpe',
+    'dict.txt': 'https://dl.fbaipublicfiles.com/fairseq/gpt2_bpe/dict.txt',
+}
+
+# Where to look for local copies of the files in BPE_URLS
+BPE_DIR = os.environ.get('TELL_BPE_DIR', 'data/roberta_bpe')
+
+
+def _import_fairseq():
+    # fairseq is not installed as a package. Instead we use the copy that
+    # torch.hub downloads. Listing the hub entrypoints imports hubconf, which
+    # in turn imports fairseq, without building any model.
+    try:
+        return importlib.import_module('fairseq')
+    except ImportError:
+        torch.hub.list(FAIRSEQ_REPO)
+        return importlib.import_module('fairseq')
+
+
+def _get_bpe_file(name, bpe_dir):
+    path = os.path.join(bpe_dir, name)
+    if os.path.exists(path):
+        return path
+    # Downloaded once and cached by fairseq
+    return BPE_URLS[name]
+
+
+@functools.lru_cache(maxsize=None)
+def get_roberta_bpe(bpe_dir: str = BPE_DIR):
+    """Get the RoBERTa BPE encoder and dictionary without loading RoBERTa.
+
+    The files are read from ``bpe_dir`` if they exist there, and are
+    downloaded otherwise. The result is shared by everyone in the process.
+
+    Returns
+    -------
+    bpe : ``fairseq.data.encoders.gpt2_bpe.GPT2BPE``
+        The same object as ``roberta.bpe``.
+    dictionary : ``fairseq.data.Dictionary``
+        The same as ``roberta.task.source_dictionary``.
+    """
+    _import_fairseq()
+    from fairseq.data import Dictionary
+    from fairseq.data.encoders.gpt2_bpe import GPT2BPE
+
+    logger.info('Loading the RoBERTa BPE.')
+    bpe = GPT2BPE(Namespace(
+        gpt2_encoder_json=_get_bpe_file('encoder.json', bpe_dir),
+        gpt2_vocab_bpe=_get_bpe_file('vocab.bpe', bpe_dir)))
+
+    dict_path = _get_bpe_file('dict.txt', bpe_dir)
+    if not os.path.exists(dict_path):
+        from fairseq.file_utils import cached_path
+        dict_path = cached_path(dict_path)
+    dictionary = Dictionary.load(dict_path)
+    dictionary.add_symbol('<mask>')
+
+    return bpe, dictionary
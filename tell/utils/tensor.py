@@ -1,3 +1,6 @@
+import torch
+
+
 def strip_pad(tensor, pad):
     return tensor[tensor.ne(pad)]
 
@@ -5,3 +8,33 @@ def strip_pad(tensor, pad):
 def fill_with_neg_inf(t):
     """FP16-compatible function that fills a tensor with -inf."""
     return t.float().fill_(float('-inf')).type_as(t)
+
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+def normalize_image(image, dtype=torch.float):
+    """Apply ToTensor and Normalize to a batch of uint8 images.
+
+    image.shape == [batch_size, 3, height, width]
+    """
+    mean = torch.tensor(IMAGENET_MEAN, dtype=dtype, device=image.device)
+    std = torch.tensor(IMAGENET_STD, dtype=dtype, device=image.device)
+    image = image.to(dtype).div_(255)
+    return image.sub_(mean.view(1, 3, 1, 1)).div_(std.view(1, 3, 1, 1))
+
+
+def segment_mean(X, segment_ids, n_segments, dim=0):
+    """Average the slices of X along `dim` that share the same segment id.
+
+    segment_ids.shape == [X.shape[dim]]
+    """
+    shape = list(X.shape)
+    shape[dim] = n_segments
+    sums = X.new_zeros(shape).index_add_(dim, segment_ids, X)
+
+    counts = torch.bincount(segment_ids, minlength=n_segments).to(X)
+    count_shape = [1] * X.dim()
+    count_shape[dim] = n_segments
+    return sums / counts.view(count_shape)